@@ -0,0 +1,195 @@
+"""Горячие копии quiz.db во время игры: DATA_DIR/backups/quiz-<время>.db.
+
+    python -m app.backup            # снять копию сейчас (сервер может работать)
+
+Копия идёт через SQLite backup API маленькими шагами по BACKUP_PAGES страниц в отдельном потоке:
+между шагами блокировка чтения отпускается, и запись ответов ждёт не дольше одного шага.
+Если базу меняют посреди копии из другого соединения, SQLite начинает её заново — тогда копия
+ждёт паузу (растёт от попытки к попытке), а шаг удваивается, но не выше BACKUP_MAX_PAGES:
+блокировку чтения по-прежнему держит один шаг, а не вся копия. После BACKUP_MAX_RESTARTS
+перезапусков подряд копия считается неудачной и ждёт следующего раза.
+
+Сервер снимает копию раз в BACKUP_INTERVAL секунд (0 — выключить) и хранит последние BACKUP_KEEP.
+
+Восстановление: остановить сервер и положить нужную копию на место DATA_DIR/quiz.db.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from app import db
+from app.metrics import Counter, Gauge, Histogram
+
+
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "900"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "24"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "64"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_MAX_PAGES = int(os.getenv("BACKUP_MAX_PAGES", "1024"))
+# Пауза после перезапуска копии: удваивается до BACKUP_RESTART_SLEEP_MAX
+BACKUP_RESTART_SLEEP = float(os.getenv("BACKUP_RESTART_SLEEP", "0.05"))
+BACKUP_RESTART_SLEEP_MAX = float(os.getenv("BACKUP_RESTART_SLEEP_MAX", "2.0"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "30"))
+
+BACKUP_SECONDS = Histogram(
+    "quiz_backup_seconds", "Полная горячая копия quiz.db", buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+BACKUP_STEP_SECONDS = Histogram("quiz_backup_step_seconds", "Один шаг backup API (держит блокировку чтения)")
+BACKUP_PAGES_PER_STEP = Gauge("quiz_backup_pages_per_step", "Страниц за шаг в конце последней копии")
+BACKUP_PAGES_TOTAL = Gauge("quiz_backup_pages", "Страниц в последней копии")
+BACKUP_RESTARTS_TOTAL = Counter("quiz_backup_restarts_total", "Копия начата заново: базу изменили посреди копирования")
+BACKUP_FAILURES_TOTAL = Counter("quiz_backup_failures_total", "Неудачные копии", ["error"])
+BACKUP_LAST_SUCCESS = Gauge("quiz_backup_last_success_timestamp", "Unix-время последней удачной копии")
+
+PREFIX = "quiz-"
+
+
+def backups_dir() -> Path:
+    # DATA_DIR читаем при вызове: бенчмарки переключают его на лету
+    return db.DATA_DIR / "backups"
+
+
+def list_backups() -> list[Path]:
+    """Копии от старых к новым (имя содержит время снятия)."""
+    return sorted(backups_dir().glob(f"{PREFIX}*.db"))
+
+
+def rotate(keep: int = BACKUP_KEEP) -> list[Path]:
+    removed = list_backups()[:-keep] if keep > 0 else []
+    for path in removed:
+        with contextlib.suppress(OSError):
+            path.unlink()
+    return removed
+
+
+class _Restarted(Exception):
+    pass
+
+
+def backup_now(
+    pages: int = BACKUP_PAGES, sleep: float = BACKUP_STEP_SLEEP, max_pages: int = BACKUP_MAX_PAGES
+) -> dict[str, Any]:
+    """Снять копию quiz.db (блокирующий вызов — из потока); возвращает путь и статистику."""
+    pages = min(pages, max_pages) if pages > 0 else max_pages
+    out = backups_dir()
+    out.mkdir(parents=True, exist_ok=True)
+    # Миллисекунды — чтобы ручная копия не затёрла плановую той же секунды
+    target = out / f"{PREFIX}{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')[:-3]}.db"
+    tmp = target.with_suffix(".tmp")
+    state = {"steps": 0, "restarts": 0, "total": 0}
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        now = time.perf_counter()
+        # Между вызовами — шаг и пауза после предыдущего; пауза блокировку не держит
+        BACKUP_STEP_SECONDS.observe(max(0.0, now - state["last"] - (sleep if state["copied"] else 0.0)))
+        state["last"] = now
+        state["steps"] += 1
+        state["total"] = total
+        copied = total - remaining
+        # Удачный шаг без продвижения — SQLite начал копию заново: базу изменили между шагами
+        if status == sqlite3.SQLITE_OK and copied <= state["copied"]:
+            state["restarts"] += 1
+            BACKUP_RESTARTS_TOTAL.inc()
+            raise _Restarted
+        state["copied"] = copied
+
+    t0 = time.perf_counter()
+    src = sqlite3.connect(db.DB_PATH)
+    dst = sqlite3.connect(tmp)
+    backoff = BACKUP_RESTART_SLEEP
+    try:
+        while True:
+            state.update(copied=0, last=time.perf_counter())
+            try:
+                src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+                break
+            except _Restarted:
+                if state["restarts"] > BACKUP_MAX_RESTARTS:
+                    raise sqlite3.OperationalError("database kept changing during backup") from None
+                # Крупнее шаг — меньше шагов, но не больше max_pages: блокировка держится один шаг.
+                # Пауза пропускает пачку записей, чтобы следующая попытка прошла между ними
+                pages = min(pages * 2, max_pages)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, BACKUP_RESTART_SLEEP_MAX)
+        if dst.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise sqlite3.DatabaseError("quick_check failed")
+    except Exception as exc:
+        BACKUP_FAILURES_TOTAL.inc(error=type(exc).__name__)
+        dst.close()
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+    finally:
+        src.close()
+    dst.close()
+    tmp.replace(target)
+    elapsed = time.perf_counter() - t0
+    BACKUP_SECONDS.observe(elapsed)
+    total = state["total"]
+    BACKUP_PAGES_TOTAL.set(total)
+    BACKUP_PAGES_PER_STEP.set(pages)
+    BACKUP_LAST_SUCCESS.set(time.time())
+    removed = rotate()
+    return {
+        "path": str(target),
+        "bytes": target.stat().st_size,
+        "pages": total,
+        "steps": state["steps"],
+        "pages_per_step": pages,
+        "restarts": state["restarts"],
+        "seconds": round(elapsed, 3),
+        "rotated": [p.name for p in removed],
+    }
+
+
+class BackupScheduler:
+    """Фоновая копия раз в interval секунд; сам backup — в потоке, event loop его не ждёт."""
+
+    def __init__(self, interval: float = BACKUP_INTERVAL) -> None:
+        self.interval = interval
+        self.last: dict[str, Any] | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last = await asyncio.to_thread(backup_now)
+            except Exception:
+                # Уже посчитано в quiz_backup_failures_total; следующая попытка — по расписанию
+                pass
+
+
+scheduler = BackupScheduler()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Горячая копия quiz.db в DATA_DIR/backups")
+    parser.add_argument("--pages", type=int, default=BACKUP_PAGES, help="страниц за шаг backup API")
+    parser.add_argument("--sleep", type=float, default=BACKUP_STEP_SLEEP, help="пауза между шагами, с")
+    parser.add_argument("--max-pages", type=int, default=BACKUP_MAX_PAGES, help="предел шага при перезапусках")
+    args = parser.parse_args()
+    result = backup_now(args.pages, args.sleep, args.max_pages)
+    print(f"{result['path']}: {result['pages']} стр. за {result['steps']} шагов, {result['seconds']} с")
+
+
+if __name__ == "__main__":
+    main()
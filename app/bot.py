@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import asyncio
 import os
+import time
+from dataclasses import dataclass
 from typing import Final
 
 from telegram import (
@@ -13,17 +15,45 @@ from telegram import (
     WebAppInfo,
     MenuButtonWebApp,
 )
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, ConversationHandler, filters
 import json
 
+from app import journal
 from app.db import get_connection, utc_now_iso
-from app.routers.hall import broadcast_to_hall
+from app.engine import DEFAULT_ROOM, QUESTION_SECONDS, GameEngine, room_name, rooms
+from app.coalesce import KeyboardEdits
+from app.dedupe import TTLSet
+from app.metrics import (
+    ANSWER_CALLBACK_SECONDS, ANSWERS_TOTAL, CALLBACK_DEDUPED_TOTAL, TELEGRAM_SEND_ERRORS, TELEGRAM_SEND_SECONDS, timed,
+)
+from app.outbox import Message, outbox
+from app.profiling import instrument_application
+from app.ratelimit import RateLimiter
+from app.routers.hall import broadcast_to_admin, broadcast_to_hall, distribution_changed, prefetch_to_hall
+from app.scoring import MAX_OPTIONS, indices_from_mask
+from app.telegram_http import TELEGRAM_POLL_POOL_SIZE, TELEGRAM_POOL_SIZE, make_request
 
 
 BOT_TOKEN: Final[str | None] = os.getenv("BOT_TOKEN")
 ADMIN_USERNAMES: Final[list[str]] = [u.strip().lower() for u in (os.getenv("ADMIN_USERNAMES", "").split(",")) if u.strip()]
 SEED_ADMIN_ID: Final[int | None] = int(os.getenv("SEED_ADMIN_ID", "0")) or None
 BASE_URL: Final[str] = os.getenv("BASE_URL", "http://localhost:8080")
+# Массовые проходы по капитанам (снятие клавиатур): параллельность и общий лимит запросов в секунду
+KEYBOARD_STRIP_CONCURRENCY: Final[int] = int(os.getenv("KEYBOARD_STRIP_CONCURRENCY", "8"))
+TELEGRAM_BULK_RATE: Final[float] = float(os.getenv("TELEGRAM_BULK_RATE", "25"))
+
+# Окно, в котором второе нажатие той же кнопки тем же капитаном считается случайным
+CALLBACK_DOUBLE_TAP_SECONDS: Final[float] = float(os.getenv("CALLBACK_DOUBLE_TAP_SECONDS", "0.4"))
+CALLBACK_DEDUPE_TTL: Final[float] = float(os.getenv("CALLBACK_DEDUPE_TTL", "600"))
+
+_bulk_limiter = RateLimiter(TELEGRAM_BULK_RATE)
+# Повторы нажатий отсекаются в памяти, до движка и Bot API (см. on_answer_callback)
+_seen_callbacks = TTLSet(CALLBACK_DEDUPE_TTL)
+_recent_taps = TTLSet(CALLBACK_DOUBLE_TAP_SECONDS)
+_answered = TTLSet(CALLBACK_DEDUPE_TTL)
+# Перерисовки клавиатуры черновика: (chat_id, message_id) -> не больше одной правки в полёте
+_keyboard_edits = KeyboardEdits()
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -35,20 +65,56 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+def _host_room(context: ContextTypes.DEFAULT_TYPE) -> GameEngine:
+    """Комната, в которой работает ведущий (см. /room); по умолчанию — основная."""
+    return rooms.get(context.user_data.get("room", DEFAULT_ROOM))
+
+
+async def choose_room(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not context.args:
+        current = context.user_data.get("room", DEFAULT_ROOM)
+        active = ", ".join(eng.room for eng in rooms.all() if eng.game_id is not None) or "нет"
+        await update.message.reply_text(
+            f"🏠 Текущая комната: <b>{current}</b>\n"
+            f"Комнаты с активной игрой: {active}\n\n"
+            "Сменить: /room <имя>",
+            parse_mode="HTML",
+        )
+        return
+    try:
+        room = room_name(context.args[0])
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    context.user_data["room"] = room
+    rooms.get(room)
+    await update.message.reply_text(
+        f"🏠 Комната: <b>{room}</b>\n"
+        "Новые игры, команды и запуск вопросов из этого чата — в ней.\n"
+        f"Экран зала комнаты: /hall?token=…&room={room}",
+        parse_mode="HTML",
+    )
+
+
 async def newgame(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not context.args:
         await update.message.reply_text("Использование: /newgame Название игры")
         return
     name = " ".join(context.args)
+    eng = _host_room(context)
     with get_connection() as conn:
-        cur = conn.execute("INSERT INTO games(name, status, current_round) VALUES (?, 'active', 1)", (name,))
+        cur = conn.execute("INSERT INTO games(name, status, current_round, room) VALUES (?, 'active', 1, ?)", (name, eng.room))
         game_id = cur.lastrowid
         conn.execute("INSERT INTO rounds(game_id, number, status) VALUES (?, 1, 'active')", (game_id,))
         conn.commit()
+    eng.reload_game()
+    stage_next(eng)
+    await prefetch_to_hall(eng)
     await update.message.reply_text(
         "🎮 Игра создана!\n\n"
         f"Название: <b>{name}</b>\n"
-        f"ID: <code>{game_id}</code>\n\n"
+        f"ID: <code>{game_id}</code>\n"
+        f"Комната: <b>{eng.room}</b>\n\n"
         "Что дальше?\n"
         "1) ➕ Добавь команды (Меню → Добавить команду)\n"
         "2) 👨‍✈️ Капитану: открыть чат с ботом → Start → /register\n"
@@ -56,7 +122,7 @@ async def newgame(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "4) ▶ Когда готов — Запустить вопрос\n",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(
-            [[InlineKeyboardButton(text="Открыть админку", web_app=WebAppInfo(url=f"{BASE_URL}/admin"))]]
+            [[InlineKeyboardButton(text="Открыть админку", web_app=WebAppInfo(url=f"{BASE_URL}/admin?room={eng.room}"))]]
         ),
     )
 
@@ -67,13 +133,16 @@ async def addteam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     team_name = context.args[0]
     captain_username = context.args[1].lstrip('@')
+    room = _host_room(context).room
     with get_connection() as conn:
-        cur = conn.execute("INSERT OR IGNORE INTO teams(name) VALUES (?)", (team_name,))
-        team_id = cur.lastrowid or conn.execute("SELECT id FROM teams WHERE name=?", (team_name,)).fetchone()[0]
+        # Название уникально только в комнате: одноимённая команда другой комнаты не затрагивается
+        conn.execute("INSERT OR IGNORE INTO teams(name, room) VALUES (?, ?)", (team_name, room))
+        team_id = conn.execute("SELECT id FROM teams WHERE room=? AND name=?", (room, team_name)).fetchone()[0]
         cur = conn.execute("INSERT OR IGNORE INTO captains(username, team_id) VALUES (?, ?)", (captain_username, team_id))
         if cur.rowcount == 0:
             conn.execute("UPDATE captains SET team_id=? WHERE username=?", (team_id, captain_username))
         conn.commit()
+    rooms.reload_captains()
     await update.message.reply_text(
         "✅ Команда добавлена!\n\n"
         f"Название: <b>{team_name}</b>\n"
@@ -96,6 +165,7 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             return
         conn.execute("UPDATE captains SET telegram_user_id=?, chat_id=? WHERE id=?", (user.id, chat.id, row["id"]))
         conn.commit()
+    rooms.reload_captains()
     await update.message.reply_text(
         "🎯 Готово! Вы зарегистрированы как капитан своей команды.\n"
         "Когда ведущий запустит вопрос — получите кнопки ответа и таймер ⏱ 60с."
@@ -113,17 +183,185 @@ def _build_answer_keyboard(question_id: int, options: list[str], multi: bool, se
     return InlineKeyboardMarkup(buttons)
 
 
-async def send_question_to_captains(game_id: int, question: dict, context: ContextTypes.DEFAULT_TYPE) -> None:
-    with get_connection() as conn:
-        caps = conn.execute("SELECT telegram_user_id, chat_id, team_id FROM captains WHERE telegram_user_id IS NOT NULL AND chat_id IS NOT NULL").fetchall()
-    text = question["text"] + "\n\n" + "\n".join(question["options"]) + ("\n\nВремя ответа: 60 секунд" )
+# ===== Подготовленные вопросы =====
+# Текст для капитанов, клавиатура и сообщение для зала собираются заранее — пока идёт
+# предыдущий вопрос, — чтобы «Следующий вопрос» сразу начинал рассылку.
+
+STAGED_MAX = 8
+
+
+@dataclass(frozen=True)
+class _Staged:
+    question: dict
+    text: str
+    keyboard: InlineKeyboardMarkup
+    hall: dict
+
+
+_staged: dict[int, _Staged] = {}
+
+
+def _question_payload(q) -> dict:
+    payload = {"id": q.id, "text": q.text, "options": q.options, "type": q.type}
+    if q.slide_url:
+        payload["image"] = q.slide_url
+    return payload
+
+
+def _stage(question: dict) -> _Staged:
+    staged = _staged.get(question["id"])
+    if staged is not None and staged.question == question:
+        return staged
     multi = question.get("type") in ("multi", "case")
-    kb = _build_answer_keyboard(question["id"], [chr(65+i) for i in range(len(question["options"]))], multi, set())
-    for c in caps:
-        try:
-            await context.bot.send_message(chat_id=c["chat_id"], text=text, reply_markup=kb)
-        except Exception:
-            continue
+    staged = _Staged(
+        question=question,
+        text=question["text"] + "\n\n" + "\n".join(question["options"]) + f"\n\nВремя ответа: {QUESTION_SECONDS} секунд",
+        keyboard=_build_answer_keyboard(question["id"], [chr(65+i) for i in range(len(question["options"]))], multi, set()),
+        hall={
+            "type": "question", "id": question["id"], "text": question["text"], "options": question["options"],
+            "seconds": QUESTION_SECONDS, **({"image": question["image"]} if question.get("image") else {}),
+        },
+    )
+    if len(_staged) >= STAGED_MAX:
+        _staged.pop(next(iter(_staged)))
+    _staged[question["id"]] = staged
+    return staged
+
+
+def stage_next(eng: GameEngine) -> None:
+    """Подготовить следующий вопрос раунда комнаты (после текущего)."""
+    q = eng.next_question()
+    if q is not None:
+        _stage(_question_payload(q))
+
+
+def send_question_to_captains(game_id: int, question: dict, room: str = DEFAULT_ROOM) -> int:
+    """Поставить вопрос всем капитанам комнаты в outbox; рассылает воркер (app.outbox), ведущий не ждёт.
+
+    Возвращает число поставленных сообщений.
+    """
+    eng = rooms.get(room)
+    staged = _stage(question)
+    payload = {"text": staged.text, "reply_markup": staged.keyboard.to_dict()}
+    live = eng.current
+    expires_at = live.deadline if live is not None and live.question_id == question["id"] else None
+    return outbox.enqueue([
+        Message(
+            "question", chat_id, payload, room=room, team_id=team_id, game_id=game_id,
+            question_id=question["id"], expires_at=expires_at,
+        )
+        for chat_id, team_id in list(eng.captain_chats)
+    ])
+
+
+# Комнаты, получившие сообщения после последнего снимка
+_delivered_rooms: set[str] = set()
+
+
+def _question_delivered(row, msg) -> None:
+    rooms.get(row["room"]).remember_message(row["question_id"], row["team_id"], row["chat_id"], msg.message_id)
+    _delivered_rooms.add(row["room"])
+
+
+def _snapshot_delivered() -> None:
+    # id сообщений — в снимок (один на разосланную пачку), чтобы после рестарта закрытие сняло клавиатуры
+    while _delivered_rooms:
+        rooms.get(_delivered_rooms.pop()).snapshot()
+
+
+outbox.on_delivered("question", _question_delivered)
+outbox.on_idle(_snapshot_delivered)
+
+
+# ===== Закрытие вопроса по дедлайну =====
+
+_close_timers: dict[str, asyncio.TimerHandle] = {}  # комната -> таймер дедлайна
+# Ссылки на фоновые задачи закрытия, чтобы их не собрал GC
+_close_tasks: set[asyncio.Task] = set()
+
+
+def _cancel_close(room: str) -> None:
+    timer = _close_timers.pop(room, None)
+    if timer is not None:
+        timer.cancel()
+
+
+def schedule_close(bot, eng: GameEngine) -> None:
+    """Закрыть текущий вопрос комнаты ровно в его дедлайн (перезапускает прежний таймер комнаты)."""
+    _cancel_close(eng.room)
+    live = eng.current
+    if live is None or live.stopped:
+        return
+    loop = asyncio.get_running_loop()
+
+    def fire() -> None:
+        _close_timers.pop(eng.room, None)
+        task = loop.create_task(close_question(bot, eng, "deadline"))
+        _close_tasks.add(task)
+        task.add_done_callback(_close_tasks.discard)
+
+    _close_timers[eng.room] = loop.call_later(max(0.0, live.deadline - time.time()), fire)
+
+
+def _retry_seconds(exc: RetryAfter) -> float:
+    retry = exc.retry_after
+    return retry.total_seconds() if hasattr(retry, "total_seconds") else float(retry)
+
+
+async def _strip_keyboards(bot, live) -> None:
+    """Снять клавиатуры у всех, кто не ответил: параллельно, но в пределах лимита Bot API."""
+    # Ответившим клавиатуру уже убрал on_answer_callback
+    targets = [msg for team_id, msg in live.messages.items() if team_id not in live.answers]
+    if not targets:
+        return
+    slots = asyncio.Semaphore(KEYBOARD_STRIP_CONCURRENCY)
+
+    async def strip(chat_id: int, message_id: int) -> bool:
+        await _keyboard_edits.settle((chat_id, message_id))
+        async with slots:
+            for _ in range(2):
+                await _bulk_limiter.acquire()
+                try:
+                    with TELEGRAM_SEND_SECONDS.time(method="editMessageReplyMarkup"):
+                        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+                    return True
+                except RetryAfter as exc:
+                    TELEGRAM_SEND_ERRORS.inc(method="editMessageReplyMarkup", error="RetryAfter")
+                    _bulk_limiter.pause(_retry_seconds(exc))
+                except Exception as exc:
+                    # Сообщение удалено или клавиатуры уже нет — не повод прерывать закрытие
+                    TELEGRAM_SEND_ERRORS.inc(method="editMessageReplyMarkup", error=type(exc).__name__)
+                    return False
+            return False
+
+    t0 = time.perf_counter()
+    done = await asyncio.gather(*(strip(chat_id, message_id) for chat_id, message_id in targets))
+    journal.record(
+        "keyboards_stripped", game_id=live.game_id, question_id=live.question_id,
+        targets=len(targets), ok=sum(done), ms=round((time.perf_counter() - t0) * 1000, 1),
+    )
+
+
+async def close_question(bot, eng: GameEngine, reason: str):
+    """Общий путь закрытия (дедлайн или «Стоп приёма»): движок, журнал, распределение в зал, клавиатуры.
+
+    Возвращает закрытый вопрос или None, если закрывать было нечего.
+    """
+    live = eng.stop()
+    if live is None:
+        return None
+    _cancel_close(eng.room)
+    journal.record("question_stop", game_id=live.game_id, question_id=live.question_id, reason=reason)
+    # Не доставленное к закрытию уже не нужно: капитан получил бы вопрос с истёкшим временем
+    outbox.expire(eng.room, live.question_id)
+    final = {"type": "distribution", "final": True, "text": "Приём ответов остановлен", **live.distribution()}
+    await broadcast_to_hall(final, eng.room)
+    await broadcast_to_admin(final, eng.room)
+    # Снятие клавиатур упирается в лимит Bot API — ведущий и таймер его не ждут
+    task = asyncio.get_running_loop().create_task(_strip_keyboards(bot, live))
+    _close_tasks.add(task)
+    task.add_done_callback(_close_tasks.discard)
+    return live
 
 
 async def begin_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -131,190 +369,179 @@ async def begin_question(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Использование: /q <question_id>")
         return
     qid = int(context.args[0])
-    with get_connection() as conn:
-        q = conn.execute("SELECT * FROM questions WHERE id=?", (qid,)).fetchone()
-        if not q:
-            await update.message.reply_text("Вопрос не найден")
-            return
-        game = conn.execute("SELECT * FROM games WHERE status='active' ORDER BY id DESC LIMIT 1").fetchone()
-        if not game:
-            await update.message.reply_text("Активная игра не найдена")
-            return
-        conn.execute("UPDATE games SET current_question_id=?, current_question_deadline=datetime('now','+60 seconds') WHERE id=?", (qid, game["id"]))
-        conn.commit()
-    opts = json.loads(q["options_json"])
-    await send_question_to_captains(game["id"], {"id": q["id"], "text": q["text"], "options": opts, "type": q.get("type", "single")}, context)
+    eng = _host_room(context)
+    q = eng.question(qid)
+    if not q:
+        await update.message.reply_text("Вопрос не найден")
+        return
+    if eng.game_id is None:
+        await update.message.reply_text("Активная игра не найдена")
+        return
+    eng.launch(q)
+    schedule_close(context.bot, eng)
+    journal.record("question_launch", game_id=eng.game_id, question_id=qid, via="id")
+    staged = _stage(_question_payload(q))
+    send_question_to_captains(eng.game_id, staged.question, eng.room)
     # Покажем вопрос и на экране зала
-    await broadcast_to_hall({"type": "question", "text": q["text"], "options": opts, "seconds": 60})
+    await broadcast_to_hall(staged.hall, eng.room)
     await update.message.reply_text(
         f"📣 Вопрос <b>{qid}</b> отправлен капитанам! ⏱ 60 сек.\n"
         "Жди ответы команд. По истечении времени нажми ‘Стоп приёма’.",
         parse_mode="HTML",
         reply_markup=_host_keyboard(),
     )
+    stage_next(eng)
+    await prefetch_to_hall(eng)
 
 
 async def begin_next_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправить следующий по порядку вопрос активного раунда без ввода ID."""
-    with get_connection() as conn:
-        game = conn.execute("SELECT * FROM games WHERE status='active' ORDER BY id DESC LIMIT 1").fetchone()
-        if not game:
-            await update.message.reply_text("Активная игра не найдена")
-            return
-        rnd = conn.execute(
-            "SELECT * FROM rounds WHERE game_id=? AND status='active' ORDER BY number DESC LIMIT 1",
-            (game["id"],),
-        ).fetchone()
-        if not rnd:
-            await update.message.reply_text("Активный раунд не найден")
-            return
-        next_q = None
-        if game["current_question_id"]:
-            cur_q = conn.execute(
-                "SELECT order_index FROM questions WHERE id=?",
-                (game["current_question_id"],),
-            ).fetchone()
-            if cur_q:
-                next_q = conn.execute(
-                    "SELECT * FROM questions WHERE round_id=? AND order_index>? ORDER BY order_index ASC LIMIT 1",
-                    (rnd["id"], cur_q["order_index"]),
-                ).fetchone()
-        if not next_q:
-            next_q = conn.execute(
-                "SELECT * FROM questions WHERE round_id=? ORDER BY order_index ASC LIMIT 1",
-                (rnd["id"],),
-            ).fetchone()
-        if not next_q:
-            await update.message.reply_text("В этом раунде нет вопросов.")
-            return
-        conn.execute(
-            "UPDATE games SET current_question_id=?, current_question_deadline=datetime('now','+60 seconds') WHERE id=?",
-            (next_q["id"], game["id"]),
-        )
-        conn.commit()
-
-    opts = json.loads(next_q["options_json"]) if next_q else []
-    await send_question_to_captains(
-        game["id"],
-        {"id": next_q["id"], "text": next_q["text"], "options": opts, "type": next_q["type"] if "type" in next_q.keys() else "single"},
-        context,
-    )
-    await broadcast_to_hall({"type": "question", "text": next_q["text"], "options": opts, "seconds": 60})
+    eng = _host_room(context)
+    if eng.game_id is None:
+        await update.message.reply_text("Активная игра не найдена")
+        return
+    if eng.round_id is None:
+        await update.message.reply_text("Активный раунд не найден")
+        return
+    next_q = eng.next_question()
+    if not next_q:
+        await update.message.reply_text("В этом раунде нет вопросов.")
+        return
+    # Обычно уже подготовлен stage_next() во время предыдущего вопроса
+    staged = _stage(_question_payload(next_q))
+    eng.launch(next_q)
+    schedule_close(context.bot, eng)
+    journal.record("question_launch", game_id=eng.game_id, question_id=next_q.id, via="next")
+
+    send_question_to_captains(eng.game_id, staged.question, eng.room)
+    await broadcast_to_hall(staged.hall, eng.room)
     await update.message.reply_text(
-        f"▶ Отправлен следующий вопрос <b>{next_q['id']}</b>. ⏱ 60 сек.",
+        f"▶ Отправлен следующий вопрос <b>{next_q.id}</b>. ⏱ 60 сек.",
         parse_mode="HTML",
         reply_markup=_host_keyboard(),
     )
+    stage_next(eng)
+    await prefetch_to_hall(eng)
 
 
 async def end_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    with get_connection() as conn:
-        game = conn.execute("SELECT * FROM games WHERE status='active' ORDER BY id DESC LIMIT 1").fetchone()
-        if not game or not game["current_question_id"]:
-            await update.message.reply_text("Текущий вопрос не активен")
-            return
-        conn.execute("UPDATE games SET current_question_deadline=datetime('now') WHERE id=?", (game["id"],))
-        conn.commit()
-    # Обновим экран зала
-    await broadcast_to_hall({"type": "results", "text": "Приём ответов остановлен"})
+    eng = _host_room(context)
+    if eng.current is None:
+        await update.message.reply_text("Текущий вопрос не активен")
+        return
+    if await close_question(context.bot, eng, "host") is None:
+        await update.message.reply_text("Приём ответов уже остановлен (время вышло).", reply_markup=_host_keyboard())
+        return
     await update.message.reply_text(
         "⛔ Приём ответов остановлен.\n"
         "✔ Можешь показать результаты в админке или запустить следующий вопрос.",
         reply_markup=InlineKeyboardMarkup(
-            [[InlineKeyboardButton(text="Открыть результаты", web_app=WebAppInfo(url=f"{BASE_URL}/admin"))]]
+            [[InlineKeyboardButton(text="Открыть результаты", web_app=WebAppInfo(url=f"{BASE_URL}/admin?room={eng.room}"))]]
         ),
     )
 
 
+@timed(ANSWER_CALLBACK_SECONDS)
 async def on_answer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     user = update.effective_user
-    await query.answer()
+    # Telegram доставил тот же callback повторно (таймаут, рестарт) — он уже обработан
+    if _seen_callbacks.seen(query.id):
+        CALLBACK_DEDUPED_TOTAL.inc(reason="redelivery")
+        return
+    # Двойное нажатие той же кнопки: второе только гасит «часики», результат покажет первое
+    if _recent_taps.seen((user.id, query.data)):
+        CALLBACK_DEDUPED_TOTAL.inc(reason="double_tap")
+        await query.answer()
+        return
     try:
         data = json.loads(query.data)
     except Exception:
+        await query.answer()
         return
     qid = data.get("qid")
     option_idx = data.get("opt")
     done = data.get("done")
-    with get_connection() as conn:
-        cap = conn.execute("SELECT * FROM captains WHERE telegram_user_id=?", (user.id,)).fetchone()
-        if not cap or not cap["team_id"]:
-            await query.edit_message_text("Вы не привязаны к команде.")
-            return
-        game = conn.execute("SELECT * FROM games WHERE status='active' ORDER BY id DESC LIMIT 1").fetchone()
-        if not game or not game["current_question_id"]:
-            await query.edit_message_text("Нет активного вопроса.")
-            return
-        if game["current_question_deadline"] and conn.execute("SELECT datetime(?) < datetime('now')", (game["current_question_deadline"],)).fetchone()[0]:
-            await query.edit_message_text("Время ответа истекло.")
+    # Всё состояние — в памяти движка комнаты капитана; в БД только фиксация (см. app.engine)
+    eng = rooms.for_captain(user.id)
+    team_id = eng.team_for(user.id) if eng is not None else None
+    if team_id is not None and (team_id, qid) in _answered:
+        # Ответ команды уже зафиксирован и сообщение обновлено — без правок сообщения
+        CALLBACK_DEDUPED_TOTAL.inc(reason="answered")
+        await query.answer("Ответ уже зафиксирован от вашей команды.")
+        return
+    await query.answer()
+    if team_id is None:
+        await query.edit_message_text("Вы не привязаны к команде.")
+        return
+    live = eng.current
+    if live is None:
+        await query.edit_message_text("Нет активного вопроса.")
+        return
+    if live.question_id != qid or live.expired():
+        journal.record("late_tap", game_id=live.game_id, question_id=qid, team_id=team_id)
+        await query.edit_message_text("Время ответа истекло.")
+        return
+    if team_id in live.answers:
+        _answered.add((team_id, qid))
+        await query.edit_message_text("Ответ уже зафиксирован от вашей команды.")
+        return
+    q_type = live.type
+    options_count = min(live.n_options, MAX_OPTIONS)
+
+    if q_type == "single":
+        if option_idx is None or not 0 <= int(option_idx) < options_count:
+            await query.edit_message_text("Выберите вариант.")
             return
-        exists = conn.execute("SELECT 1 FROM answers WHERE team_id=? AND question_id=?", (cap["team_id"], qid)).fetchone()
-        if exists:
+        idx = int(option_idx)
+        if not eng.submit(team_id, user.id, 1 << idx, idx):
+            _answered.add((team_id, qid))
             await query.edit_message_text("Ответ уже зафиксирован от вашей команды.")
             return
-        # Узнаём тип вопроса
-        q = conn.execute("SELECT * FROM questions WHERE id=?", (qid,)).fetchone()
-        q_type = (q["type"] or "single") if q else "single"
-        options_count = len(json.loads(q["options_json"])) if q else 0
-
-        if q_type == "single":
-            if option_idx is None:
-                await query.edit_message_text("Выберите вариант.")
-                return
-            conn.execute(
-                "INSERT INTO answers(game_id, question_id, team_id, captain_user_id, option_index, answered_at) VALUES (?,?,?,?,?,datetime('now'))",
-                (game["id"], qid, cap["team_id"], user.id, int(option_idx)),
-            )
-            conn.commit()
-            await query.edit_message_reply_markup(reply_markup=None)
-            await query.edit_message_text("Ответ принят. Изменение запрещено.")
-            return
+        ANSWERS_TOTAL.inc(type=q_type)
+        _answered.add((team_id, qid))
+        journal.record("answer", game_id=live.game_id, question_id=qid, team_id=team_id, type=q_type, option=idx)
+        distribution_changed(eng)
+        await query.edit_message_reply_markup(reply_markup=None)
+        await query.edit_message_text("Ответ принят. Изменение запрещено.")
+        return
 
-        # multi|case — черновики + фиксация по кнопке "Готово"
-        row = conn.execute(
-            "SELECT selections_json FROM draft_answers WHERE game_id=? AND question_id=? AND team_id=?",
-            (game["id"], qid, cap["team_id"]),
-        ).fetchone()
-        current = set(json.loads(row["selections_json"])) if row else set()
-
-        if option_idx is not None and not done:
-            idx = int(option_idx)
-            if 0 <= idx < options_count:
-                if idx in current:
-                    current.remove(idx)
-                else:
-                    current.add(idx)
-                if row:
-                    conn.execute(
-                        "UPDATE draft_answers SET selections_json=?, updated_at=datetime('now') WHERE game_id=? AND question_id=? AND team_id=?",
-                        (json.dumps(sorted(list(current))), game["id"], qid, cap["team_id"]),
-                    )
-                else:
-                    conn.execute(
-                        "INSERT INTO draft_answers(game_id, question_id, team_id, selections_json) VALUES (?,?,?,?)",
-                        (game["id"], qid, cap["team_id"], json.dumps(sorted(list(current)))),
-                    )
-                conn.commit()
-            # перерисуем клавиатуру
-            letters = [chr(65+i) for i in range(options_count)]
-            kb = _build_answer_keyboard(qid, letters, True, current)
-            await query.edit_message_reply_markup(reply_markup=kb)
-            return
+    # multi|case — черновик (битовая маска) в движке + фиксация по кнопке "Готово"
+    current = live.drafts.get(team_id, 0)
+
+    if option_idx is not None and not done:
+        idx = int(option_idx)
+        if 0 <= idx < options_count:
+            current ^= 1 << idx
+            eng.set_draft(team_id, current)
+            distribution_changed(eng)
+        # перерисуем клавиатуру: быстрые нажатия склеиваются в одну правку с последним состоянием
+        letters = [chr(65+i) for i in range(live.n_options)]
+        kb = _build_answer_keyboard(qid, letters, True, indices_from_mask(current))
+        chat_id, message_id = query.message.chat_id, query.message.message_id
+        _keyboard_edits.set(
+            (chat_id, message_id), kb,
+            lambda markup: context.bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup),
+        )
+        return
 
-        if done:
-            if not current:
-                await query.answer("Выберите хотя бы один вариант", show_alert=True)
-                return
-            conn.execute(
-                "INSERT INTO answers(game_id, question_id, team_id, captain_user_id, option_index, answered_at, option_indices_json) VALUES (?,?,?,?,?,datetime('now'),?)",
-                (game["id"], qid, cap["team_id"], user.id, -1, json.dumps(sorted(list(current)))),
-            )
-            conn.execute("DELETE FROM draft_answers WHERE game_id=? AND question_id=? AND team_id=?", (game["id"], qid, cap["team_id"]))
-            conn.commit()
-            await query.edit_message_reply_markup(reply_markup=None)
-            await query.edit_message_text("Ответ зафиксирован. Изменение запрещено.")
+    if done:
+        if not current:
+            await query.answer("Выберите хотя бы один вариант", show_alert=True)
             return
+        if not eng.submit(team_id, user.id, current):
+            _answered.add((team_id, qid))
+            await query.edit_message_text("Ответ уже зафиксирован от вашей команды.")
+            return
+        ANSWERS_TOTAL.inc(type=q_type)
+        _answered.add((team_id, qid))
+        journal.record("answer", game_id=live.game_id, question_id=qid, team_id=team_id, type=q_type, mask=current)
+        distribution_changed(eng)
+        # Запоздавшая перерисовка черновика не должна вернуть клавиатуру после фиксации
+        await _keyboard_edits.settle((query.message.chat_id, query.message.message_id))
+        await query.edit_message_reply_markup(reply_markup=None)
+        await query.edit_message_text("Ответ зафиксирован. Изменение запрещено.")
+        return
 
 
 # ===== Меню ведущего (кнопки) =====
@@ -329,6 +556,23 @@ def _is_admin(update: Update) -> bool:
     return bool(row) or (ADMIN_USERNAMES and username in ADMIN_USERNAMES)
 
 
+def _score_rows(conn, room: str) -> list:
+    """Быстрый счёт для меню ведущего: только одиночные вопросы, только команды комнаты."""
+    return conn.execute(
+        """
+        SELECT t.name AS team,
+               SUM(CASE WHEN q.type='single' AND a.option_index = q.correct_index THEN 1 ELSE 0 END) AS pts
+        FROM teams t
+        LEFT JOIN answers a ON a.team_id = t.id
+        LEFT JOIN questions q ON q.id = a.question_id
+        WHERE t.room = ?
+        GROUP BY t.name
+        ORDER BY pts DESC, team ASC
+        """,
+        (room,),
+    ).fetchall()
+
+
 def _host_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         [
@@ -361,7 +605,8 @@ async def host_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "1) ‘Новая игра’ — создать матч\n"
         "2) ‘Добавить команду’ — привязать @капитана\n"
         "3) Капитану: Start → /register\n"
-        "4) ‘Запустить вопрос’ — рассылка с таймером 60с\n",
+        "4) ‘Запустить вопрос’ — рассылка с таймером 60с\n\n"
+        f"Комната: {context.user_data.get('room', DEFAULT_ROOM)} (сменить — /room <имя>)",
         reply_markup=_host_keyboard()
     )
     return CHOOSING
@@ -394,17 +639,7 @@ async def host_choose(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CONFIRM_ACTION
     if text == "Счёт":
         with get_connection() as conn:
-            rows = conn.execute(
-                """
-                SELECT t.name AS team,
-                       SUM(CASE WHEN q.type='single' AND a.option_index = q.correct_index THEN 1 ELSE 0 END) AS pts
-                FROM teams t
-                LEFT JOIN answers a ON a.team_id = t.id
-                LEFT JOIN questions q ON q.id = a.question_id
-                GROUP BY t.name
-                ORDER BY pts DESC, team ASC
-                """
-            ).fetchall()
+            rows = _score_rows(conn, _host_room(context).room)
         lines = [f"{r['team']}: {int(r['pts'] or 0)}" for r in rows]
         await update.message.reply_text("Текущий счёт:\n" + ("\n".join(lines) if lines else "пока пусто"), reply_markup=_host_keyboard())
         return CHOOSING
@@ -416,7 +651,7 @@ async def host_choose(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Параллельно отправим кнопку-ссылку
         await update.message.reply_text(
             "Открыть экспорт:",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="Экспорт CSV", url=f"{BASE_URL}/admin/export.csv")]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="Экспорт CSV", url=f"{BASE_URL}/admin/export.csv?room={_host_room(context).room}")]])
         )
         return CHOOSING
     if text == "Админ‑панель":
@@ -424,24 +659,25 @@ async def host_choose(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Кнопка, открывающая веб внутри Telegram (Web App)
         await update.message.reply_text(
             "Открыть админку во встроенном окне:",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="Открыть /admin", web_app=WebAppInfo(url=f"{BASE_URL}/admin"))]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="Открыть /admin", web_app=WebAppInfo(url=f"{BASE_URL}/admin?room={_host_room(context).room}"))]])
         )
         # Дополнительно обычная ссылка на случай, если клиент без WebApp
         await update.message.reply_text(
             "Если кнопка не открывается, нажми ссылку:",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="/admin (ссылка)", url=f"{BASE_URL}/admin")]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="/admin (ссылка)", url=f"{BASE_URL}/admin?room={_host_room(context).room}")]])
         )
         return CHOOSING
     if text == "Экран зала":
         hall_token = os.getenv("HALL_TOKEN", "quiz2024")
+        hall_url = f"{BASE_URL}/hall?token={hall_token}&room={_host_room(context).room}"
         await update.message.reply_text("Экран зала:", reply_markup=_host_keyboard())
         await update.message.reply_text(
             "Открыть экран зала во встроенном окне:",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="Открыть /hall", web_app=WebAppInfo(url=f"{BASE_URL}/hall?token={hall_token}"))]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="Открыть /hall", web_app=WebAppInfo(url=hall_url))]])
         )
         await update.message.reply_text(
             "Если кнопка не открывается, нажми ссылку:",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="/hall (ссылка)", url=f"{BASE_URL}/hall?token={hall_token}")]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(text="/hall (ссылка)", url=hall_url)]])
         )
         return CHOOSING
     if text == "Админы":
@@ -561,7 +797,14 @@ async def host_confirm_action(update: Update, context: ContextTypes.DEFAULT_TYPE
 def build_application() -> Application | None:
     if not BOT_TOKEN:
         return None
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Рассылки и правки — свой пул, getUpdates — свой: long polling не занимает соединения отправки
+        .request(make_request("send", TELEGRAM_POOL_SIZE))
+        .get_updates_request(make_request("updates", TELEGRAM_POLL_POOL_SIZE))
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     # Команды бэкап
     app.add_handler(CommandHandler("newgame", newgame))
@@ -570,6 +813,7 @@ def build_application() -> Application | None:
     app.add_handler(CommandHandler("q", begin_question))
     app.add_handler(CommandHandler("next", begin_next_question))
     app.add_handler(CommandHandler("stop", end_question))
+    app.add_handler(CommandHandler("room", choose_room))
     app.add_handler(CallbackQueryHandler(on_answer_callback))
 
     # Меню ведущего
@@ -587,17 +831,26 @@ def build_application() -> Application | None:
         fallbacks=[MessageHandler(filters.Regex("^(Отмена|Назад)$"), host_choose)],
     )
     app.add_handler(conv)
+    instrument_application(app)
     return app
 
 
 async def run_polling(app: Application) -> None:
     await app.initialize()
     await app.start()
+    # Рассылка из outbox, включая недоставленное до рестарта
+    outbox.start(app.bot)
+    # Вопросы, открытые до рестарта, закроются по своим дедлайнам (или сразу, если те прошли)
+    for eng in rooms.all():
+        schedule_close(app.bot, eng)
+        stage_next(eng)
+        await prefetch_to_hall(eng)
     try:
         await app.updater.start_polling()
         # Работает, пока не отменят
         await asyncio.Event().wait()
     finally:
+        await outbox.stop()
         await app.updater.stop()
         await app.stop()
         await app.shutdown()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
+
+from telegram.error import BadRequest, RetryAfter
+
+from app.metrics import KEYBOARD_EDITS_SKIPPED_TOTAL, TELEGRAM_SEND_ERRORS, TELEGRAM_SEND_SECONDS
+
+
+_UNSET = object()
+
+
+@dataclass
+class _Slot:
+    desired: Any = _UNSET
+    sent: Any = _UNSET
+    task: asyncio.Task | None = None
+    # Ждущие settle(): разбудить, когда правки по сообщению закончатся
+    waiters: list[asyncio.Future] = field(default_factory=list)
+
+
+class KeyboardEdits:
+    """Склейка перерисовок клавиатуры одного сообщения.
+
+    Хранится только последняя желаемая клавиатура; на сообщение не больше одного запроса
+    в полёте. Пока он идёт, новые нажатия лишь заменяют желаемое состояние, а после ответа
+    уходит сразу последнее — промежуточные не отправляются вовсе. Правка, совпадающая с
+    уже отправленной клавиатурой, пропускается.
+    """
+
+    def __init__(self) -> None:
+        self._slots: dict[Hashable, _Slot] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def set(self, key: Hashable, markup: Any, send: Callable[[Any], Awaitable[Any]]) -> None:
+        """Запросить клавиатуру markup для сообщения key; send(markup) выполняет саму правку."""
+        slot = self._slots.setdefault(key, _Slot())
+        if slot.desired is not _UNSET:
+            KEYBOARD_EDITS_SKIPPED_TOTAL.inc(reason="superseded")
+        slot.desired = markup
+        if slot.task is None:
+            slot.task = asyncio.get_running_loop().create_task(self._flush(key, slot, send))
+
+    async def _flush(self, key: Hashable, slot: _Slot, send: Callable[[Any], Awaitable[Any]]) -> None:
+        try:
+            while slot.desired is not _UNSET:
+                markup, slot.desired = slot.desired, _UNSET
+                if slot.sent is not _UNSET and markup == slot.sent:
+                    KEYBOARD_EDITS_SKIPPED_TOTAL.inc(reason="unchanged")
+                    continue
+                try:
+                    with TELEGRAM_SEND_SECONDS.time(method="editMessageReplyMarkup"):
+                        await send(markup)
+                except RetryAfter as exc:
+                    TELEGRAM_SEND_ERRORS.inc(method="editMessageReplyMarkup", error="RetryAfter")
+                    # Повторим после паузы, если за это время не пришло состояние новее
+                    if slot.desired is _UNSET:
+                        slot.desired = markup
+                    retry = exc.retry_after
+                    await asyncio.sleep(retry.total_seconds() if hasattr(retry, "total_seconds") else float(retry))
+                    continue
+                except BadRequest as exc:
+                    # «message is not modified» — на экране уже то, что нужно
+                    if "not modified" not in str(exc).lower():
+                        TELEGRAM_SEND_ERRORS.inc(method="editMessageReplyMarkup", error=type(exc).__name__)
+                        continue
+                except Exception as exc:
+                    TELEGRAM_SEND_ERRORS.inc(method="editMessageReplyMarkup", error=type(exc).__name__)
+                    continue
+                slot.sent = markup
+        finally:
+            slot.task = None
+            for waiter in slot.waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            slot.waiters.clear()
+
+    async def settle(self, key: Hashable) -> None:
+        """Отменить ещё не отправленные правки сообщения и дождаться той, что уже в полёте.
+
+        Вызывается перед финальной правкой (ответ зафиксирован, вопрос закрыт), чтобы
+        запоздавшая перерисовка не вернула клавиатуру поверх неё.
+        """
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        if slot.desired is not _UNSET:
+            KEYBOARD_EDITS_SKIPPED_TOTAL.inc(reason="superseded")
+            slot.desired = _UNSET
+        if slot.task is not None:
+            waiter = asyncio.get_running_loop().create_future()
+            slot.waiters.append(waiter)
+            await waiter
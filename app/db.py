@@ -1,243 +1,509 @@
 from __future__ import annotations
 
+import contextlib
 import os
 import sqlite3
+import time
 from pathlib import Path
 from datetime import datetime, timezone
+from typing import Any, Callable, Iterator
+
+from app.metrics import DB_QUERY_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows — локальная разработка, один процесс
+    fcntl = None
 
 
 DATA_DIR = Path(os.getenv("DATA_DIR", str(Path(__file__).resolve().parent.parent / "data")))
 DB_PATH = DATA_DIR / "quiz.db"
 
 
+class _InstrumentedConnection(sqlite3.Connection):
+    """Соединение, которое пишет длительность execute/commit в quiz_db_query_seconds."""
+
+    def execute(self, *args: Any) -> sqlite3.Cursor:
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - t0, op="execute")
+
+    def commit(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - t0, op="commit")
+
+
 def get_connection() -> sqlite3.Connection:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, factory=_InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+# ===== Миграции схемы =====
+# Каждый шаг — функция над соединением внутри общей транзакции. Никаких executescript:
+# он неявно коммитит. ALTER TABLE ADD COLUMN — только через _add_column (идемпотентно).
+
+
+def _exec_script(conn: sqlite3.Connection, script: str) -> None:
+    """Выполнить несколько SQL-выражений по одному, не выходя из текущей транзакции."""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    existing = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migrate_v1(conn: sqlite3.Connection) -> None:
+    pass
+
+
+def _migrate_v2(conn: sqlite3.Connection) -> None:
+    # Основные таблицы: игры, раунды, команды, капитаны, вопросы, ответы
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'draft', -- draft|active|finished
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            current_round INTEGER,
+            current_question_id INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS rounds (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            number INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending|active|finished
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS teams (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+
+        CREATE TABLE IF NOT EXISTS captains (
+            id INTEGER PRIMARY KEY,
+            telegram_user_id INTEGER NOT NULL UNIQUE,
+            username TEXT,
+            team_id INTEGER UNIQUE,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE SET NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY,
+            round_id INTEGER NOT NULL,
+            order_index INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            options_json TEXT NOT NULL, -- JSON массив строк
+            correct_index INTEGER NOT NULL,
+            slide_url TEXT,
+            FOREIGN KEY (round_id) REFERENCES rounds(id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            captain_user_id INTEGER NOT NULL,
+            option_index INTEGER NOT NULL,
+            answered_at TEXT NOT NULL DEFAULT (datetime('now')),
+            UNIQUE (team_id, question_id),
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
+            FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_rounds_game ON rounds(game_id);
+        CREATE INDEX IF NOT EXISTS idx_questions_round ON questions(round_id);
+        CREATE INDEX IF NOT EXISTS idx_answers_question ON answers(question_id);
+        CREATE INDEX IF NOT EXISTS idx_answers_team ON answers(team_id);
+        """,
+    )
+
+
+def _migrate_v3(conn: sqlite3.Connection) -> None:
+    # Поддержка кейсов (мультивыбор + веса)
+    _add_column(conn, "questions", "type", "TEXT NOT NULL DEFAULT 'single'")
+    _add_column(conn, "questions", "correct_indices_json", "TEXT")
+    _add_column(conn, "questions", "scoring_weights_json", "TEXT")
+    _add_column(conn, "answers", "option_indices_json", "TEXT")
+
+
+def _migrate_v4(conn: sqlite3.Connection) -> None:
+    # Очки, дедлайн вопроса и чат капитана
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS scores (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            points REAL NOT NULL DEFAULT 0,
+            UNIQUE (game_id, team_id),
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
+        );
+        """,
+    )
+    _add_column(conn, "games", "current_question_deadline", "TEXT")
+    _add_column(conn, "captains", "chat_id", "INTEGER")
+
+
+def _migrate_v5(conn: sqlite3.Connection) -> None:
+    # Таблица админов
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY,
+            telegram_user_id INTEGER UNIQUE,
+            username TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_admins_username ON admins(lower(username));
+        """,
+    )
+
+
+def _migrate_v6(conn: sqlite3.Connection) -> None:
+    # Черновики ответов для мультивыбора (кейсы)
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS draft_answers (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            selections_json TEXT NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+            UNIQUE (team_id, question_id),
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
+            FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
+        );
+        """,
+    )
+
+
+def _migrate_v7(conn: sqlite3.Connection) -> None:
+    # Исправление схемы captains — telegram_user_id допускает NULL (заполняется при /register)
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS captains_new (
+            id INTEGER PRIMARY KEY,
+            telegram_user_id INTEGER UNIQUE,
+            username TEXT,
+            team_id INTEGER UNIQUE,
+            chat_id INTEGER,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE SET NULL
+        );
+        INSERT INTO captains_new(id, telegram_user_id, username, team_id, chat_id)
+        SELECT id, telegram_user_id, username, team_id, chat_id FROM captains;
+        DROP TABLE captains;
+        ALTER TABLE captains_new RENAME TO captains;
+        """,
+    )
+
+
+def _migrate_v8(conn: sqlite3.Connection) -> None:
+    # Мультивыбор хранится битовой маской (бит i — вариант i), JSON — только представления
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS answers_new (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            captain_user_id INTEGER NOT NULL,
+            option_index INTEGER NOT NULL,
+            option_mask INTEGER NOT NULL DEFAULT 0,
+            answered_at TEXT NOT NULL DEFAULT (datetime('now')),
+            UNIQUE (team_id, question_id),
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
+            FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
+        );
+        INSERT INTO answers_new(id, game_id, question_id, team_id, captain_user_id, option_index, option_mask, answered_at)
+        SELECT id, game_id, question_id, team_id, captain_user_id, option_index,
+               (SELECT COALESCE(SUM(DISTINCT 1 << value), 0) FROM json_each(COALESCE(option_indices_json, '[]'))
+                WHERE value BETWEEN 0 AND 25),
+               answered_at
+        FROM answers;
+        DROP TABLE answers;
+        ALTER TABLE answers_new RENAME TO answers;
+        CREATE INDEX IF NOT EXISTS idx_answers_question ON answers(question_id);
+        CREATE INDEX IF NOT EXISTS idx_answers_team ON answers(team_id);
+
+        CREATE TABLE IF NOT EXISTS draft_answers_new (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            selections_mask INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+            UNIQUE (team_id, question_id),
+            FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
+            FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
+            FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
+        );
+        INSERT INTO draft_answers_new(id, game_id, question_id, team_id, selections_mask, updated_at)
+        SELECT id, game_id, question_id, team_id,
+               (SELECT COALESCE(SUM(DISTINCT 1 << value), 0) FROM json_each(COALESCE(selections_json, '[]'))
+                WHERE value BETWEEN 0 AND 25),
+               updated_at
+        FROM draft_answers;
+        DROP TABLE draft_answers;
+        ALTER TABLE draft_answers_new RENAME TO draft_answers;
+
+        -- Совместимость: прежние JSON-колонки как представления над масками
+        CREATE VIEW IF NOT EXISTS answers_json AS
+        SELECT a.*,
+               CASE WHEN a.option_mask = 0 THEN NULL ELSE (
+                 WITH RECURSIVE bits(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM bits WHERE i < 25)
+                 SELECT json_group_array(i) FROM bits WHERE (a.option_mask >> i) & 1
+               ) END AS option_indices_json
+        FROM answers a;
+
+        CREATE VIEW IF NOT EXISTS draft_answers_json AS
+        SELECT d.*,
+               (
+                 WITH RECURSIVE bits(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM bits WHERE i < 25)
+                 SELECT json_group_array(i) FROM bits WHERE (d.selections_mask >> i) & 1
+               ) AS selections_json
+        FROM draft_answers d;
+        """,
+    )
+
+
+def _migrate_v9(conn: sqlite3.Connection) -> None:
+    # Журнал событий игры (app.journal): только дописывается, без внешних ключей — переживает удаление игр.
+    # mono_us сравним только внутри одного процесса (pid), wall_us — для людей
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            mono_us INTEGER NOT NULL,
+            wall_us INTEGER NOT NULL,
+            pid INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            game_id INTEGER,
+            question_id INTEGER,
+            team_id INTEGER,
+            chat_id INTEGER,
+            data_json TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_events_question ON events(question_id, kind);
+        CREATE INDEX IF NOT EXISTS idx_events_kind ON events(kind, id);
+        """,
+    )
+
+
+def _migrate_v10(conn: sqlite3.Connection) -> None:
+    # Журнал и снимки игрового движка (app.engine); журнал сжимается после каждого снимка
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS engine_journal (
+            -- AUTOINCREMENT: после сжатия журнал пуст, а seq не должен начинаться заново
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            payload_json TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        CREATE TABLE IF NOT EXISTS engine_snapshots (
+            seq INTEGER PRIMARY KEY,
+            state_json TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        """,
+    )
+
+
+def _migrate_v11(conn: sqlite3.Connection) -> None:
+    # Комнаты: несколько одновременных игр на одном развёртывании. Всё прежнее — в комнате 'main'
+    _add_column(conn, "games", "room", "TEXT NOT NULL DEFAULT 'main'")
+    _add_column(conn, "engine_journal", "room", "TEXT NOT NULL DEFAULT 'main'")
+    # У снимков ключ (room, seq): seq общий на все комнаты, но снимок «с нуля» бывает у каждой
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS engine_snapshots_new (
+            room TEXT NOT NULL DEFAULT 'main',
+            seq INTEGER NOT NULL,
+            state_json TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (room, seq)
+        );
+        INSERT INTO engine_snapshots_new(seq, state_json, created_at)
+        SELECT seq, state_json, created_at FROM engine_snapshots;
+        DROP TABLE engine_snapshots;
+        ALTER TABLE engine_snapshots_new RENAME TO engine_snapshots;
+        -- Название команды уникально в своей комнате: одноимённые команды разных комнат — разные команды
+        CREATE TABLE IF NOT EXISTS teams_new (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            room TEXT NOT NULL DEFAULT 'main',
+            UNIQUE (room, name)
+        );
+        INSERT INTO teams_new(id, name) SELECT id, name FROM teams;
+        DROP TABLE teams;
+        ALTER TABLE teams_new RENAME TO teams;
+        CREATE INDEX IF NOT EXISTS idx_games_room ON games(room, status, id);
+        CREATE INDEX IF NOT EXISTS idx_engine_journal_room ON engine_journal(room, seq);
+        """,
+    )
+
+
+def _migrate_v12(conn: sqlite3.Connection) -> None:
+    # Распределение ответов по вариантам на момент закрытия вопроса (app.engine.GameEngine.stop)
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS question_distributions (
+            id INTEGER PRIMARY KEY,
+            room TEXT NOT NULL DEFAULT 'main',
+            game_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            answered INTEGER NOT NULL,
+            counts_json TEXT NOT NULL,
+            drafts_json TEXT NOT NULL,
+            closed_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_question_distributions_question ON question_distributions(question_id, id);
+        """,
+    )
+
+
+def _migrate_v13(conn: sqlite3.Connection) -> None:
+    # Исходящие сообщения Bot API (app.outbox): ставятся в очередь, доставляются воркером с повторами
+    _exec_script(
+        conn,
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT NOT NULL DEFAULT 'main',
+            kind TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            team_id INTEGER,
+            game_id INTEGER,
+            question_id INTEGER,
+            payload_json TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL DEFAULT 0,
+            expires_at REAL,
+            message_id INTEGER,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_at) WHERE status = 'pending';
+        CREATE INDEX IF NOT EXISTS idx_outbox_question ON outbox(room, question_id, status);
+        """,
+    )
+
+
+# Номер версии = позиция в списке; новые шаги — только в конец
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+    _migrate_v10,
+    _migrate_v11,
+    _migrate_v12,
+    _migrate_v13,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT version FROM schema_meta WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:  # schema_meta ещё нет — пустая БД
+        return 0
+    return row[0] if row else 0
+
+
+@contextlib.contextmanager
+def _migration_lock() -> Iterator[None]:
+    """Межпроцессная блокировка: воркеры uvicorn не мигрируют БД одновременно."""
+    if fcntl is None:
+        yield
+        return
+    with open(DATA_DIR / "quiz.db.migrate.lock", "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
 def init_db() -> None:
-    """Инициализация БД и создание основной схемы викторины."""
+    """Инициализация БД: применяет недостающие миграции одной транзакцией; на актуальной схеме — одно чтение версии."""
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with get_connection() as conn:
-        # Версия схемы
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS schema_meta (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                version INTEGER NOT NULL
-            )
-            """
-        )
-        cur = conn.execute("SELECT version FROM schema_meta WHERE id = 1")
-        row = cur.fetchone()
-        current_version = row["version"] if row else 0
-
-        # Миграции по версиям
-        if current_version < 1:
-            conn.execute("INSERT OR REPLACE INTO schema_meta (id, version) VALUES (1, 1)")
-
-        if current_version < 2:
-            # Основные таблицы: игры, раунды, команды, капитаны, вопросы, ответы
-            conn.executescript(
-                """
-                PRAGMA foreign_keys = ON;
-
-                CREATE TABLE IF NOT EXISTS games (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'draft', -- draft|active|finished
-                    created_at TEXT NOT NULL DEFAULT (datetime('now')),
-                    current_round INTEGER,
-                    current_question_id INTEGER
-                );
-
-                CREATE TABLE IF NOT EXISTS rounds (
-                    id INTEGER PRIMARY KEY,
-                    game_id INTEGER NOT NULL,
-                    number INTEGER NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'pending', -- pending|active|finished
-                    FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE
-                );
-
-                CREATE TABLE IF NOT EXISTS teams (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL UNIQUE
-                );
-
-                CREATE TABLE IF NOT EXISTS captains (
-                    id INTEGER PRIMARY KEY,
-                    telegram_user_id INTEGER NOT NULL UNIQUE,
-                    username TEXT,
-                    team_id INTEGER UNIQUE,
-                    FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE SET NULL
-                );
-
-                CREATE TABLE IF NOT EXISTS questions (
-                    id INTEGER PRIMARY KEY,
-                    round_id INTEGER NOT NULL,
-                    order_index INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    options_json TEXT NOT NULL, -- JSON массив строк
-                    correct_index INTEGER NOT NULL,
-                    slide_url TEXT,
-                    FOREIGN KEY (round_id) REFERENCES rounds(id) ON DELETE CASCADE
-                );
-
-                CREATE TABLE IF NOT EXISTS answers (
-                    id INTEGER PRIMARY KEY,
-                    game_id INTEGER NOT NULL,
-                    question_id INTEGER NOT NULL,
-                    team_id INTEGER NOT NULL,
-                    captain_user_id INTEGER NOT NULL,
-                    option_index INTEGER NOT NULL,
-                    answered_at TEXT NOT NULL DEFAULT (datetime('now')),
-                    UNIQUE (team_id, question_id),
-                    FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
-                    FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
-                    FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
-                );
-
-                CREATE INDEX IF NOT EXISTS idx_rounds_game ON rounds(game_id);
-                CREATE INDEX IF NOT EXISTS idx_questions_round ON questions(round_id);
-                CREATE INDEX IF NOT EXISTS idx_answers_question ON answers(question_id);
-                CREATE INDEX IF NOT EXISTS idx_answers_team ON answers(team_id);
-                """
-            )
-            conn.execute("UPDATE schema_meta SET version = 2 WHERE id = 1")
-
-        conn.commit()
-
-        # v3: поддержка кейсов (мультивыбор + веса)
-        if current_version < 3:
-            # Добавляем поля к вопросам
-            try:
-                conn.execute("ALTER TABLE questions ADD COLUMN type TEXT NOT NULL DEFAULT 'single'")
-            except sqlite3.OperationalError:
-                pass
-            try:
-                conn.execute("ALTER TABLE questions ADD COLUMN correct_indices_json TEXT")
-            except sqlite3.OperationalError:
-                pass
-            try:
-                conn.execute("ALTER TABLE questions ADD COLUMN scoring_weights_json TEXT")
-            except sqlite3.OperationalError:
-                pass
-
-            # Добавляем поле для хранения множественного выбора ответа (опционально)
-            try:
-                conn.execute("ALTER TABLE answers ADD COLUMN option_indices_json TEXT")
-            except sqlite3.OperationalError:
-                pass
-
-            conn.execute("UPDATE schema_meta SET version = 3 WHERE id = 1")
-            conn.commit()
-
-        # v4: очки, дедлайн вопроса и чат капитана
-        cur = conn.execute("SELECT version FROM schema_meta WHERE id = 1")
-        row = cur.fetchone()
-        current_version = row["version"] if row else 0
-        if current_version < 4:
+    conn = get_connection()
+    try:
+        if _schema_version(conn) >= SCHEMA_VERSION:
+            return
+        with _migration_lock():
+            # Пока ждали блокировку, другой воркер мог уже всё применить
+            current_version = _schema_version(conn)
+            if current_version >= SCHEMA_VERSION:
+                return
+            conn.isolation_level = None
+            # Пересборка таблиц (v7, v8) — без внешних ключей; внутри транзакции pragma не действует, поэтому до BEGIN
+            conn.execute("PRAGMA foreign_keys = OFF")
+            conn.execute("BEGIN IMMEDIATE")
             try:
                 conn.execute(
                     """
-                    CREATE TABLE IF NOT EXISTS scores (
-                        id INTEGER PRIMARY KEY,
-                        game_id INTEGER NOT NULL,
-                        team_id INTEGER NOT NULL,
-                        points REAL NOT NULL DEFAULT 0,
-                        UNIQUE (game_id, team_id),
-                        FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
-                        FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
-                    );
+                    CREATE TABLE IF NOT EXISTS schema_meta (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version INTEGER NOT NULL
+                    )
                     """
                 )
-            except sqlite3.OperationalError:
-                pass
-            try:
-                conn.execute("ALTER TABLE games ADD COLUMN current_question_deadline TEXT")
-            except sqlite3.OperationalError:
-                pass
-            try:
-                conn.execute("ALTER TABLE captains ADD COLUMN chat_id INTEGER")
-            except sqlite3.OperationalError:
-                pass
-            conn.execute("UPDATE schema_meta SET version = 4 WHERE id = 1")
-            conn.commit()
-
-        # v5: таблица админов
-        cur = conn.execute("SELECT version FROM schema_meta WHERE id = 1")
-        row = cur.fetchone()
-        current_version = row["version"] if row else 0
-        if current_version < 5:
-            conn.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS admins (
-                    id INTEGER PRIMARY KEY,
-                    telegram_user_id INTEGER UNIQUE,
-                    username TEXT,
-                    created_at TEXT NOT NULL DEFAULT (datetime('now'))
-                );
-                CREATE INDEX IF NOT EXISTS idx_admins_username ON admins(lower(username));
-                """
-            )
-            conn.execute("UPDATE schema_meta SET version = 5 WHERE id = 1")
-            conn.commit()
-
-        # v6: черновики ответов для мультивыбора (кейсы)
-        cur = conn.execute("SELECT version FROM schema_meta WHERE id = 1")
-        row = cur.fetchone()
-        current_version = row["version"] if row else 0
-        if current_version < 6:
-            conn.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS draft_answers (
-                    id INTEGER PRIMARY KEY,
-                    game_id INTEGER NOT NULL,
-                    question_id INTEGER NOT NULL,
-                    team_id INTEGER NOT NULL,
-                    selections_json TEXT NOT NULL,
-                    updated_at TEXT NOT NULL DEFAULT (datetime('now')),
-                    UNIQUE (team_id, question_id),
-                    FOREIGN KEY (game_id) REFERENCES games(id) ON DELETE CASCADE,
-                    FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
-                    FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE CASCADE
-                );
-                """
-            )
-            conn.execute("UPDATE schema_meta SET version = 6 WHERE id = 1")
-            conn.commit()
-
-        # v7: исправление схемы captains — telegram_user_id допускает NULL (заполняется при /register)
-        cur = conn.execute("SELECT version FROM schema_meta WHERE id = 1")
-        row = cur.fetchone()
-        current_version = row["version"] if row else 0
-        if current_version < 7:
-            # Пере-создадим таблицу, сохраним данные
-            conn.executescript(
-                """
-                PRAGMA foreign_keys=OFF;
-                CREATE TABLE IF NOT EXISTS captains_new (
-                    id INTEGER PRIMARY KEY,
-                    telegram_user_id INTEGER UNIQUE,
-                    username TEXT,
-                    team_id INTEGER UNIQUE,
-                    chat_id INTEGER,
-                    FOREIGN KEY (team_id) REFERENCES teams(id) ON DELETE SET NULL
-                );
-                INSERT INTO captains_new(id, telegram_user_id, username, team_id, chat_id)
-                SELECT id, telegram_user_id, username, team_id, chat_id FROM captains;
-                DROP TABLE captains;
-                ALTER TABLE captains_new RENAME TO captains;
-                PRAGMA foreign_keys=ON;
-                """
-            )
-            conn.execute("UPDATE schema_meta SET version = 7 WHERE id = 1")
-            conn.commit()
+                for version, migrate in enumerate(MIGRATIONS, start=1):
+                    if version > current_version:
+                        migrate(conn)
+                conn.execute("INSERT OR REPLACE INTO schema_meta (id, version) VALUES (1, ?)", (SCHEMA_VERSION,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-
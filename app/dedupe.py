@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TTLSet:
+    """Множество ключей, каждый живёт ttl секунд; не больше maxsize (старые вытесняются первыми).
+
+    ttl общий, поэтому порядок вставки совпадает с порядком истечения: просроченные
+    ключи всегда в начале, и вытеснение не сканирует всё множество.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 100_000) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._expires: OrderedDict[Hashable, float] = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        expires = self._expires
+        while expires:
+            key, deadline = next(iter(expires.items()))
+            if deadline > now and len(expires) <= self.maxsize:
+                break
+            expires.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        deadline = self._expires.get(key)
+        return deadline is not None and deadline > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def add(self, key: Hashable) -> None:
+        now = time.monotonic()
+        self._expires[key] = now + self.ttl
+        self._expires.move_to_end(key)
+        self._evict(now)
+
+    def seen(self, key: Hashable) -> bool:
+        """True — ключ уже был в пределах ttl (повтор); иначе запомнить его и вернуть False."""
+        if key in self:
+            return True
+        self.add(key)
+        return False
@@ -0,0 +1,553 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from app import db
+from app.metrics import Counter, Gauge, Histogram
+from app.scoring import MAX_OPTIONS
+
+
+# Состояние живой игры в памяти процесса: активная игра и раунд, порядок вопросов, капитаны,
+# текущий вопрос с дедлайном, ответами и черновиками. Обработчики бота читают только его.
+#
+# Каждое изменение — одна транзакция: строка в engine_journal + проекция в обычные таблицы
+# (games, answers), которые читают админка и подсчёт очков. Память меняется только после commit.
+# Периодический снимок в engine_snapshots сжимает журнал; после рестарта recover() = снимок + хвост.
+#
+# Игры идут в комнатах (games.room, teams.room): у каждой комнаты свой GameEngine со своим журналом
+# и снимками, все запросы движка ограничены его комнатой. Реестр rooms находит комнату капитана.
+
+SNAPSHOT_EVERY = int(os.getenv("ENGINE_SNAPSHOT_EVERY", "200"))
+SNAPSHOTS_KEEP = 3
+QUESTION_SECONDS = 60
+DEFAULT_ROOM = "main"
+_ROOM_RE = re.compile(r"^[\w-]{1,32}$")
+
+ENGINE_OPS_TOTAL = Counter("quiz_engine_ops_total", "Операции журнала игрового движка", ["op"])
+ENGINE_SNAPSHOT_SECONDS = Histogram("quiz_engine_snapshot_seconds", "Запись снимка состояния движка")
+ENGINE_RECOVERY_SECONDS = Gauge("quiz_engine_recovery_seconds", "Длительность последнего восстановления движка")
+
+
+@dataclass(frozen=True)
+class QuestionInfo:
+    id: int
+    round_id: int
+    order_index: int
+    text: str
+    options: list[str]
+    type: str
+    slide_url: str | None = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "QuestionInfo":
+        return cls(
+            id=row["id"],
+            round_id=row["round_id"],
+            order_index=row["order_index"],
+            text=row["text"],
+            options=json.loads(row["options_json"]),
+            type=row["type"] or "single",
+            slide_url=row["slide_url"],
+        )
+
+    @property
+    def multi(self) -> bool:
+        return self.type in ("multi", "case")
+
+
+@dataclass
+class LiveQuestion:
+    """Запущенный вопрос. answers/drafts: team_id -> битовая маска вариантов (для single — 1 << индекс).
+
+    counts — сколько зафиксированных ответов содержит каждый вариант, draft_counts — то же по черновикам;
+    оба ведутся по мере ответов и нажатий, без пересчёта.
+    messages — team_id -> (chat_id, message_id) разосланных вопросов, чтобы снять клавиатуры при закрытии.
+    """
+
+    question_id: int
+    game_id: int
+    type: str
+    n_options: int
+    deadline: float  # unix-время
+    stopped: bool = False
+    answers: dict[int, int] = field(default_factory=dict)
+    drafts: dict[int, int] = field(default_factory=dict)
+    messages: dict[int, tuple[int, int]] = field(default_factory=dict)
+    counts: list[int] = field(init=False)
+    draft_counts: list[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * self.n_options
+        self.draft_counts = [0] * self.n_options
+        for mask in self.answers.values():
+            self._count(self.counts, mask, 1)
+        for mask in self.drafts.values():
+            self._count(self.draft_counts, mask, 1)
+
+    def _count(self, counts: list[int], mask: int, delta: int) -> None:
+        for i in range(min(self.n_options, MAX_OPTIONS)):
+            if (mask >> i) & 1:
+                counts[i] += delta
+
+    def add_answer(self, team_id: int, mask: int) -> None:
+        if team_id not in self.answers:
+            self._count(self.counts, mask, 1)
+        self.answers[team_id] = mask
+        draft = self.drafts.pop(team_id, 0)
+        self._count(self.draft_counts, draft, -1)
+
+    def set_draft(self, team_id: int, mask: int) -> None:
+        # Нажатие меняет один бит: считаем только разницу со старым черновиком
+        old = self.drafts.get(team_id, 0)
+        self._count(self.draft_counts, old & ~mask, -1)
+        self._count(self.draft_counts, mask & ~old, 1)
+        self.drafts[team_id] = mask
+
+    def expired(self, now: float | None = None) -> bool:
+        return self.stopped or (now if now is not None else time.time()) > self.deadline
+
+    def distribution(self) -> dict[str, Any]:
+        return {
+            "question_id": self.question_id,
+            "labels": [chr(65 + i) for i in range(self.n_options)],
+            "counts": list(self.counts),
+            "answered": len(self.answers),
+            "drafts": list(self.draft_counts),
+            "drafting": len(self.drafts),
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "question_id": self.question_id,
+            "game_id": self.game_id,
+            "type": self.type,
+            "n_options": self.n_options,
+            "deadline": self.deadline,
+            "stopped": self.stopped,
+            "answers": self.answers,
+            "drafts": self.drafts,
+            "messages": self.messages,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "LiveQuestion":
+        return cls(
+            question_id=data["question_id"],
+            game_id=data["game_id"],
+            type=data["type"],
+            n_options=data["n_options"],
+            deadline=data["deadline"],
+            stopped=data["stopped"],
+            # JSON превращает ключи в строки
+            answers={int(k): v for k, v in data["answers"].items()},
+            drafts={int(k): v for k, v in data["drafts"].items()},
+            messages={int(k): tuple(v) for k, v in data.get("messages", {}).items()},
+        )
+
+
+def room_name(raw: str | None) -> str:
+    """Имя комнаты из запроса/команды: пусто — комната по умолчанию; ValueError — недопустимое имя."""
+    name = (raw or "").strip().lower() or DEFAULT_ROOM
+    if not _ROOM_RE.match(name):
+        raise ValueError("Имя комнаты: до 32 букв, цифр, '_' или '-'")
+    return name
+
+
+class GameEngine:
+    def __init__(self, room: str = DEFAULT_ROOM) -> None:
+        self.room = room
+        self.game_id: int | None = None
+        self.round_id: int | None = None
+        self.current: LiveQuestion | None = None
+        self.questions: dict[int, QuestionInfo] = {}
+        self.round_order: dict[int, list[int]] = {}
+        self._position: dict[int, int] = {}  # question_id -> позиция в round_order своего раунда
+        self.captains: dict[int, int] = {}  # telegram_user_id -> team_id
+        self.captain_chats: list[tuple[int, int]] = []  # (chat_id, team_id)
+        self.seq = 0
+        self._since_snapshot = 0
+        self._conn: sqlite3.Connection | None = None
+
+    # ===== Соединение и журнал =====
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.get_connection()
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _write(self, op: str, payload: dict[str, Any], sql: str | None = None, params: tuple = ()) -> None:
+        """Проекция + запись журнала одной транзакцией, затем применение к памяти."""
+        conn = self._db()
+        try:
+            if sql:
+                conn.execute(sql, params)
+            cur = conn.execute(
+                "INSERT INTO engine_journal(room, op, payload_json) VALUES (?, ?, ?)", (self.room, op, json.dumps(payload))
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.seq = cur.lastrowid
+        self._apply(op, payload)
+        ENGINE_OPS_TOTAL.inc(op=op)
+        self._since_snapshot += 1
+        if self._since_snapshot >= SNAPSHOT_EVERY:
+            self.snapshot()
+
+    def _apply(self, op: str, p: dict[str, Any]) -> None:
+        cur = self.current
+        if op == "game":
+            self.game_id = p["game_id"]
+            self.current = None
+        elif op == "launch":
+            self.current = LiveQuestion(
+                question_id=p["question_id"],
+                game_id=p["game_id"],
+                type=p["type"],
+                n_options=p["n_options"],
+                deadline=p["deadline"],
+                answers={int(k): v for k, v in p.get("prior", {}).items()},
+            )
+        elif cur is None or cur.question_id != p["question_id"]:
+            return  # операция над уже сменившимся вопросом
+        elif op == "stop":
+            cur.stopped = True
+            cur.deadline = min(cur.deadline, p["at"])
+        elif op == "draft":
+            cur.set_draft(p["team_id"], p["mask"])
+        elif op == "answer":
+            cur.add_answer(p["team_id"], p["mask"])
+
+    def snapshot(self) -> None:
+        state = {"game_id": self.game_id, "current": self.current.to_dict() if self.current else None}
+        conn = self._db()
+        with ENGINE_SNAPSHOT_SECONDS.time():
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO engine_snapshots(room, seq, state_json) VALUES (?, ?, ?)",
+                    (self.room, self.seq, json.dumps(state)),
+                )
+                conn.execute("DELETE FROM engine_journal WHERE room = ? AND seq <= ?", (self.room, self.seq))
+                conn.execute(
+                    """
+                    DELETE FROM engine_snapshots WHERE room = ? AND seq NOT IN (
+                        SELECT seq FROM engine_snapshots WHERE room = ? ORDER BY seq DESC LIMIT ?
+                    )
+                    """,
+                    (self.room, self.room, SNAPSHOTS_KEEP),
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        self._since_snapshot = 0
+
+    # ===== Восстановление и справочные данные =====
+
+    def recover(self) -> None:
+        """Снимок + хвост журнала; при первом запуске без журнала — из таблиц games/answers/draft_answers."""
+        self.close()
+        conn = self._db()
+        self.game_id, self.current, self.seq = None, None, 0
+        snap = conn.execute(
+            "SELECT seq, state_json FROM engine_snapshots WHERE room = ? ORDER BY seq DESC LIMIT 1", (self.room,)
+        ).fetchone()
+        if snap is not None:
+            state = json.loads(snap["state_json"])
+            self.seq = snap["seq"]
+            self.game_id = state["game_id"]
+            self.current = LiveQuestion.from_dict(state["current"]) if state["current"] else None
+        tail = conn.execute(
+            "SELECT seq, op, payload_json FROM engine_journal WHERE room = ? AND seq > ? ORDER BY seq", (self.room, self.seq)
+        ).fetchall()
+        for row in tail:
+            self._apply(row["op"], json.loads(row["payload_json"]))
+            self.seq = row["seq"]
+        if snap is None and not tail:
+            self._bootstrap(conn)
+        self._load_captains(conn)
+        # Игру могли сменить в обход движка (старые версии, ручные правки) — сверяемся с БД
+        self.reload_game()
+        self.snapshot()
+
+    def _bootstrap(self, conn: sqlite3.Connection) -> None:
+        game = conn.execute(
+            """
+            SELECT id, current_question_id, CAST(strftime('%s', current_question_deadline) AS REAL) AS deadline
+            FROM games WHERE room = ? AND status='active' ORDER BY id DESC LIMIT 1
+            """,
+            (self.room,),
+        ).fetchone()
+        if game is None:
+            return
+        self.game_id = game["id"]
+        q = self.question(game["current_question_id"]) if game["current_question_id"] else None
+        if q is None:
+            return
+        self.current = LiveQuestion(
+            question_id=q.id,
+            game_id=game["id"],
+            type=q.type,
+            n_options=len(q.options),
+            deadline=game["deadline"] or 0.0,
+            answers=self._stored_answers(conn, q.id),
+            drafts={
+                r["team_id"]: r["selections_mask"]
+                for r in conn.execute("SELECT team_id, selections_mask FROM draft_answers WHERE question_id=?", (q.id,))
+            },
+        )
+
+    @staticmethod
+    def _stored_answers(conn: sqlite3.Connection, question_id: int) -> dict[int, int]:
+        rows = conn.execute("SELECT team_id, option_index, option_mask FROM answers WHERE question_id=?", (question_id,))
+        return {
+            r["team_id"]: r["option_mask"] or (1 << r["option_index"] if 0 <= r["option_index"] < MAX_OPTIONS else 0)
+            for r in rows
+        }
+
+    def _load_captains(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute(
+            """
+            SELECT c.telegram_user_id, c.chat_id, c.team_id FROM captains c JOIN teams t ON t.id = c.team_id
+            WHERE c.telegram_user_id IS NOT NULL AND t.room = ?
+            """,
+            (self.room,),
+        ).fetchall()
+        self.captains = {r["telegram_user_id"]: r["team_id"] for r in rows if r["team_id"]}
+        self.captain_chats = [(r["chat_id"], r["team_id"]) for r in rows if r["chat_id"] is not None]
+
+    def _load_game(self, conn: sqlite3.Connection) -> None:
+        self.questions, self.round_order, self._position, self.round_id = {}, {}, {}, None
+        if self.game_id is None:
+            return
+        rows = conn.execute(
+            """
+            SELECT q.* FROM questions q JOIN rounds r ON r.id = q.round_id
+            WHERE r.game_id = ? ORDER BY q.round_id, q.order_index
+            """,
+            (self.game_id,),
+        ).fetchall()
+        for row in rows:
+            q = QuestionInfo.from_row(row)
+            self.questions[q.id] = q
+            order = self.round_order.setdefault(q.round_id, [])
+            self._position[q.id] = len(order)
+            order.append(q.id)
+        rnd = conn.execute(
+            "SELECT id FROM rounds WHERE game_id=? AND status='active' ORDER BY number DESC LIMIT 1", (self.game_id,)
+        ).fetchone()
+        self.round_id = rnd["id"] if rnd else None
+
+    def reload_captains(self) -> None:
+        """После /register, /addteam и правок капитанов."""
+        self._load_captains(self._db())
+
+    def reload_game(self) -> None:
+        """После создания игры или добавления вопросов: активной становится последняя активная игра."""
+        conn = self._db()
+        game = conn.execute(
+            "SELECT id FROM games WHERE room = ? AND status='active' ORDER BY id DESC LIMIT 1", (self.room,)
+        ).fetchone()
+        game_id = game["id"] if game else None
+        if game_id != self.game_id:
+            self._write("game", {"game_id": game_id})
+        self._load_game(conn)
+
+    # ===== Чтение =====
+
+    def question(self, question_id: int) -> QuestionInfo | None:
+        q = self.questions.get(question_id)
+        if q is None:
+            # /q <id> допускает вопрос вне активной игры (но в своей комнате) — редкий путь ведущего
+            row = self._db().execute(
+                """
+                SELECT q.* FROM questions q JOIN rounds r ON r.id = q.round_id JOIN games g ON g.id = r.game_id
+                WHERE q.id = ? AND g.room = ?
+                """,
+                (question_id, self.room),
+            ).fetchone()
+            q = QuestionInfo.from_row(row) if row else None
+        return q
+
+    def team_for(self, telegram_user_id: int) -> int | None:
+        return self.captains.get(telegram_user_id)
+
+    def next_question(self, after: int | None = None) -> QuestionInfo | None:
+        """Следующий по order_index в активном раунде после after (по умолчанию — текущего); после последнего — снова первый."""
+        order = self.round_order.get(self.round_id or -1) or []
+        if not order:
+            return None
+        if after is None and self.current is not None:
+            after = self.current.question_id
+        idx = 0
+        if after is not None and self.questions.get(after) is not None and self.questions[after].round_id == self.round_id:
+            idx = (self._position[after] + 1) % len(order)
+        return self.questions[order[idx]]
+
+    def upcoming(self, n: int) -> list[QuestionInfo]:
+        """До n вопросов раунда, которые пойдут после текущего; на последнем вопросе раунда — пусто."""
+        order = self.round_order.get(self.round_id or -1) or []
+        start = 0
+        cur = self.questions.get(self.current.question_id) if self.current is not None else None
+        if cur is not None and cur.round_id == self.round_id:
+            start = self._position[cur.id] + 1
+        return [self.questions[qid] for qid in order[start:start + max(n, 0)]]
+
+    # ===== Изменения =====
+
+    def launch(self, q: QuestionInfo, seconds: int = QUESTION_SECONDS) -> LiveQuestion:
+        if self.game_id is None:
+            raise LookupError("Активная игра не найдена")
+        deadline = time.time() + seconds
+        payload = {
+            "game_id": self.game_id,
+            "question_id": q.id,
+            "type": q.type,
+            "n_options": len(q.options),
+            "deadline": deadline,
+            # Повторный запуск того же вопроса: уже ответившие команды остаются ответившими
+            "prior": self._stored_answers(self._db(), q.id),
+        }
+        self._write(
+            "launch",
+            payload,
+            "UPDATE games SET current_question_id=?, current_question_deadline=datetime(?, 'unixepoch') WHERE id=?",
+            (q.id, deadline, self.game_id),
+        )
+        self.snapshot()
+        return self.current
+
+    def stop(self) -> LiveQuestion | None:
+        """Закрыть приём. None — закрывать нечего (нет вопроса или уже закрыт)."""
+        cur = self.current
+        if cur is None or cur.stopped:
+            return None
+        now = time.time()
+        self._write(
+            "stop",
+            {"question_id": cur.question_id, "at": now},
+            "UPDATE games SET current_question_deadline=datetime(?, 'unixepoch') WHERE id=?",
+            (now, cur.game_id),
+        )
+        # Итоговое распределение — в БД: после закрытия его читают админка и отчёты
+        dist = cur.distribution()
+        conn = self._db()
+        conn.execute(
+            """
+            INSERT INTO question_distributions(room, game_id, question_id, answered, counts_json, drafts_json)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (self.room, cur.game_id, cur.question_id, dist["answered"], json.dumps(dist["counts"]), json.dumps(dist["drafts"])),
+        )
+        conn.commit()
+        self.snapshot()
+        return cur
+
+    def set_draft(self, team_id: int, mask: int) -> None:
+        cur = self.current
+        self._write("draft", {"question_id": cur.question_id, "team_id": team_id, "mask": mask})
+
+    def submit(self, team_id: int, captain_user_id: int, mask: int, option_index: int = -1) -> bool:
+        """Зафиксировать ответ команды на текущий вопрос. False — ответ уже был (в т.ч. гонка с UNIQUE)."""
+        cur = self.current
+        try:
+            self._write(
+                "answer",
+                {"question_id": cur.question_id, "team_id": team_id, "mask": mask},
+                "INSERT INTO answers(game_id, question_id, team_id, captain_user_id, option_index, answered_at, option_mask) "
+                "VALUES (?,?,?,?,?,datetime('now'),?)",
+                # одиночный выбор хранится индексом, мультивыбор — маской (как раньше)
+                (cur.game_id, cur.question_id, team_id, captain_user_id, option_index, 0 if option_index >= 0 else mask),
+            )
+        except sqlite3.IntegrityError:
+            # В БД ответ уже есть, а в памяти — нет: подтягиваем сохранённый, чтобы counts сходились
+            stored = self._stored_answers(self._db(), cur.question_id)
+            cur.add_answer(team_id, stored.get(team_id, mask))
+            return False
+        return True
+
+    def remember_message(self, question_id: int, team_id: int, chat_id: int, message_id: int) -> None:
+        """Запомнить разосланное сообщение (без журнала: попадёт в ближайший снимок)."""
+        cur = self.current
+        if cur is not None and cur.question_id == question_id:
+            cur.messages[team_id] = (chat_id, message_id)
+
+
+class Rooms:
+    """Движки всех комнат процесса и привязка капитанов к комнатам.
+
+    Комната появляется при первом обращении (get) и восстанавливается из своего журнала.
+    """
+
+    def __init__(self) -> None:
+        self._engines: dict[str, GameEngine] = {}
+        self._captain_room: dict[int, str] = {}  # telegram_user_id -> комната
+
+    def get(self, room: str = DEFAULT_ROOM) -> GameEngine:
+        eng = self._engines.get(room)
+        if eng is None:
+            eng = GameEngine(room)
+            eng.recover()
+            self._engines[room] = eng
+            self._index_captains()
+        return eng
+
+    def find(self, room: str) -> GameEngine | None:
+        """Уже поднятая комната или None — в отличие от get, движок не создаётся."""
+        return self._engines.get(room)
+
+    def all(self) -> list[GameEngine]:
+        return list(self._engines.values())
+
+    def for_captain(self, telegram_user_id: int) -> GameEngine | None:
+        room = self._captain_room.get(telegram_user_id)
+        return self._engines.get(room) if room is not None else None
+
+    def recover(self) -> None:
+        """Поднять все комнаты, в которых есть игры, команды или снимки; комната по умолчанию — всегда."""
+        t0 = time.perf_counter()
+        self.close()
+        with db.get_connection() as conn:
+            rows = conn.execute(
+                "SELECT room FROM games UNION SELECT room FROM teams UNION SELECT room FROM engine_snapshots"
+            ).fetchall()
+        self._engines = {}
+        for name in sorted({DEFAULT_ROOM, *(r["room"] for r in rows)}):
+            eng = GameEngine(name)
+            eng.recover()
+            self._engines[name] = eng
+        self._index_captains()
+        ENGINE_RECOVERY_SECONDS.set(time.perf_counter() - t0)
+
+    def reload_captains(self) -> None:
+        """После /register, /addteam и правок капитанов: команду могли перенести в другую комнату."""
+        with db.get_connection() as conn:
+            names = [r["room"] for r in conn.execute("SELECT DISTINCT room FROM teams")]
+        for name in names:
+            if name not in self._engines:
+                self.get(name)
+        for eng in self._engines.values():
+            eng.reload_captains()
+        self._index_captains()
+
+    def _index_captains(self) -> None:
+        self._captain_room = {uid: eng.room for eng in self._engines.values() for uid in eng.captains}
+
+    def close(self) -> None:
+        for eng in self._engines.values():
+            eng.close()
+
+
+rooms = Rooms()
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Any
+
+from app import db
+from app.metrics import LOOP_LAG_LAST, Gauge
+
+
+# Проверки готовности считает фоновая задача раз в HEALTH_INTERVAL секунд; /readyz отдаёт
+# готовый результат, поэтому частые пробы не трогают ни БД, ни бота.
+
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "5"))
+# Лаг event loop выше порога — процесс жив, но отвечать в срок не успевает
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "1.0"))
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", "2.0"))
+
+HEALTH_CHECK_OK = Gauge("quiz_health_check_ok", "Результат последней проверки готовности (1 — в порядке)", ["check"])
+
+
+def _ping_db() -> float:
+    t0 = time.perf_counter()
+    conn = db.get_connection()
+    try:
+        conn.execute("SELECT 1").fetchone()
+    finally:
+        conn.close()
+    return time.perf_counter() - t0
+
+
+class HealthChecker:
+    def __init__(self, interval: float = HEALTH_INTERVAL) -> None:
+        self.interval = interval
+        self.state: Any = None
+        self.checks: dict[str, dict[str, Any]] = {}
+        self.checked_at: float | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self, state: Any) -> None:
+        """state — app.state: оттуда берётся задача бота (_tg_task)."""
+        self.state = state
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self) -> None:
+        checks = {"db": await self._check_db(), "bot": self._check_bot(), "ws": self._check_ws(), "loop": self._check_loop()}
+        for name, check in checks.items():
+            HEALTH_CHECK_OK.set(1 if check["ok"] else 0, check=name)
+        self.checks = checks
+        self.checked_at = time.time()
+
+    async def _check_db(self) -> dict[str, Any]:
+        # В потоке и с таймаутом: занятая запись не должна подвешивать проверку и event loop
+        try:
+            seconds = await asyncio.wait_for(asyncio.to_thread(_ping_db), HEALTH_DB_TIMEOUT)
+        except Exception as exc:
+            return {"ok": False, "error": type(exc).__name__}
+        return {"ok": True, "ms": round(seconds * 1000, 1)}
+
+    def _check_bot(self) -> dict[str, Any]:
+        task = getattr(self.state, "_tg_task", None)
+        if task is None:
+            # Режим обслуживания или нет BOT_TOKEN — бот не запускался, и это не ошибка
+            return {"ok": True, "state": "disabled"}
+        if not task.done():
+            return {"ok": True, "state": "running"}
+        if task.cancelled():
+            return {"ok": False, "state": "cancelled"}
+        exc = task.exception()
+        return {"ok": False, "state": "crashed" if exc is not None else "stopped", **({"error": type(exc).__name__} if exc else {})}
+
+    def _check_ws(self) -> dict[str, Any]:
+        from app.routers.hall import ws_manager
+
+        return {"ok": True, "connections": ws_manager.count(), "rooms": ws_manager.counts()}
+
+    def _check_loop(self) -> dict[str, Any]:
+        lag = LOOP_LAG_LAST.value()
+        return {"ok": lag <= HEALTH_MAX_LOOP_LAG, "lag_ms": round(lag * 1000, 1)}
+
+    def report(self) -> tuple[bool, dict[str, Any]]:
+        """Готовность по последней проверке; устаревшая проверка (задача не крутится) — не готов."""
+        if self.checked_at is None:
+            return False, {"status": "starting", "checks": {}}
+        age = time.time() - self.checked_at
+        stale = age > 3 * self.interval + HEALTH_DB_TIMEOUT
+        ready = not stale and all(check["ok"] for check in self.checks.values())
+        return ready, {
+            "status": "ready" if ready else ("stale" if stale else "degraded"),
+            "age_s": round(age, 1),
+            "checks": self.checks,
+        }
+
+
+checker = HealthChecker()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from app.db import get_connection
+from app.metrics import Counter, Gauge, Histogram
+
+
+# Журнал хронологии игры: запуск вопроса, доставка капитанам, ответы, стоп, показ в зале.
+# record() только кладёт кортеж в очередь — запись в SQLite пачками делает отдельный поток,
+# поэтому путь ответа капитана не ждёт диска.
+
+JOURNAL_BATCH = int(os.getenv("JOURNAL_BATCH", "500"))
+JOURNAL_QUEUE_MAX = int(os.getenv("JOURNAL_QUEUE_MAX", "100000"))
+
+JOURNAL_EVENTS_TOTAL = Counter("quiz_journal_events_total", "События, принятые в журнал", ["kind"])
+JOURNAL_DROPPED_TOTAL = Counter("quiz_journal_dropped_total", "События, отброшенные из-за переполнения очереди журнала")
+JOURNAL_QUEUE = Gauge("quiz_journal_queue", "События в очереди журнала на момент последней записи")
+JOURNAL_FLUSH_SECONDS = Histogram("quiz_journal_flush_seconds", "Запись пачки событий журнала в SQLite")
+
+_INSERT = (
+    "INSERT INTO events(mono_us, wall_us, pid, kind, game_id, question_id, team_id, chat_id, data_json) "
+    "VALUES (?,?,?,?,?,?,?,?,?)"
+)
+
+
+class EventJournal:
+    def __init__(self) -> None:
+        self._queue: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._pid = os.getpid()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._writer, name="event-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Дописать очередь и остановить поток."""
+        if not self.running:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def record(
+        self,
+        kind: str,
+        *,
+        game_id: int | None = None,
+        question_id: int | None = None,
+        team_id: int | None = None,
+        chat_id: int | None = None,
+        **data: Any,
+    ) -> None:
+        """Неблокирующая запись события; время берётся в момент вызова. Без запущенного писателя — no-op."""
+        if self._thread is None:
+            return
+        if self._queue.qsize() >= JOURNAL_QUEUE_MAX:
+            JOURNAL_DROPPED_TOTAL.inc()
+            return
+        self._queue.put((
+            time.monotonic_ns() // 1000,
+            time.time_ns() // 1000,
+            self._pid,
+            kind,
+            game_id,
+            question_id,
+            team_id,
+            chat_id,
+            json.dumps(data, ensure_ascii=False) if data else None,
+        ))
+        JOURNAL_EVENTS_TOTAL.inc(kind=kind)
+
+    def _writer(self) -> None:
+        conn = get_connection()
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                batch = []
+                while True:
+                    if item is None:
+                        stopping = True
+                    else:
+                        batch.append(item)
+                    if stopping or len(batch) >= JOURNAL_BATCH:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                JOURNAL_QUEUE.set(self._queue.qsize())
+                if batch:
+                    self._flush(conn, batch)
+        finally:
+            conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, batch: list[tuple]) -> None:
+        with JOURNAL_FLUSH_SECONDS.time():
+            try:
+                conn.executemany(_INSERT, batch)
+                conn.commit()
+            except sqlite3.Error:
+                # Журнал — вспомогательный: потерянную пачку считаем, игру не останавливаем
+                conn.rollback()
+                JOURNAL_DROPPED_TOTAL.inc(len(batch))
+
+
+journal = EventJournal()
+record = journal.record
+
+
+# ===== Чтение для разбора после игры =====
+
+
+def _row_to_event(row: sqlite3.Row) -> dict[str, Any]:
+    event = dict(row)
+    raw = event.pop("data_json")
+    event["data"] = json.loads(raw) if raw else {}
+    return event
+
+
+def list_events(
+    conn: sqlite3.Connection,
+    kind: str | None = None,
+    question_id: int | None = None,
+    game_id: int | None = None,
+    after_id: int = 0,
+    limit: int = 500,
+) -> list[dict[str, Any]]:
+    where, params = ["id > ?"], [after_id]
+    for column, value in (("kind", kind), ("question_id", question_id), ("game_id", game_id)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    rows = conn.execute(
+        f"SELECT * FROM events WHERE {' AND '.join(where)} ORDER BY id LIMIT ?", (*params, limit)
+    ).fetchall()
+    return [_row_to_event(r) for r in rows]
+
+
+def _spread(offsets_us: list[int]) -> dict[str, Any] | None:
+    if not offsets_us:
+        return None
+    ordered = sorted(offsets_us)
+
+    def at(share: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] / 1000, 1)
+
+    return {"count": len(ordered), "first_ms": at(0), "p50_ms": at(0.5), "p95_ms": at(0.95), "last_ms": at(1)}
+
+
+def question_timeline(conn: sqlite3.Connection, question_id: int) -> dict[str, Any] | None:
+    """Задержки последнего запуска вопроса: доставка, ответы, стоп и показ в зале — в мс от запуска."""
+    launch = conn.execute(
+        "SELECT * FROM events WHERE question_id = ? AND kind = 'question_launch' ORDER BY id DESC LIMIT 1",
+        (question_id,),
+    ).fetchone()
+    if launch is None:
+        return None
+    # mono_us сравним только внутри процесса, запустившего вопрос; окно — до следующего запуска
+    next_launch = conn.execute(
+        "SELECT MIN(id) FROM events WHERE id > ? AND pid = ? AND kind = 'question_launch'",
+        (launch["id"], launch["pid"]),
+    ).fetchone()[0]
+    rows = conn.execute(
+        """
+        SELECT kind, mono_us FROM events
+        WHERE id > ? AND id < ? AND pid = ? AND (question_id = ? OR question_id IS NULL)
+        ORDER BY id
+        """,
+        (launch["id"], next_launch or 2**63 - 1, launch["pid"], question_id),
+    ).fetchall()
+    t0 = launch["mono_us"]
+    offsets: dict[str, list[int]] = {}
+    for r in rows:
+        offsets.setdefault(r["kind"], []).append(r["mono_us"] - t0)
+    return {
+        "question_id": question_id,
+        "game_id": launch["game_id"],
+        "launched_at_us": launch["wall_us"],
+        **{kind: _spread(values) for kind, values in sorted(offsets.items())},
+    }
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from pathlib import Path
+from typing import Any
+
+from app.metrics import Counter, LOOP_LAG_LAST, LOOP_LAG_SECONDS
+
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+# Шаг event loop дольше порога — сэмплируем стек из сторожевого потока
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "100"))
+SLOW_TRACE_BUFFER = int(os.getenv("SLOW_TRACE_BUFFER", "100"))
+
+SLOW_CALLBACKS_TOTAL = Counter("quiz_slow_callbacks_total", "Шаги event loop дольше SLOW_CALLBACK_MS", ["handler"])
+
+_APP_DIR = Path(__file__).resolve().parent
+# Служебные кадры в стеке (обёртки, сам монитор) — не обработчики
+_SKIP_FILES = {_APP_DIR / "loop_monitor.py", _APP_DIR / "main.py", _APP_DIR / "metrics.py", _APP_DIR / "profiling.py"}
+
+
+def _handler_label(frame: traceback.FrameSummary) -> str | None:
+    """bot:on_answer_callback, admin:admin_final_results, ws:broadcast_json — или None для чужого кода."""
+    path = Path(frame.filename).resolve()
+    if path in _SKIP_FILES or _APP_DIR not in path.parents:
+        return None
+    module = path.stem
+    if module == "websocket_manager":
+        module = "ws"
+    return f"{module}:{frame.name}"
+
+
+class LoopMonitor:
+    """Лаг event loop + трассы зависаний: сторожевой поток видит, что heartbeat не пришёл вовремя,
+    и снимает стек потока event loop прямо во время долгого шага."""
+
+    def __init__(self, threshold_ms: float = SLOW_CALLBACK_MS, buffer_size: int = SLOW_TRACE_BUFFER) -> None:
+        self.threshold = threshold_ms / 1000
+        self.interval = min(LOOP_LAG_INTERVAL, self.threshold / 2)
+        self.traces: deque[dict[str, Any]] = deque(maxlen=buffer_size)
+        self._tick = 0
+        self._last_tick = time.monotonic()
+        self._sampled_tick = -1
+        self._pending: dict[str, Any] | None = None
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self._tick += 1
+            self._last_tick = time.monotonic()
+            LOOP_LAG_SECONDS.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                pending["duration_ms"] = round(lag * 1000, 1)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 4):
+            tick = self._tick
+            stalled = time.monotonic() - self._last_tick - self.interval
+            if stalled > self.threshold and tick != self._sampled_tick:
+                self._sampled_tick = tick
+                self._sample(stalled)
+
+    def _sample(self, stalled: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        labels = [label for label in map(_handler_label, stack) if label]
+        handler = labels[0] if labels else "unknown"
+        trace = {
+            "at": time.time(),
+            "handler": handler,
+            "where": labels[-1] if labels else None,
+            "stalled_ms": round(stalled * 1000, 1),
+            "duration_ms": None,  # заполнит heartbeat, когда шаг закончится
+            "stack": [f"{Path(f.filename).name}:{f.lineno} {f.name}" for f in stack[-30:]],
+        }
+        self.traces.append(trace)
+        self._pending = trace
+        SLOW_CALLBACKS_TOTAL.inc(handler=handler)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """Трассы, новые первыми."""
+        return list(reversed(self.traces))
+
+
+monitor = LoopMonitor()
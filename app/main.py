@@ -2,36 +2,64 @@ from __future__ import annotations
 
 import asyncio
 import contextlib
-from pathlib import Path
 
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
 
 from app.db import init_db
-from app.bot import build_application, run_polling
+from app import slides
+from app.backup import scheduler as backup_scheduler
+from app.engine import rooms
+from app.health import checker as health_checker
+from app.journal import journal
+from app.page_cache import CachedStaticFiles, STATIC_DIR
 from app.routers import admin as admin_router
 from app.routers import hall as hall_router
+from app.routers import ops as ops_router
+from app.loop_monitor import monitor as loop_monitor
+from app.profiling import ProfilingMiddleware
 
 
 app = FastAPI(title="Викторина")
+# Профилирование по заявке из /admin/profiling; выключенное — одна проверка на запрос
+app.add_middleware(ProfilingMiddleware)
 
 
 # Роуты
 app.include_router(hall_router.router)
 app.include_router(admin_router.router)
+app.include_router(ops_router.router)
 
 
-# Статика и шаблоны
-BASE_DIR = Path(__file__).resolve().parent
-app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+# Статика: URL с отпечатком (?v=<хэш>, см. app.page_cache.static_url) кэшируются навсегда
+app.mount("/static", CachedStaticFiles(directory=str(STATIC_DIR)), name="static")
+# Слайды партнёров из PDF (app.slides): имена — хэши содержимого
+app.mount(slides.URL_PREFIX, slides.SlideFiles(directory=str(slides.slides_dir()), check_dir=False), name="slides")
+
+
+async def _build_slides() -> None:
+    # Растеризация PDF — в потоке и после старта: ни старт, ни event loop её не ждут
+    try:
+        await asyncio.to_thread(slides.build)
+    except Exception as exc:
+        # Сервер работает и без картинок (слайды показываются текстом) — только считаем
+        slides.SLIDES_BUILD_FAILURES.inc(stage="build", error=type(exc).__name__)
 
 
 @app.on_event("startup")
 async def on_startup() -> None:
     init_db()
-    # seed admin if provided
+    # Состояние игр всех комнат — в память до того, как бот начнёт принимать апдейты
+    rooms.recover()
+    journal.start()
+    loop_monitor.start()
+    backup_scheduler.start()
     import os
+    slides.slides_dir().mkdir(parents=True, exist_ok=True)
+    slides.load()
+    if os.getenv("SLIDES_BUILD_ON_START", "1") in ("1", "true", "True"):
+        app.state._slides_task = asyncio.get_event_loop().create_task(_build_slides())
+    # seed admin if provided
     from app.db import get_connection
     # Режим обслуживания: если включён, бот не поднимаем
     maintenance = os.getenv("MAINTENANCE", "1") in ("1", "true", "True")
@@ -40,22 +68,33 @@ async def on_startup() -> None:
         with get_connection() as conn:
             conn.execute("INSERT OR IGNORE INTO admins(telegram_user_id) VALUES (?)", (seed_admin_id,))
             conn.commit()
-    # Старт Telegram-бота (если есть токен)
+    # Старт Telegram-бота (если есть токен). python-telegram-bot импортируем только здесь:
+    # в режиме обслуживания и на репликах только для зала он не нужен.
     if not maintenance:
+        from app.bot import build_application, run_polling
+
         tg_app = build_application()
         if tg_app is not None:
             loop = asyncio.get_event_loop()
             app.state._tg_task = loop.create_task(run_polling(tg_app))
             app.state.tg_app = tg_app
+    # Последним: первая проверка готовности уже видит задачу бота
+    health_checker.start(app.state)
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
+    health_checker.stop()
+    loop_monitor.stop()
+    backup_scheduler.stop()
     tg_task = getattr(app.state, "_tg_task", None)
     if tg_task is not None:
         tg_task.cancel()
         with contextlib.suppress(Exception):
             await tg_task
+    # Последним — чтобы в журнал попали события остановки
+    journal.stop()
+    rooms.close()
 
 
 @app.get("/")
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import os
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from app import db, journal
+from app.metrics import Counter, Gauge, Histogram, TELEGRAM_SEND_ERRORS, TELEGRAM_SEND_SECONDS
+from app.ratelimit import RateLimiter
+
+
+# Исходящие сообщения Bot API: enqueue() пишет строки в таблицу outbox и сразу возвращает
+# управление, воркер рассылает их параллельно, повторяет сетевые ошибки с экспоненциальной
+# паузой и отмечает доставку. Недоставленное переживает рестарт: воркер продолжит с того же места.
+
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "16"))
+# Bot API пропускает около 30 сообщений в секунду в разные чаты — держимся чуть ниже
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "28"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "200"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "0.5"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "30"))
+# Доставленные и просроченные строки храним для разбора, потом чистим на старте воркера
+OUTBOX_KEEP_SECONDS = float(os.getenv("OUTBOX_KEEP_SECONDS", str(2 * 24 * 3600)))
+
+OUTBOX_PENDING = Gauge("quiz_outbox_pending", "Сообщения в очереди outbox (ещё не доставлены)")
+OUTBOX_SENT_TOTAL = Counter("quiz_outbox_sent_total", "Доставленные сообщения outbox", ["kind"])
+OUTBOX_RETRIES_TOTAL = Counter("quiz_outbox_retries_total", "Повторы отправки после ошибки", ["error"])
+OUTBOX_DROPPED_TOTAL = Counter("quiz_outbox_dropped_total", "Сообщения, снятые без доставки (failed|expired)", ["kind", "status"])
+OUTBOX_DELIVERY_SECONDS = Histogram("quiz_outbox_delivery_seconds", "От постановки в outbox до доставки", ["kind"])
+
+# Ответы Telegram, которые повтор не исправит: бот заблокирован, чат не найден, неверный запрос
+_PERMANENT_ERRORS = ("Forbidden", "BadRequest", "ChatMigrated", "InvalidToken")
+
+
+@dataclass
+class Message:
+    kind: str
+    chat_id: int
+    payload: dict[str, Any]
+    room: str = "main"
+    team_id: int | None = None
+    game_id: int | None = None
+    question_id: int | None = None
+    # Не отправлять после этого момента (unix time): вопрос, пришедший после дедлайна, бесполезен
+    expires_at: float | None = None
+
+
+@functools.lru_cache(maxsize=16)
+def _send_kwargs(payload_json: str) -> dict[str, Any]:
+    # У всех капитанов вопроса payload один — клавиатуру разбираем один раз
+    from telegram import InlineKeyboardMarkup
+
+    kwargs = json.loads(payload_json)
+    markup = kwargs.get("reply_markup")
+    if markup is not None:
+        kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(markup, None)
+    return kwargs
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    # Джиттер, чтобы повторы после общего сбоя не приходили одной пачкой
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Outbox:
+    def __init__(self) -> None:
+        self._conn: sqlite3.Connection | None = None
+        self._bot: Any = None
+        self._task: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._limiter: RateLimiter | None = None
+        self._inflight: set[int] = set()
+        self._sending: set[asyncio.Task] = set()
+        # id строк, снятых expire(), пока они ждали слота в воркере: отправлять их уже не нужно.
+        # По id, а не по вопросу — перезапуск того же вопроса ставит новые строки
+        self._expired: set[int] = set()
+        # kind -> обработчик доставленного сообщения (row, message)
+        self._handlers: dict[str, Callable[[sqlite3.Row, Any], None]] = {}
+        # Вызываются, когда воркер разослал всё, что было к отправке
+        self._idle_hooks: list[Callable[[], None]] = []
+        self._idle: asyncio.Event | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def on_delivered(self, kind: str, handler: Callable[[sqlite3.Row, Any], None]) -> None:
+        self._handlers[kind] = handler
+
+    def on_idle(self, hook: Callable[[], None]) -> None:
+        self._idle_hooks.append(hook)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = db.get_connection()
+        return self._conn
+
+    # ===== Постановка в очередь =====
+
+    def enqueue(self, messages: list[Message]) -> int:
+        """Записать сообщения одной транзакцией и разбудить воркер; возвращает число строк."""
+        if not messages:
+            return 0
+        now = time.time()
+        conn = self._db()
+        try:
+            conn.executemany(
+                """
+                INSERT INTO outbox(room, kind, chat_id, team_id, game_id, question_id, payload_json, next_at, expires_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (m.room, m.kind, m.chat_id, m.team_id, m.game_id, m.question_id,
+                     json.dumps(m.payload, ensure_ascii=False), now, m.expires_at, now)
+                    for m in messages
+                ],
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if self._wake is not None:
+            self._wake.set()
+        return len(messages)
+
+    def expire(self, room: str, question_id: int) -> int:
+        """Вопрос закрыт: снять его недоставленные сообщения (и те, что ждут слота в воркере)."""
+        conn = self._db()
+        ids = [
+            r["id"]
+            for r in conn.execute(
+                "SELECT id FROM outbox WHERE status = 'pending' AND room = ? AND question_id = ?", (room, question_id)
+            )
+        ]
+        conn.executemany("UPDATE outbox SET status = 'expired' WHERE id = ? AND status = 'pending'", [(i,) for i in ids])
+        conn.commit()
+        # Строки, уже взятые воркером, отметит сам _deliver
+        self._expired.update(i for i in ids if i in self._inflight)
+        return len(ids)
+
+    # ===== Воркер =====
+
+    def start(self, bot: Any) -> None:
+        if self.running:
+            return
+        self._bot = bot
+        self._wake = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self._limiter = RateLimiter(OUTBOX_RATE)
+        conn = self._db()
+        conn.execute(
+            "DELETE FROM outbox WHERE status != 'pending' AND created_at < ?", (time.time() - OUTBOX_KEEP_SECONDS,)
+        )
+        conn.commit()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить воркер. Недоставленное остаётся pending и уйдёт после рестарта."""
+        tasks = [t for t in (self._task, *self._sending) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._inflight.clear()
+        self._expired.clear()
+        self._sending.clear()
+        self.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def drain(self) -> None:
+        """Дождаться, пока не останется сообщений к отправке (для бенчмарков и остановки)."""
+        while self.running:
+            self._idle.clear()
+            self._wake.set()
+            await self._idle.wait()
+            due = self._next_due()
+            if due is None:
+                return
+            # Остались только отложенные повторы — ждём их срока
+            await asyncio.sleep(max(0.0, due - time.time()))
+
+    def _next_due(self) -> float | None:
+        row = self._db().execute("SELECT MIN(next_at) FROM outbox WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            conn = self._db()
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_at <= ? ORDER BY id LIMIT ?",
+                (time.time(), OUTBOX_BATCH + len(self._inflight)),
+            ).fetchall()
+            OUTBOX_PENDING.set(conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0])
+            for row in rows:
+                if row["id"] in self._inflight:
+                    continue
+                self._inflight.add(row["id"])
+                task = asyncio.get_running_loop().create_task(self._send(row))
+                self._sending.add(task)
+                task.add_done_callback(self._sent)
+            if not self._inflight:
+                self._became_idle()
+            # Ждём новых сообщений, освобождения слотов или срока ближайшего повтора
+            due = self._next_due() if not self._inflight else None
+            timeout = None if due is None else max(0.0, due - time.time())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _sent(self, task: asyncio.Task) -> None:
+        self._sending.discard(task)
+        if not self._inflight and self._wake is not None:
+            self._wake.set()
+
+    def _became_idle(self) -> None:
+        for hook in self._idle_hooks:
+            try:
+                hook()
+            except Exception:
+                pass
+        self._idle.set()
+
+    def _finish(self, row: sqlite3.Row, status: str, **fields: Any) -> None:
+        sets = ", ".join(f"{k} = ?" for k in ("status", *fields))
+        # Повтор не должен вернуть в очередь строку, которую тем временем снял expire()
+        guard = " AND status = 'pending'" if status == "pending" else ""
+        conn = self._db()
+        conn.execute(f"UPDATE outbox SET {sets} WHERE id = ?{guard}", (status, *fields.values(), row["id"]))
+        conn.commit()
+
+    async def _send(self, row: sqlite3.Row) -> None:
+        try:
+            async with self._slots:
+                await self._deliver(row)
+        finally:
+            self._inflight.discard(row["id"])
+            self._expired.discard(row["id"])
+
+    async def _deliver(self, row: sqlite3.Row) -> None:
+        from telegram.error import RetryAfter
+
+        kind = row["kind"]
+        marks = dict(game_id=row["game_id"], question_id=row["question_id"], team_id=row["team_id"], chat_id=row["chat_id"])
+        if (row["expires_at"] is not None and time.time() >= row["expires_at"]) or row["id"] in self._expired:
+            self._finish(row, "expired")
+            OUTBOX_DROPPED_TOTAL.inc(kind=kind, status="expired")
+            journal.record("delivery_expired", **marks)
+            return
+        attempts = row["attempts"] + 1
+        await self._limiter.acquire()
+        try:
+            with TELEGRAM_SEND_SECONDS.time(method="sendMessage"):
+                msg = await self._bot.send_message(chat_id=row["chat_id"], **_send_kwargs(row["payload_json"]))
+        except RetryAfter as exc:
+            # Просьба сервера подождать — не ошибка сообщения, попытку не засчитываем
+            TELEGRAM_SEND_ERRORS.inc(method="sendMessage", error="RetryAfter")
+            OUTBOX_RETRIES_TOTAL.inc(error="RetryAfter")
+            retry = exc.retry_after
+            delay = retry.total_seconds() if hasattr(retry, "total_seconds") else float(retry)
+            self._limiter.pause(delay)
+            self._finish(row, "pending", next_at=time.time() + delay)
+            return
+        except Exception as exc:
+            error = type(exc).__name__
+            TELEGRAM_SEND_ERRORS.inc(method="sendMessage", error=error)
+            if error in _PERMANENT_ERRORS or attempts >= OUTBOX_MAX_ATTEMPTS:
+                self._finish(row, "failed", attempts=attempts, last_error=f"{error}: {exc}"[:500])
+                OUTBOX_DROPPED_TOTAL.inc(kind=kind, status="failed")
+                journal.record("delivery_failed", **marks, error=error, attempts=attempts)
+                return
+            OUTBOX_RETRIES_TOTAL.inc(error=error)
+            self._finish(
+                row, "pending", attempts=attempts, next_at=time.time() + _backoff(attempts), last_error=f"{error}: {exc}"[:500]
+            )
+            journal.record("delivery_retry", **marks, error=error, attempts=attempts)
+            return
+        now = time.time()
+        self._finish(row, "sent", attempts=attempts, message_id=msg.message_id, sent_at=now)
+        OUTBOX_SENT_TOTAL.inc(kind=kind)
+        OUTBOX_DELIVERY_SECONDS.observe(now - row["created_at"], kind=kind)
+        journal.record("delivery", **marks, attempts=attempts)
+        handler = self._handlers.get(kind)
+        if handler is not None:
+            handler(row, msg)
+
+
+outbox = Outbox()
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # brotli опционален — без него отдаём gzip
+    brotli = None
+
+
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+TEMPLATES_DIR = BASE_DIR / "templates"
+
+# Страницы ревалидируются по ETag; статика с отпечатком в URL кэшируется навсегда
+PAGE_CACHE_CONTROL = "no-cache"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_CACHE_CONTROL = "public, max-age=300"
+
+_fingerprints: dict[str, str] = {}
+
+
+def fingerprint(name: str) -> str:
+    """Короткий хэш содержимого файла из app/static (считается один раз за процесс)."""
+    digest = _fingerprints.get(name)
+    if digest is None:
+        digest = hashlib.sha256((STATIC_DIR / name).read_bytes()).hexdigest()[:12]
+        _fingerprints[name] = digest
+    return digest
+
+
+def static_url(name: str) -> str:
+    return f"/static/{name}?v={fingerprint(name)}"
+
+
+class PrerenderedPage:
+    """Готовые байты страницы: исходные, gzip и (если есть brotli) br, плюс ETag."""
+
+    __slots__ = ("body", "etag", "variants", "media_type")
+
+    def __init__(self, body: bytes, media_type: str = "text/html; charset=utf-8") -> None:
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        self.variants: dict[str, bytes] = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def _pick_encoding(self, accept_encoding: str) -> str | None:
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return None
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": PAGE_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in {tag.strip() for tag in if_none_match.split(",")} or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        encoding = self._pick_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is None:
+            return Response(content=self.body, media_type=self.media_type, headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(content=self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+templates.env.globals["static_url"] = static_url
+_pages: dict[str, PrerenderedPage] = {}
+
+
+def page(name: str) -> PrerenderedPage:
+    """Шаблон без данных запроса рендерится один раз; дальше отдаются готовые байты."""
+    cached = _pages.get(name)
+    if cached is None:
+        cached = PrerenderedPage(templates.get_template(name).render().encode("utf-8"))
+        _pages[name] = cached
+    return cached
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles с долгим кэшем для URL с актуальным отпечатком (?v=<хэш>)."""
+
+    def file_response(self, full_path: os.PathLike, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        version = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("v", [None])[0]
+        name = Path(full_path).relative_to(STATIC_DIR).as_posix() if STATIC_DIR in Path(full_path).parents else None
+        if version and name and version == fingerprint(name):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return response
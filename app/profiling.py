@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import cProfile
+import functools
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter as _Counter, deque
+from typing import Any, Awaitable, Callable
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+# Профилирование «по заявке»: админ взводит захват следующих N HTTP-запросов или
+# Telegram-апдейтов, совпадающих по пути/имени обработчика. Пока ничего не взведено,
+# хуки проверяют один атрибут модуля и сразу передают управление дальше.
+
+PROFILE_BUFFER = int(os.getenv("PROFILE_BUFFER", "20"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+KINDS = ("http", "telegram")
+MODES = ("cprofile", "sample")
+
+
+class ProfileArm:
+    __slots__ = ("kind", "match", "remaining", "mode")
+
+    def __init__(self, kind: str, match: str, count: int, mode: str) -> None:
+        self.kind = kind
+        self.match = match
+        self.remaining = count
+        self.mode = mode
+
+    def as_dict(self) -> dict[str, Any]:
+        return {"kind": self.kind, "match": self.match, "remaining": self.remaining, "mode": self.mode}
+
+
+armed: ProfileArm | None = None
+profiles: deque[dict[str, Any]] = deque(maxlen=PROFILE_BUFFER)
+_ids = itertools.count(1)
+# cProfile в потоке может быть только один — параллельные совпадения пропускаем
+_busy = False
+
+
+def arm(kind: str, match: str, count: int, mode: str) -> ProfileArm:
+    global armed
+    if kind not in KINDS:
+        raise ValueError(f"kind: ожидается одно из {KINDS}")
+    if mode not in MODES:
+        raise ValueError(f"mode: ожидается одно из {MODES}")
+    if count < 1:
+        raise ValueError("count должен быть положительным")
+    armed = ProfileArm(kind, match, count, mode)
+    return armed
+
+
+def disarm() -> None:
+    global armed
+    armed = None
+
+
+def get_profile(profile_id: int) -> dict[str, Any] | None:
+    return next((p for p in profiles if p["id"] == profile_id), None)
+
+
+def _claim(kind: str, target: str) -> ProfileArm | None:
+    global armed
+    current = armed
+    if current is None or _busy or current.kind != kind or current.match not in target:
+        return None
+    current.remaining -= 1
+    if current.remaining <= 0:
+        armed = None
+    return current
+
+
+class _StackSampler:
+    """Сэмплы стека потока event loop в свёрнутом формате (flamegraph: a;b;c N)."""
+
+    def __init__(self, thread_id: int) -> None:
+        self._thread_id = thread_id
+        self._stop = threading.Event()
+        self.counts: _Counter[str] = _Counter()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+
+    def __enter__(self) -> "_StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+async def run_profiled(kind: str, target: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """Выполнить call, сняв профиль, если взведённый захват совпал с kind/target."""
+    global _busy
+    current = _claim(kind, target)
+    if current is None:
+        return await call()
+    _busy = True
+    started = time.time()
+    t0 = time.perf_counter()
+    # Внимание: и cProfile, и сэмплер видят другие задачи, выполнявшиеся на loop во время await
+    prof = cProfile.Profile() if current.mode == "cprofile" else None
+    sampler = _StackSampler(threading.get_ident()) if prof is None else None
+    try:
+        if prof is not None:
+            prof.enable()
+            try:
+                return await call()
+            finally:
+                prof.disable()
+        with sampler:
+            return await call()
+    finally:
+        if prof is not None:
+            prof.create_stats()
+            data = marshal.dumps(prof.stats)
+        else:
+            data = "".join(f"{stack} {n}\n" for stack, n in sampler.counts.most_common()).encode("utf-8")
+        profiles.append({
+            "id": next(_ids),
+            "kind": kind,
+            "target": target,
+            "mode": current.mode,
+            "at": started,
+            "duration_ms": round((time.perf_counter() - t0) * 1000, 2),
+            "data": data,
+        })
+        _busy = False
+
+
+def stats_text(entry: dict[str, Any], limit: int = 40) -> str:
+    """Текстовая сводка cProfile-профиля (топ по cumulative)."""
+    out = io.StringIO()
+    stats = pstats.Stats(stream=out)
+    stats.stats = marshal.loads(entry["data"])
+    stats.get_top_level_stats()
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI-хук для HTTP: без взведённого захвата — одна проверка и прямой вызов приложения."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if armed is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        await run_profiled("http", scope["path"], lambda: self.app(scope, receive, send))
+
+
+def _profiled_callback(callback: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update: Any, context: Any) -> Any:
+        if armed is None:
+            return await callback(update, context)
+        return await run_profiled("telegram", name, lambda: callback(update, context))
+
+    return wrapper
+
+
+def _instrument_handler(handler: Any) -> None:
+    # ConversationHandler — контейнер: оборачиваем вложенные обработчики
+    nested = []
+    for attr in ("entry_points", "fallbacks"):
+        nested += list(getattr(handler, attr, None) or [])
+    for state_handlers in (getattr(handler, "states", None) or {}).values():
+        nested += list(state_handlers)
+    if nested:
+        for inner in nested:
+            _instrument_handler(inner)
+        return
+    callback = getattr(handler, "callback", None)
+    if callback is not None and not getattr(callback, "_profiled", False):
+        wrapped = _profiled_callback(callback)
+        wrapped._profiled = True  # type: ignore[attr-defined]
+        handler.callback = wrapped
+
+
+def instrument_application(application: Any) -> None:
+    """Обернуть все зарегистрированные обработчики telegram.ext.Application."""
+    for group in application.handlers.values():
+        for handler in group:
+            _instrument_handler(handler)
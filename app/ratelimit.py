@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Асинхронный token bucket: не больше rate вызовов в секунду, всплеск до burst.
+
+    Bot API ограничивает рассылку примерно 30 сообщениями в секунду на бота — массовые
+    проходы (снятие клавиатур, рассылки) ждут здесь, а не получают RetryAfter.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None) -> None:
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Сервер попросил подождать (RetryAfter): обнулить запас на это время."""
+        self._tokens = -seconds * self.rate
+        self._updated = time.monotonic()
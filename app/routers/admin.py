@@ -1,52 +1,208 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Query, Request, WebSocket
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from fastapi import HTTPException
 
-from app.routers.hall import broadcast_to_hall
+from app.routers.hall import admin_channel, broadcast_to_hall, prefetch_to_hall, ws_manager
+from app import journal, slides
 from app.db import get_connection
-from app.fixtures import build_default_fixture
+from app.engine import DEFAULT_ROOM, room_name, rooms
+from app.page_cache import page
+from app.scoring import score_teams
 import json
 import csv
 from io import StringIO
 from fastapi import Depends
 from fastapi import Request as FastAPIRequest
-from app.bot import send_question_to_captains
 
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+
+
+def _room(raw: str) -> str:
+    # Все операции админки — в одной комнате (?room=, по умолчанию основная)
+    try:
+        return room_name(raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request):
-    return templates.TemplateResponse("admin.html", {"request": request})
+    return page("admin.html").response(request)
+
+
+@router.get("/admin/loop-traces")
+async def admin_loop_traces():
+    """Последние зависания event loop: обработчик, длительность и стек (новые первыми)."""
+    from app.loop_monitor import monitor
+
+    return {"threshold_ms": monitor.threshold * 1000, "traces": monitor.snapshot()}
+
+
+@router.get("/admin/events")
+async def admin_events(
+    kind: str | None = None,
+    question_id: int | None = None,
+    game_id: int | None = None,
+    after_id: int = 0,
+    limit: int = 500,
+):
+    """Журнал событий игры (app.journal); для постраничного чтения передавайте after_id = последний id."""
+    from app.journal import list_events
+
+    with get_connection() as conn:
+        return list_events(conn, kind, question_id, game_id, after_id, min(limit, 5000))
+
+
+@router.get("/admin/events/timeline/{question_id}")
+async def admin_event_timeline(question_id: int):
+    """Задержки по последнему запуску вопроса: доставка, ответы, стоп, показ в зале (мс от запуска)."""
+    from app.journal import question_timeline
+
+    with get_connection() as conn:
+        timeline = question_timeline(conn, question_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Запусков вопроса в журнале нет")
+    return timeline
+
+
+@router.get("/admin/distribution")
+async def admin_distribution(room: str = DEFAULT_ROOM, question_id: int | None = None):
+    """Распределение ответов по вариантам: текущего вопроса — из памяти, закрытого — последний снимок при закрытии."""
+    # Только существующие комнаты: опрос админки не должен заводить движок под любое имя
+    eng = rooms.find(_room(room))
+    if eng is None:
+        raise HTTPException(status_code=404, detail="Комната не найдена")
+    live = eng.current
+    if live is not None and question_id in (None, live.question_id):
+        return {**live.distribution(), "open": not live.expired()}
+    if question_id is None:
+        raise HTTPException(status_code=404, detail="Вопрос ещё не запускался")
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM question_distributions WHERE question_id=? ORDER BY id DESC LIMIT 1", (question_id,)
+        ).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Распределение для вопроса не сохранено")
+    counts = json.loads(row["counts_json"])
+    return {
+        "question_id": question_id,
+        "labels": [chr(65 + i) for i in range(len(counts))],
+        "counts": counts,
+        "answered": row["answered"],
+        "drafts": json.loads(row["drafts_json"]),
+        "open": False,
+        "closed_at": row["closed_at"],
+    }
+
+
+@router.websocket("/ws/admin")
+async def admin_ws(websocket: WebSocket, room: str = Query(DEFAULT_ROOM)):
+    """Живое распределение ответов комнаты для админки; экран зала этот канал не получает."""
+    try:
+        room = room_name(room)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await ws_manager.connect(websocket, admin_channel(room))
+    try:
+        while True:
+            await websocket.receive_text()
+    except Exception:
+        pass
+    finally:
+        ws_manager.disconnect(websocket)
+
+
+@router.get("/admin/profiling")
+async def admin_profiling_status():
+    """Взведённый захват профилей (если есть) и список снятых профилей без данных."""
+    from app import profiling
+
+    return {
+        "armed": profiling.armed.as_dict() if profiling.armed else None,
+        "profiles": [{k: v for k, v in p.items() if k != "data"} for p in reversed(profiling.profiles)],
+    }
+
+
+@router.post("/admin/profiling")
+async def admin_profiling_arm(payload: dict):
+    """Профилировать следующие N HTTP-запросов/апдейтов бота.
+
+    {"kind": "http"|"telegram", "match": "/admin/final-results"|"on_answer_callback",
+     "count": 1, "mode": "cprofile"|"sample"}
+    """
+    from app import profiling
+
+    try:
+        arm = profiling.arm(
+            str(payload.get("kind", "http")),
+            str(payload.get("match", "")),
+            int(payload.get("count", 1)),
+            str(payload.get("mode", "cprofile")),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "armed": arm.as_dict()}
+
+
+@router.delete("/admin/profiling")
+async def admin_profiling_disarm():
+    from app import profiling
+
+    profiling.disarm()
+    return {"ok": True}
+
+
+@router.get("/admin/profiles/{profile_id}")
+async def admin_profile_download(profile_id: int, text: bool = False):
+    """cProfile — файл .prof (pstats/snakeviz) или ?text=1 для сводки; sample — свёрнутые стеки для flamegraph."""
+    from fastapi.responses import PlainTextResponse, Response
+    from app import profiling
+
+    entry = profiling.get_profile(profile_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    if entry["mode"] == "sample":
+        return PlainTextResponse(entry["data"].decode("utf-8"))
+    if text:
+        return PlainTextResponse(profiling.stats_text(entry))
+    return Response(
+        content=entry["data"],
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.prof"'},
+    )
 
 
 @router.post("/admin/broadcast")
-async def admin_broadcast(payload: dict):
+async def admin_broadcast(payload: dict, room: str = DEFAULT_ROOM):
     # Простая заглушка для рассылки на экран зала
-    await broadcast_to_hall(payload)
+    if payload.get("type") == "slide" and not payload.get("image") and payload.get("text"):
+        # Слайд партнёра по имени — картинкой из кэша, если она есть
+        payload = {**slides.slide_message(payload["text"], int(payload.get("page", 1))), **payload}
+    await broadcast_to_hall(payload, _room(room))
     return {"ok": True}
 
 
 @router.post("/admin/show-final-results")
-async def admin_show_final_results():
+async def admin_show_final_results(room: str = DEFAULT_ROOM):
     """Показать финальные результаты на экране зала."""
-    data = await admin_final_results()
+    room = _room(room)
+    data = await admin_final_results(room)
     results_text = "\n".join([
         f"{r['team']}: {r['total']} очков — {r['level']}"
         for r in data["results"]
     ])
-    await broadcast_to_hall({"type": "results", "text": f"ИТОГИ ВИКТОРИНЫ\n\n{results_text}"})
+    await broadcast_to_hall({"type": "results", "text": f"ИТОГИ ВИКТОРИНЫ\n\n{results_text}"}, room)
     return {"ok": True}
 
 
 @router.post("/admin/load-fixtures")
-async def load_fixtures(payload: dict):
+async def load_fixtures(payload: dict, room: str = DEFAULT_ROOM):
     """Загрузка фикстур вопросов. Ожидает структуру: { game_name, round: 1|2, questions: [...] }"""
+    room = _room(room)
     game_name = payload.get("game_name")
     round_number = payload.get("round")
     questions = payload.get("questions", [])
@@ -54,7 +210,9 @@ async def load_fixtures(payload: dict):
         raise HTTPException(status_code=400, detail="game_name, round, questions обязательны")
 
     with get_connection() as conn:
-        cur = conn.execute("INSERT INTO games(name, status, current_round) VALUES (?, 'active', ?)", (game_name, round_number))
+        cur = conn.execute(
+            "INSERT INTO games(name, status, current_round, room) VALUES (?, 'active', ?, ?)", (game_name, round_number, room)
+        )
         game_id = cur.lastrowid
         cur = conn.execute("INSERT INTO rounds(game_id, number, status) VALUES (?, ?, 'active')", (game_id, round_number))
         round_id = cur.lastrowid
@@ -85,15 +243,24 @@ async def load_fixtures(payload: dict):
             )
             order_index += 1
         conn.commit()
+    eng = rooms.get(room)
+    eng.reload_game()
+    await prefetch_to_hall(eng)
 
     return {"ok": True, "game_id": game_id, "round_id": round_id, "count": len(questions)}
 
 
 @router.post("/admin/load-default")
-async def load_default():
+async def load_default(room: str = DEFAULT_ROOM):
+    # Фикстуры — сотни строк литералов; грузим модуль только по запросу
+    from app.fixtures import build_default_fixture
+
+    room = _room(room)
     data = build_default_fixture()
     with get_connection() as conn:
-        cur = conn.execute("INSERT INTO games(name, status, current_round) VALUES (?, 'active', ?)", (data["game_name"], 1))
+        cur = conn.execute(
+            "INSERT INTO games(name, status, current_round, room) VALUES (?, 'active', ?, ?)", (data["game_name"], 1, room)
+        )
         game_id = cur.lastrowid
         for rnd in data["rounds"]:
             cur = conn.execute("INSERT INTO rounds(game_id, number, status) VALUES (?, ?, 'active')", (game_id, rnd["number"]))
@@ -118,45 +285,22 @@ async def load_default():
                 )
                 order_index += 1
         conn.commit()
+    eng = rooms.get(room)
+    eng.reload_game()
+    await prefetch_to_hall(eng)
     return {"ok": True, "game_id": game_id}
 
 
 @router.get("/admin/score")
-async def admin_score():
-    # Подсчёт: single — 1 балл за правильный; case — сумма весов по выбранным вариантам
+async def admin_score(room: str = DEFAULT_ROOM):
+    # Подсчёт: single — 1 балл за правильный; case/multi — сумма весов по выбранным вариантам
     with get_connection() as conn:
-        rows = conn.execute(
-            """
-            WITH case_points AS (
-                SELECT a.team_id,
-                       SUM(
-                         json_extract(q.scoring_weights_json, '$.' || substr(upper(printf('%c', 65 + json_each.value)), 1))
-                       ) AS pts
-                FROM answers a
-                JOIN questions q ON q.id = a.question_id AND q.type IN ('case','multi')
-                JOIN json_each(COALESCE(a.option_indices_json, '[]'))
-                GROUP BY a.team_id
-            ),
-            single_points AS (
-                SELECT a.team_id,
-                       SUM(CASE WHEN q.type='single' AND a.option_index = q.correct_index THEN 1 ELSE 0 END) AS pts
-                FROM answers a
-                JOIN questions q ON q.id = a.question_id
-                GROUP BY a.team_id
-            )
-            SELECT t.name AS team,
-                   COALESCE(sp.pts,0) + COALESCE(cp.pts,0) AS points
-            FROM teams t
-            LEFT JOIN single_points sp ON sp.team_id = t.id
-            LEFT JOIN case_points cp ON cp.team_id = t.id
-            ORDER BY points DESC, team ASC
-            """
-        ).fetchall()
-    return {"score": [{"team": r["team"], "points": r["points"]} for r in rows]}
+        rows = score_teams(conn, case_types=("case", "multi"), room=_room(room))
+    return {"score": [{"team": r["team"], "points": r["total"]} for r in rows]}
 
 
 @router.get("/admin/export.csv")
-async def admin_export_csv():
+async def admin_export_csv(room: str = DEFAULT_ROOM):
     with get_connection() as conn:
         rows = conn.execute(
             """
@@ -166,8 +310,10 @@ async def admin_export_csv():
             JOIN teams t ON t.id = a.team_id
             JOIN games g ON g.id = a.game_id
             JOIN rounds r ON r.id = q.round_id
+            WHERE g.room = ?
             ORDER BY a.answered_at ASC
-            """
+            """,
+            (_room(room),),
         ).fetchall()
     out = StringIO()
     w = csv.writer(out)
@@ -178,8 +324,9 @@ async def admin_export_csv():
 
 
 @router.post("/admin/partner-question")
-async def partner_question(payload: dict, request: FastAPIRequest):
-    # payload: { slide: "WORKS TEAM", text, options: [..], correct_index }
+async def partner_question(payload: dict, request: FastAPIRequest, room: str = DEFAULT_ROOM):
+    # payload: { slide: "WORKS TEAM", page?: 1, text, options: [..], correct_index }
+    room = _room(room)
     slide = payload.get("slide")
     text = payload.get("text")
     options = payload.get("options")
@@ -187,14 +334,14 @@ async def partner_question(payload: dict, request: FastAPIRequest):
     if not (slide and text and options and isinstance(options, list)):
         raise HTTPException(status_code=400, detail="slide, text, options обязательны")
 
-    # 1) показать слайд на экране зала
-    await broadcast_to_hall({"type": "slide", "text": slide})
+    # 1) показать слайд на экране зала (картинкой из кэша слайдов, если PDF партнёра собран)
+    await broadcast_to_hall(slides.slide_message(slide, int(payload.get("page", 1))), room)
 
-    # 2) создать вопрос сразу после слайда в текущей активной игре
+    # 2) создать вопрос сразу после слайда в текущей активной игре комнаты
     with get_connection() as conn:
-        game = conn.execute("SELECT * FROM games WHERE status='active' ORDER BY id DESC LIMIT 1").fetchone()
+        game = conn.execute("SELECT * FROM games WHERE room=? AND status='active' ORDER BY id DESC LIMIT 1", (room,)).fetchone()
         if not game:
-            cur = conn.execute("INSERT INTO games(name, status, current_round) VALUES ('Partner Game', 'active', 1)")
+            cur = conn.execute("INSERT INTO games(name, status, current_round, room) VALUES ('Partner Game', 'active', 1, ?)", (room,))
             game_id = cur.lastrowid
             cur = conn.execute("INSERT INTO rounds(game_id, number, status) VALUES (?, 1, 'active')", (game_id,))
             round_id = cur.lastrowid
@@ -214,90 +361,39 @@ async def partner_question(payload: dict, request: FastAPIRequest):
             (round_id, order_index, text, json.dumps(options, ensure_ascii=False), correct_index),
         )
         qid = cur.lastrowid
-        conn.execute("UPDATE games SET current_question_id=?, current_question_deadline=datetime('now','+60 seconds') WHERE id=?", (qid, game_id))
         conn.commit()
+    # Новый вопрос (а возможно, и игра) — в движок, запуск — через него же
+    eng = rooms.get(room)
+    eng.reload_game()
+    eng.launch(eng.question(qid))
+    journal.record("question_launch", game_id=eng.game_id, question_id=qid, via="partner")
 
     # 3) разослать капитанам с таймером 60с
     tg_app = request.app.state.tg_app if hasattr(request.app.state, 'tg_app') else None
     if tg_app is None:
         return {"ok": True, "warning": "tg bot disabled"}
-    await send_question_to_captains(game_id, {"id": qid, "text": text, "options": options, "type": "single"}, tg_app.bot)
+    from app.bot import schedule_close, send_question_to_captains
+
+    schedule_close(tg_app.bot, eng)
+    send_question_to_captains(game_id, {"id": qid, "text": text, "options": options, "type": "single"}, room)
     return {"ok": True, "question_id": qid}
 
 
 @router.get("/admin/final-results")
-async def admin_final_results():
-    """Финальная таблица с уровнями по кейсам."""
+async def admin_final_results(room: str = DEFAULT_ROOM):
+    """Финальная таблица с уровнями по кейсам (команды одной комнаты)."""
     with get_connection() as conn:
-        # Подсчёт по кейсам
-        rows = conn.execute(
-            """
-            WITH case_points AS (
-                SELECT a.team_id,
-                       a.question_id,
-                       SUM(
-                         COALESCE(json_extract(q.scoring_weights_json, '$.' || upper(printf('%c', 65 + json_each.value))), 0)
-                       ) AS case_pts,
-                       COUNT(CASE WHEN json_extract(q.scoring_weights_json, '$.' || upper(printf('%c', 65 + json_each.value))) = 0 THEN 1 END) AS zero_count
-                FROM answers a
-                JOIN questions q ON q.id = a.question_id AND q.type = 'case'
-                JOIN json_each(COALESCE(a.option_indices_json, '[]'))
-                GROUP BY a.team_id, a.question_id
-            ),
-            team_case_results AS (
-                SELECT team_id,
-                       SUM(case_pts) AS total_case_pts,
-                       SUM(zero_count) AS total_zeros
-                FROM case_points
-                GROUP BY team_id
-            ),
-            single_points AS (
-                SELECT a.team_id,
-                       COUNT(CASE WHEN q.type='single' AND a.option_index = q.correct_index THEN 1 END) AS correct,
-                       COUNT(CASE WHEN q.type='single' THEN 1 END) AS total
-                FROM answers a
-                JOIN questions q ON q.id = a.question_id
-                GROUP BY a.team_id
-            )
-            SELECT t.name AS team,
-                   COALESCE(sp.correct,0) AS single_correct,
-                   COALESCE(sp.total,0) AS single_total,
-                   COALESCE(tcr.total_case_pts,0) AS case_points,
-                   COALESCE(tcr.total_zeros,0) AS has_zero
-            FROM teams t
-            LEFT JOIN single_points sp ON sp.team_id = t.id
-            LEFT JOIN team_case_results tcr ON tcr.team_id = t.id
-            ORDER BY single_correct + COALESCE(tcr.total_case_pts,0) DESC, team ASC
-            """
-        ).fetchall()
-    
-    results = []
-    for r in rows:
-        single_pts = r["single_correct"]
-        case_pts = r["case_points"]
-        has_zero = r["has_zero"] > 0
-        total = single_pts + case_pts
-        
-        # Определение уровня
-        if has_zero or single_pts == 0:
-            level = "Базовый"
-        elif case_pts >= 4:
-            level = "Супер-профи"
-        elif case_pts >= 3:
-            level = "Продвинутый"
-        elif case_pts >= 1.5:
-            level = "Средний"
-        else:
-            level = "Базовый"
-        
-        results.append({
-            "team": r["team"],
-            "single_correct": single_pts,
-            "single_total": r["single_total"],
-            "case_points": case_pts,
-            "total": total,
-            "level": level
-        })
-    
-    return {"results": results}
-
+        rows = score_teams(conn, case_types=("case",), room=_room(room))
+    return {
+        "results": [
+            {
+                "team": r["team"],
+                "single_correct": r["single_correct"],
+                "single_total": r["single_total"],
+                "case_points": r["case_points"],
+                "total": r["total"],
+                "level": r["level"],
+            }
+            for r in rows
+        ]
+    }
@@ -1,31 +1,64 @@
 from __future__ import annotations
 
+import asyncio
+
 from fastapi import APIRouter, WebSocket, Request, HTTPException, Query
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 import os
 
+from app import journal, slides
+from app.engine import DEFAULT_ROOM, GameEngine, room_name
+from app.page_cache import page
 from app.websocket_manager import WebSocketManager
 
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 ws_manager = WebSocketManager()
 
 HALL_TOKEN = os.getenv("HALL_TOKEN", "quiz2024")
+# Сколько следующих вопросов анонсировать экрану заранее
+HALL_PREFETCH = int(os.getenv("HALL_PREFETCH", "3"))
+
+# Живое распределение ответов — не чаще раза в столько секунд на комнату
+DISTRIBUTION_INTERVAL = float(os.getenv("HALL_DISTRIBUTION_INTERVAL", "1.0"))
+
+# Последний анонс по комнатам — экран, подключившийся позже, получает его сразу
+_last_prefetch: dict[str, dict] = {}
+_distribution_timers: dict[str, asyncio.TimerHandle] = {}
+_distribution_sent: dict[str, float] = {}
+# Ссылки на задачи рассылки, чтобы их не собрал GC
+_distribution_tasks: set[asyncio.Task] = set()
 
 
 @router.get("/hall", response_class=HTMLResponse)
 async def hall_page(request: Request, token: str = Query(None)):
     if token != HALL_TOKEN:
         raise HTTPException(status_code=403, detail="Неверный токен доступа")
-    return templates.TemplateResponse("hall.html", {"request": request})
+    return page("hall.html").response(request)
+
+
+@router.get("/hall/slides")
+async def hall_slides():
+    """Все слайды из кэша — экран прогревает их заранее, чтобы показ не ждал загрузки."""
+    return {"slides": slides.all_urls()}
 
 
 @router.websocket("/ws/hall")
-async def hall_ws(websocket: WebSocket):
-    await ws_manager.connect(websocket)
+async def hall_ws(websocket: WebSocket, room: str = Query(DEFAULT_ROOM), token: str = Query(None)):
+    # Экран видит только свою комнату: /ws/hall?token=…&room=<имя>. Токен — как у /hall:
+    # анонс несёт тексты следующих вопросов
+    if token != HALL_TOKEN:
+        await websocket.close(code=1008)
+        return
+    try:
+        room = room_name(room)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await ws_manager.connect(websocket, room)
     try:
+        if room in _last_prefetch:
+            await websocket.send_json(_last_prefetch[room])
         while True:
             # Держим соединение; сообщений от клиента не ждём
             await websocket.receive_text()
@@ -35,7 +68,62 @@ async def hall_ws(websocket: WebSocket):
         ws_manager.disconnect(websocket)
 
 
-async def broadcast_to_hall(message: dict):
-    await ws_manager.broadcast_json(message)
+async def broadcast_to_hall(message: dict, room: str = DEFAULT_ROOM):
+    sent = await ws_manager.broadcast_json(message, room)
+    journal.record("hall_broadcast", type=message.get("type"), room=room, screens=sent)
+
+
+def admin_channel(room: str) -> str:
+    # Двоеточие в имя комнаты не пропускает room_name — канал админки с экраном не совпадёт
+    return f"admin:{room}"
+
+
+async def broadcast_to_admin(message: dict, room: str = DEFAULT_ROOM) -> int:
+    """Только страницам админки комнаты (/ws/admin): живое распределение залу не показываем."""
+    return await ws_manager.broadcast_json(message, admin_channel(room))
+
+
+async def _send_distribution(room: str, dist: dict) -> None:
+    # Варианты — админке; залу — только число ответивших, иначе открытый вопрос подсказан
+    await broadcast_to_admin({"type": "distribution", "final": False, "text": "Ответы команд", **dist}, room)
+    await broadcast_to_hall({"type": "answered", "question_id": dist["question_id"], "answered": dist["answered"]}, room)
+
+
+async def prefetch_to_hall(eng: GameEngine, n: int = HALL_PREFETCH) -> None:
+    """Анонс следующих вопросов раунда: экран заранее греет картинки и собирает разметку."""
+    items = []
+    for q in eng.upcoming(n):
+        item = {"kind": "question", "id": q.id, "text": q.text, "options": q.options}
+        if q.slide_url:
+            item["image"] = q.slide_url
+        items.append(item)
+    message = {"type": "prefetch", "items": items}
+    if _last_prefetch.get(eng.room) == message:
+        return
+    _last_prefetch[eng.room] = message
+    await broadcast_to_hall(message, eng.room)
+
+
+def distribution_changed(eng: GameEngine) -> None:
+    """Ответ или черновик изменил распределение текущего вопроса комнаты.
+
+    Полное распределение уходит в канал админки, залу — только число ответивших.
+    Рассылка — не чаще DISTRIBUTION_INTERVAL; изменения внутри интервала уходят одним
+    событием в его конце, с последним состоянием счётчиков.
+    """
+    if eng.room in _distribution_timers:
+        return
+    loop = asyncio.get_running_loop()
+    delay = max(0.0, _distribution_sent.get(eng.room, 0.0) + DISTRIBUTION_INTERVAL - loop.time())
 
+    def fire() -> None:
+        _distribution_timers.pop(eng.room, None)
+        live = eng.current
+        if live is None or live.stopped:
+            return  # итог уже разослал close_question
+        _distribution_sent[eng.room] = loop.time()
+        task = loop.create_task(_send_distribution(eng.room, live.distribution()))
+        _distribution_tasks.add(task)
+        task.add_done_callback(_distribution_tasks.discard)
 
+    _distribution_timers[eng.room] = loop.call_later(delay, fire)
@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.health import checker
+from app.metrics import render
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Телеметрия в формате Prometheus."""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: процесс отвечает. Без обращений к БД и боту."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz():
+    """Readiness: БД, задача бота, экраны зала и лаг event loop — из последней фоновой проверки."""
+    ready, body = checker.report()
+    return JSONResponse(body, status_code=200 if ready else 503, headers={"Cache-Control": "no-store"})
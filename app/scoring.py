@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from array import array
+from typing import Any, Iterable
+
+
+# Ключи весов — латинские буквы A..Z: вариант i ↔ chr(65 + i), бит i маски
+MAX_OPTIONS = 26
+# Для чистого Python: таблица сумм по всем маскам строится, пока 2^n разумно
+_TABLE_MAX_OPTIONS = 16
+# Размер пакета для numpy-пути, чтобы матрица битов не разрасталась
+_CHUNK = 65536
+
+LEVEL_BASIC = "Базовый"
+LEVEL_MIDDLE = "Средний"
+LEVEL_ADVANCED = "Продвинутый"
+LEVEL_SUPER = "Супер-профи"
+
+
+def mask_from_indices(indices: Iterable[int]) -> int:
+    mask = 0
+    for idx in indices:
+        idx = int(idx)
+        if 0 <= idx < MAX_OPTIONS:
+            mask |= 1 << idx
+    return mask
+
+
+def indices_from_mask(mask: int) -> set[int]:
+    return {i for i in range(MAX_OPTIONS) if (mask >> i) & 1}
+
+
+class QuestionWeights:
+    """Веса вариантов одного вопроса в числовом виде + маска вариантов с нулевым весом."""
+
+    __slots__ = ("raw", "width", "weights", "zero_mask", "_points", "_zeros")
+
+    def __init__(self, raw: str | None) -> None:
+        self.raw = raw
+        weights = [0.0] * MAX_OPTIONS
+        zero_mask = 0
+        width = 0
+        try:
+            parsed = json.loads(raw) if raw else {}
+        except ValueError:
+            parsed = {}
+        if isinstance(parsed, dict):
+            for code, value in parsed.items():
+                if len(code) != 1 or not ("A" <= code <= "Z"):
+                    continue
+                try:
+                    weight = float(value)
+                except (TypeError, ValueError):
+                    continue
+                idx = ord(code) - 65
+                weights[idx] = weight
+                if weight == 0:
+                    zero_mask |= 1 << idx
+                width = max(width, idx + 1)
+        self.width = width
+        self.weights = array("d", weights[:width])
+        self.zero_mask = zero_mask
+        self._points: array | None = None
+        self._zeros: array | None = None
+
+    def _build_tables(self) -> None:
+        # Сумма весов для каждой маски: table[m] = table[m без младшего бита] + w[младший бит]
+        size = 1 << self.width
+        points = array("d", bytes(8 * size))
+        zeros = array("H", bytes(2 * size))
+        for m in range(1, size):
+            low = m & -m
+            idx = low.bit_length() - 1
+            points[m] = points[m ^ low] + self.weights[idx]
+            zeros[m] = zeros[m ^ low] + ((self.zero_mask >> idx) & 1)
+        self._points, self._zeros = points, zeros
+
+    def score(self, mask: int) -> tuple[float, int]:
+        """Очки и число выбранных вариантов с нулевым весом для маски выбора."""
+        mask &= (1 << self.width) - 1
+        if self.width <= _TABLE_MAX_OPTIONS:
+            if self._points is None:
+                self._build_tables()
+            return self._points[mask], self._zeros[mask]
+        pts = 0.0
+        m = mask
+        while m:
+            low = m & -m
+            pts += self.weights[low.bit_length() - 1]
+            m ^= low
+        return pts, bin(mask & self.zero_mask).count("1")
+
+
+_weights_cache: dict[int, QuestionWeights] = {}
+
+
+def get_weights(question_id: int, raw: str | None) -> QuestionWeights:
+    """Веса вопроса из кэша; пересобираются, только если поменялся JSON."""
+    cached = _weights_cache.get(question_id)
+    if cached is None or cached.raw != raw:
+        cached = QuestionWeights(raw)
+        _weights_cache[question_id] = cached
+    return cached
+
+
+def level_for(single_pts: float, case_pts: float, has_zero: bool) -> str:
+    if has_zero or single_pts == 0:
+        return LEVEL_BASIC
+    if case_pts >= 4:
+        return LEVEL_SUPER
+    if case_pts >= 3:
+        return LEVEL_ADVANCED
+    if case_pts >= 1.5:
+        return LEVEL_MIDDLE
+    return LEVEL_BASIC
+
+
+def _num(value: float) -> float | int:
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+_np: Any = None
+
+
+def load_numpy() -> Any:
+    """numpy импортируется при первом подсчёте, а не при старте приложения; None — если не установлен."""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+        except ImportError:  # numpy опционален — есть запасной путь на array
+            numpy = False
+        _np = numpy
+    return _np or None
+
+
+def _plain_rows(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> list[tuple]:
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur.execute(sql, params).fetchall()
+
+
+def _score_numpy(np, weights: list[QuestionWeights], t_idx, q_idx, masks, n_teams):
+    width = max([w.width for w in weights] + [1])
+    w_matrix = np.zeros((len(weights), width), dtype=np.float64)
+    z_matrix = np.zeros((len(weights), width), dtype=np.float64)
+    for i, w in enumerate(weights):
+        if w.width:
+            w_matrix[i, : w.width] = w.weights
+            z_matrix[i, : w.width] = [(w.zero_mask >> b) & 1 for b in range(w.width)]
+
+    t = np.asarray(t_idx, dtype=np.int64)
+    q = np.asarray(q_idx, dtype=np.int64)
+    m = np.asarray(masks, dtype=np.int64)
+    shifts = np.arange(width, dtype=np.int64)
+    pts = np.empty(len(m), dtype=np.float64)
+    zeros = np.empty(len(m), dtype=np.float64)
+    for start in range(0, len(m), _CHUNK):
+        end = start + _CHUNK
+        bits = ((m[start:end, None] >> shifts) & 1).astype(np.float64)
+        qi = q[start:end]
+        pts[start:end] = np.einsum("ij,ij->i", bits, w_matrix[qi])
+        zeros[start:end] = np.einsum("ij,ij->i", bits, z_matrix[qi])
+
+    return (
+        np.bincount(t, weights=pts, minlength=n_teams).tolist(),
+        np.bincount(t, weights=zeros, minlength=n_teams).tolist(),
+    )
+
+
+def _score_python(weights: list[QuestionWeights], t_idx, q_idx, masks, n_teams):
+    case_pts = [0.0] * n_teams
+    zero_count = [0] * n_teams
+    for t, q, m in zip(t_idx, q_idx, masks):
+        pts, zeros = weights[q].score(m)
+        case_pts[t] += pts
+        zero_count[t] += zeros
+    return case_pts, zero_count
+
+
+def score_teams(
+    conn: sqlite3.Connection,
+    case_types: Iterable[str] = ("case",),
+    use_numpy: bool | None = None,
+    room: str | None = None,
+) -> list[dict[str, Any]]:
+    """Итоги всех команд: одиночные вопросы, веса кейсов за один пакетный проход, уровни.
+
+    case_types — какие типы вопросов считаются по весам (финал — только 'case',
+    текущий счёт — 'case' и 'multi'). room — только команды этой комнаты (None — все).
+    Результат отсортирован по total убыв., затем по имени.
+    """
+    case_types = set(case_types)
+    np = load_numpy() if use_numpy is not False else None
+
+    # Ответы других комнат отсекаются в самом SQL, а не после выборки
+    team_filter, params = ("a.team_id IN (SELECT id FROM teams WHERE room = ?)", (room,)) if room else ("1", ())
+    teams = _plain_rows(conn, "SELECT id, name FROM teams" + (" WHERE room = ?" if room else ""), params)
+    team_pos = {tid: i for i, (tid, _) in enumerate(teams)}
+    n_teams = len(teams)
+
+    # Одиночные — целочисленное сравнение, агрегируем прямо в SQLite
+    single_correct = [0] * n_teams
+    single_total = [0] * n_teams
+    for team_id, correct, total in _plain_rows(
+        conn,
+        """
+        SELECT a.team_id, SUM(a.option_index = q.correct_index), COUNT(*)
+        FROM answers a
+        JOIN questions q ON q.id = a.question_id
+        WHERE COALESCE(q.type, 'single') = 'single' AND """ + team_filter + """
+        GROUP BY a.team_id
+        """,
+        params,
+    ):
+        t = team_pos.get(team_id)
+        if t is not None:
+            single_correct[t] = correct
+            single_total[t] = total
+
+    # Кейсы — маски всех команд и матрица весов, один проход
+    q_pos: dict[int, int] = {}
+    weights: list[QuestionWeights] = []
+    for qid, q_type, raw in _plain_rows(conn, "SELECT id, type, scoring_weights_json FROM questions"):
+        if q_type in case_types:
+            q_pos[qid] = len(weights)
+            weights.append(get_weights(qid, raw))
+
+    t_idx: list[int] = []
+    q_idx: list[int] = []
+    masks: list[int] = []
+    if weights:
+        for team_id, question_id, option_mask in _plain_rows(
+            conn,
+            "SELECT a.team_id, a.question_id, a.option_mask FROM answers a WHERE a.option_mask <> 0 AND " + team_filter,
+            params,
+        ):
+            t = team_pos.get(team_id)
+            q = q_pos.get(question_id)
+            if t is None or q is None:
+                continue
+            t_idx.append(t)
+            q_idx.append(q)
+            masks.append(option_mask)
+
+    if np is not None and t_idx:
+        case_pts, zero_count = _score_numpy(np, weights, t_idx, q_idx, masks, n_teams)
+    else:
+        case_pts, zero_count = _score_python(weights, t_idx, q_idx, masks, n_teams)
+
+    results = []
+    for i, (_, name) in enumerate(teams):
+        sc = _num(single_correct[i])
+        cp = _num(case_pts[i])
+        has_zero = zero_count[i] > 0
+        results.append(
+            {
+                "team": name,
+                "single_correct": sc,
+                "single_total": int(single_total[i]),
+                "case_points": cp,
+                "has_zero": has_zero,
+                "total": _num(sc + cp),
+                "level": level_for(sc, cp, has_zero),
+            }
+        )
+    results.sort(key=lambda r: (-r["total"], r["team"]))
+    return results
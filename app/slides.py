@@ -0,0 +1,206 @@
+"""Кэш слайдов партнёров: PDF из корня репозитория -> готовые JPEG в DATA_DIR/slides.
+
+    python -m app.slides            # собрать изменившиеся PDF (то же делает старт сервера в фоне)
+    python -m app.slides --force    # пересобрать всё
+
+Файлы называются по хэшу содержимого и отдаются из /slides с immutable-кэшем; manifest.json
+связывает партнёра (имя PDF) со списком страниц. Растеризатор — PyMuPDF, если установлен,
+иначе pdftoppm (poppler-utils); без обоих слайды остаются текстовыми, как раньше.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterable
+
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import Response
+from starlette.types import Scope
+
+from app import db
+from app.metrics import Counter, Histogram
+from app.page_cache import IMMUTABLE_CACHE_CONTROL
+
+
+SOURCE_DIR = Path(os.getenv("SLIDES_SOURCE_DIR", str(Path(__file__).resolve().parent.parent)))
+SLIDE_WIDTH = int(os.getenv("SLIDE_WIDTH", "1920"))
+SLIDE_QUALITY = int(os.getenv("SLIDE_QUALITY", "82"))
+URL_PREFIX = "/slides"
+
+# Как партнёр называется в админке -> имя PDF (без .pdf), если они не совпадают
+ALIASES = {
+    "хелло фуди": "hello foody",
+}
+
+SLIDES_RENDER_SECONDS = Histogram("quiz_slides_render_seconds", "Растеризация одного PDF партнёра", ["engine"])
+SLIDES_BUILD_FAILURES = Counter("quiz_slides_build_failures_total", "Ошибки сборки кэша слайдов", ["stage", "error"])
+
+# имя PDF (casefold) -> URL страниц
+_manifest: dict[str, list[str]] = {}
+
+
+def slides_dir() -> Path:
+    # DATA_DIR читаем при вызове: бенчмарки переключают его на лету
+    return db.DATA_DIR / "slides"
+
+
+def _key(name: str) -> str:
+    key = name.strip().casefold()
+    return ALIASES.get(key, key)
+
+
+def slide_urls(name: str) -> list[str]:
+    """URL страниц слайда партнёра; пустой список — картинок нет, показываем текст."""
+    return _manifest.get(_key(name), [])
+
+
+def slide_message(name: str, page: int = 1) -> dict:
+    """Событие зала для слайда: картинка нужной страницы (если есть в кэше) и все страницы — для прогрева."""
+    message = {"type": "slide", "text": name}
+    urls = slide_urls(name)
+    if urls:
+        message["image"] = urls[min(max(page, 1), len(urls)) - 1]
+        message["pages"] = urls
+    return message
+
+
+def all_urls() -> list[str]:
+    return [url for urls in _manifest.values() for url in urls]
+
+
+def load() -> None:
+    path = slides_dir() / "manifest.json"
+    try:
+        sources = json.loads(path.read_text("utf-8"))["sources"]
+    except (OSError, ValueError, KeyError):
+        sources = {}
+    _manifest.clear()
+    _manifest.update({key: entry["pages"] for key, entry in sources.items()})
+
+
+# ===== Растеризация =====
+
+
+def _render_pymupdf(pdf: Path, width: int) -> list[bytes]:
+    try:
+        import pymupdf
+    except ImportError:  # старые версии — только под именем fitz
+        import fitz as pymupdf
+
+    pages = []
+    with pymupdf.open(pdf) as doc:
+        for page in doc:
+            zoom = width / page.rect.width
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            pages.append(pix.tobytes("jpeg", jpg_quality=SLIDE_QUALITY))
+    return pages
+
+
+def _render_pdftoppm(pdf: Path, width: int) -> list[bytes]:
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run(
+            ["pdftoppm", "-jpeg", "-jpegopt", f"quality={SLIDE_QUALITY}", "-scale-to-x", str(width), "-scale-to-y", "-1",
+             str(pdf), str(Path(tmp) / "p")],
+            check=True,
+            capture_output=True,
+        )
+        # p-1.jpg … p-10.jpg: сортируем по номеру, а не по строке
+        files = sorted(Path(tmp).glob("p-*.jpg"), key=lambda f: int(f.stem.rsplit("-", 1)[1]))
+        return [f.read_bytes() for f in files]
+
+
+def rasterizer() -> tuple[str, Callable[[Path, int], list[bytes]]] | None:
+    try:
+        import pymupdf  # noqa: F401
+    except ImportError:
+        try:
+            import fitz  # noqa: F401
+        except ImportError:
+            return ("pdftoppm", _render_pdftoppm) if shutil.which("pdftoppm") else None
+    return "pymupdf", _render_pymupdf
+
+
+def build(pdfs: Iterable[Path] | None = None, width: int = SLIDE_WIDTH, force: bool = False) -> dict[str, int]:
+    """Растеризовать PDF, у которых сменилось содержимое (или все при force); обновить manifest.json.
+
+    Возвращает {имя: число страниц} для пересобранных PDF.
+    """
+    out = slides_dir()
+    out.mkdir(parents=True, exist_ok=True)
+    manifest_path = out / "manifest.json"
+    try:
+        sources = json.loads(manifest_path.read_text("utf-8"))["sources"]
+    except (OSError, ValueError, KeyError):
+        sources = {}
+    render = rasterizer()
+    built: dict[str, int] = {}
+    for pdf in sorted(pdfs if pdfs is not None else SOURCE_DIR.glob("*.pdf")):
+        key = _key(pdf.stem)
+        digest = hashlib.sha256(pdf.read_bytes()).hexdigest()
+        entry = sources.get(key)
+        if not force and entry and entry["sha256"] == digest and entry["width"] == width:
+            continue
+        if render is None:
+            SLIDES_BUILD_FAILURES.inc(stage="rasterizer", error="missing")
+            continue
+        name, fn = render
+        t0 = time.perf_counter()
+        try:
+            pages = fn(pdf, width)
+        except Exception as exc:
+            # Битый PDF не мешает остальным; прежние страницы в манифесте остаются
+            SLIDES_BUILD_FAILURES.inc(stage="render", error=type(exc).__name__)
+            continue
+        SLIDES_RENDER_SECONDS.observe(time.perf_counter() - t0, engine=name)
+        urls = []
+        for data in pages:
+            # Имя = хэш содержимого: файл никогда не меняется, кэш браузера можно не ревалидировать
+            fname = hashlib.sha256(data).hexdigest()[:20] + ".jpg"
+            target = out / fname
+            if not target.exists():
+                tmp = target.with_suffix(".tmp")
+                tmp.write_bytes(data)
+                tmp.replace(target)
+            urls.append(f"{URL_PREFIX}/{fname}")
+        sources[key] = {"file": pdf.name, "sha256": digest, "width": width, "pages": urls}
+        built[pdf.name] = len(urls)
+    if built:
+        tmp = manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"sources": sources}, ensure_ascii=False, indent=1), "utf-8")
+        tmp.replace(manifest_path)
+    load()
+    return built
+
+
+class SlideFiles(StaticFiles):
+    """Картинки слайдов: имя — хэш содержимого, поэтому кэшируются навсегда."""
+
+    def file_response(self, full_path: os.PathLike, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Растеризовать PDF партнёров в кэш слайдов")
+    parser.add_argument("pdf", nargs="*", type=Path, help="PDF-файлы (по умолчанию — все *.pdf из SLIDES_SOURCE_DIR)")
+    parser.add_argument("--width", type=int, default=SLIDE_WIDTH)
+    parser.add_argument("--force", action="store_true", help="пересобрать, даже если PDF не менялся")
+    args = parser.parse_args()
+    if rasterizer() is None:
+        raise SystemExit("Нет растеризатора: установите PyMuPDF (pip install pymupdf) или poppler-utils (pdftoppm)")
+    built = build(args.pdf or None, args.width, args.force)
+    for name, pages in built.items():
+        print(f"{name}: {pages} стр.")
+    print(f"{len(all_urls())} слайдов в {slides_dir()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import importlib.util
+import os
+from typing import Any, Final
+
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+from app.metrics import Counter, Gauge
+
+
+# Два пула к Bot API: long polling держит свой запрос открытым десятки секунд и не должен
+# занимать соединения рассылки вопросов и правок клавиатур (и наоборот).
+TELEGRAM_POOL_SIZE: Final[int] = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_POLL_POOL_SIZE: Final[int] = int(os.getenv("TELEGRAM_POLL_POOL_SIZE", "1"))
+# Сколько запрос ждёт свободного соединения, прежде чем упасть с TimedOut
+TELEGRAM_POOL_TIMEOUT: Final[float] = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "5"))
+TELEGRAM_CONNECT_TIMEOUT: Final[float] = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT: Final[float] = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+TELEGRAM_WRITE_TIMEOUT: Final[float] = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "10"))
+# HTTP/2: все запросы мультиплексируются в немногих keep-alive соединениях; нужен пакет h2
+TELEGRAM_HTTP2: Final[bool] = os.getenv("TELEGRAM_HTTP2", "1") == "1"
+
+TELEGRAM_POOL_CONNECTIONS = Gauge("quiz_telegram_pool_connections", "Размер пула соединений к Bot API", ["pool", "http"])
+TELEGRAM_POOL_IN_FLIGHT = Gauge("quiz_telegram_pool_in_flight", "Запросы к Bot API, занявшие пул (в полёте или в очереди)", ["pool"])
+TELEGRAM_POOL_TIMEOUTS = Counter("quiz_telegram_pool_timeouts_total", "Запросы, не дождавшиеся свободного соединения", ["pool"])
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class PooledRequest(HTTPXRequest):
+    """HTTPXRequest с именем пула: считает занятость и таймауты ожидания соединения.
+
+    in_flight, упёршийся в размер пула (при HTTP/1.1), и рост pool_timeouts — признак,
+    что отправка ждёт соединений, а не Telegram.
+    """
+
+    def __init__(self, pool: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.pool = pool
+
+    async def do_request(self, *args: Any, **kwargs: Any) -> tuple[int, bytes]:
+        TELEGRAM_POOL_IN_FLIGHT.inc(pool=self.pool)
+        try:
+            return await super().do_request(*args, **kwargs)
+        except TimedOut as exc:
+            if "Pool timeout" in str(exc):
+                TELEGRAM_POOL_TIMEOUTS.inc(pool=self.pool)
+            raise
+        finally:
+            TELEGRAM_POOL_IN_FLIGHT.dec(pool=self.pool)
+
+
+def make_request(pool: str, size: int, read_timeout: float = TELEGRAM_READ_TIMEOUT) -> PooledRequest:
+    """Пул к Bot API по настройкам из окружения; без h2 — тихо на HTTP/1.1."""
+    http_version = "2" if TELEGRAM_HTTP2 and http2_available() else "1.1"
+    request = PooledRequest(
+        pool,
+        connection_pool_size=size,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        http_version=http_version,
+    )
+    TELEGRAM_POOL_CONNECTIONS.set(size, pool=pool, http=http_version)
+    return request
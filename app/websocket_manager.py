@@ -4,32 +4,59 @@ from typing import Any, Set
 
 from starlette.websockets import WebSocket, WebSocketState
 
+from app.metrics import WS_BROADCAST_SECONDS, WS_CONNECTIONS
+
 
 class WebSocketManager:
-    """Простой менеджер подключений для broadcast JSON-сообщений всем клиентам."""
+    """Простой менеджер подключений для broadcast JSON-сообщений клиентам.
+
+    Подключения разложены по каналам (комнатам): рассылка идёт только в свой канал.
+    """
 
     def __init__(self) -> None:
-        self._connections: Set[WebSocket] = set()
+        self._channels: dict[str, Set[WebSocket]] = {}
+        self._room_of: dict[WebSocket, str] = {}
+
+    def count(self, channel: str | None = None) -> int:
+        if channel is None:
+            return len(self._room_of)
+        return len(self._channels.get(channel, ()))
+
+    def counts(self) -> dict[str, int]:
+        """Подключения по каналам."""
+        return {channel: len(members) for channel, members in self._channels.items()}
 
-    async def connect(self, websocket: WebSocket) -> None:
+    async def connect(self, websocket: WebSocket, channel: str = "main") -> None:
         await websocket.accept()
-        self._connections.add(websocket)
+        self._channels.setdefault(channel, set()).add(websocket)
+        self._room_of[websocket] = channel
+        WS_CONNECTIONS.set(len(self._room_of))
 
     def disconnect(self, websocket: WebSocket) -> None:
-        if websocket in self._connections:
-            self._connections.remove(websocket)
-
-    async def broadcast_json(self, message: Any) -> None:
+        channel = self._room_of.pop(websocket, None)
+        if channel is None:
+            return
+        members = self._channels.get(channel)
+        if members is not None:
+            members.discard(websocket)
+            if not members:
+                del self._channels[channel]
+        WS_CONNECTIONS.set(len(self._room_of))
+
+    async def broadcast_json(self, message: Any, channel: str = "main") -> int:
+        """Разослать всем в канале; возвращает число экранов, которым сообщение ушло."""
         dead: list[WebSocket] = []
-        for ws in list(self._connections):
-            try:
-                if ws.application_state == WebSocketState.CONNECTED:
-                    await ws.send_json(message)
-                else:
+        sent = 0
+        with WS_BROADCAST_SECONDS.time():
+            for ws in list(self._channels.get(channel, ())):
+                try:
+                    if ws.application_state == WebSocketState.CONNECTED:
+                        await ws.send_json(message)
+                        sent += 1
+                    else:
+                        dead.append(ws)
+                except Exception:
                     dead.append(ws)
-            except Exception:
-                dead.append(ws)
         for ws in dead:
             self.disconnect(ws)
-
-
+        return sent
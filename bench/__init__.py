@@ -0,0 +1 @@
+"""Бенчмарки викторины: `python -m bench.<имя>` из корня репозитория."""
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import math
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import app.db as db
+from app.scoring import mask_from_indices
+
+
+CASE_WEIGHTS = [
+    {"A": 0.5, "B": 1, "C": 0.5, "D": 1.5, "E": 2},
+    {"A": 0, "B": 1, "C": 1.5, "D": 0, "E": 2},
+    {"A": 1, "B": 1.5, "C": 0, "D": 1, "E": 2},
+]
+
+
+def use_db(data_dir: Path) -> Path:
+    """Переключить app.db на отдельный каталог данных (у каждого размера — своя БД)."""
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    db.DATA_DIR = data_dir
+    db.DB_PATH = data_dir / "quiz.db"
+    # Движки комнат держат свои соединения — пусть переоткроют их уже к новой БД
+    from app.engine import rooms
+    from app.outbox import outbox
+
+    rooms.close()
+    outbox.close()
+    return db.DB_PATH
+
+
+def generate_db(data_dir: Path, teams: int, answers: int, case_share: float = 0.25, seed: int = 1) -> Path:
+    """Сгенерировать БД: teams команд, каждая отвечает на все вопросы, всего ~answers ответов."""
+    path = use_db(data_dir)
+    if path.exists():
+        path.unlink()
+    db.init_db()
+    rnd = random.Random(seed)
+    n_questions = max(1, math.ceil(answers / teams))
+    with db.get_connection() as conn:
+        game_id = conn.execute("INSERT INTO games(name, status, current_round) VALUES ('Bench', 'active', 1)").lastrowid
+        round_id = conn.execute("INSERT INTO rounds(game_id, number, status) VALUES (?, 1, 'active')", (game_id,)).lastrowid
+        questions = []
+        for i in range(n_questions):
+            is_case = rnd.random() < case_share
+            weights = CASE_WEIGHTS[i % len(CASE_WEIGHTS)] if is_case else None
+            qid = conn.execute(
+                """
+                INSERT INTO questions(round_id, order_index, text, options_json, correct_index, type, scoring_weights_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    round_id,
+                    i + 1,
+                    f"Вопрос {i + 1}",
+                    json.dumps(["A", "B", "C", "D", "E"] if is_case else ["A", "B", "C", "D"]),
+                    rnd.randrange(4),
+                    "case" if is_case else "single",
+                    json.dumps(weights) if weights else None,
+                ),
+            ).lastrowid
+            questions.append((qid, is_case))
+        conn.executemany("INSERT INTO teams(name) VALUES (?)", [(f"Команда {t:04d}",) for t in range(teams)])
+        team_ids = [r[0] for r in conn.execute("SELECT id FROM teams ORDER BY id")]
+        rows = []
+        for qid, is_case in questions:
+            for t in team_ids:
+                if is_case:
+                    picked = rnd.sample(range(5), rnd.randint(1, 3))
+                    rows.append((game_id, qid, t, 1000 + t, -1, mask_from_indices(picked)))
+                else:
+                    rows.append((game_id, qid, t, 1000 + t, rnd.randrange(4), 0))
+        conn.executemany(
+            "INSERT INTO answers(game_id, question_id, team_id, captain_user_id, option_index, option_mask) VALUES (?,?,?,?,?,?)",
+            rows,
+        )
+        conn.commit()
+    return path
+
+
+def timeit(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> dict[str, float]:
+    """Время вызова fn в миллисекундах: min/median/max по repeat прогонам."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"min_ms": min(samples), "median_ms": statistics.median(samples), "max_ms": max(samples), "rounds": repeat}
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """p50/p95/p99/max по выборке (в тех же единицах, что и samples)."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+    return {"count": len(ordered), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+def write_json(path: str | None, payload: dict[str, Any]) -> None:
+    if not path:
+        return
+    Path(path).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
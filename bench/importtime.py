@@ -0,0 +1,78 @@
+"""Профиль импорта при старте (`python -X importtime`): сколько стоит `import app.main`.
+
+    python -m bench.importtime --top 15 --json bench_importtime.json
+
+По умолчанию MAINTENANCE=1 — как на репликах без бота. Отчёт показывает, какие тяжёлые
+пакеты (telegram, numpy, app.fixtures) попали в старт, хотя не должны.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.common import write_json
+
+
+# Модули, которые должны грузиться лениво
+WATCHED = ("telegram", "numpy", "app.fixtures", "app.bot")
+
+
+def profile_import(module: str, env: dict[str, str]) -> list[dict]:
+    """Запустить чистый интерпретатор с -X importtime и разобрать его stderr."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "depth": (len(name) - len(name.lstrip())) // 2,
+                     "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--maintenance", default="1", help="значение MAINTENANCE для дочернего процесса")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="quiz-import-") as tmp:
+        env = dict(os.environ, MAINTENANCE=args.maintenance, DATA_DIR=tmp)
+        runs = [profile_import(args.module, env) for _ in range(args.repeat)]
+
+    totals = sorted(next(r["cumulative_us"] for r in run if r["module"] == args.module) for run in runs)
+    rows = runs[len(runs) // 2]
+    loaded = {r["module"] for r in rows}
+    watched = {w: any(m == w or m.startswith(w + ".") for m in loaded) for w in WATCHED}
+    top_level = sorted((r for r in rows if r["depth"] == 1), key=lambda r: r["cumulative_us"], reverse=True)
+
+    print(f"import {args.module}: медиана {totals[len(totals) // 2] / 1000:.1f} ms ({len(loaded)} модулей)")
+    for r in top_level[: args.top]:
+        print(f"  {r['cumulative_us'] / 1000:8.1f} ms  {r['module']}")
+    for name, present in watched.items():
+        print(f"  {'загружен' if present else 'не загружен':12} {name}")
+
+    write_json(args.json, {
+        "module": args.module,
+        "maintenance": args.maintenance,
+        "total_us": totals,
+        "modules": len(loaded),
+        "watched": watched,
+        "top": top_level[: args.top],
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""Нагрузочный прогон живой игры без Telegram: ведущий запускает вопросы, капитаны жмут кнопки,
+экраны зала подключены к /ws/hall.
+
+    python -m bench.live_game --teams 200 --questions 6 --viewers 20 --json live_game.json
+
+Через настоящие обработчики app.bot (begin_next_question, on_answer_callback, end_question)
+идут синтетические Update, а Bot подменён заглушкой с задержкой сети. Отчёт: задержка
+подтверждения ответа (p50/p95/p99), время в SQLite на апдейт и ожидание блокировки при
+commit, лаг рассылки на экраны зала, время доставки вопроса капитанам.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import app.db as db
+from bench.common import CASE_WEIGHTS, percentiles, use_db, write_json
+
+
+# ===== Заглушки Telegram =====
+
+
+class FakeUser:
+    def __init__(self, user_id: int, username: str) -> None:
+        self.id = user_id
+        self.username = username
+
+
+class FakeChat:
+    def __init__(self, chat_id: int) -> None:
+        self.id = chat_id
+
+
+class FakeMessage:
+    def __init__(self, bot: "FakeBot", chat_id: int, message_id: int, text: str = "") -> None:
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+
+    async def reply_text(self, text: str, **kwargs: Any) -> "FakeMessage":
+        return await self.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+
+class FakeBot:
+    """Bot с задержкой сети: считает вызовы API и время их выполнения."""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, seed: int) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls: Counter[str] = Counter()
+        self.sent_at: dict[int, float] = {}
+        self._rnd = random.Random(seed)
+        self._next_id = 1
+
+    async def _network(self, method: str) -> None:
+        self.calls[method] += 1
+        delay = max(0.0, self._rnd.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> FakeMessage:
+        await self._network("sendMessage")
+        self._next_id += 1
+        self.sent_at[chat_id] = time.perf_counter()
+        return FakeMessage(self, chat_id, self._next_id, text)
+
+    async def edit_message_reply_markup(self, **kwargs: Any) -> bool:
+        await self._network("editMessageReplyMarkup")
+        return True
+
+    async def edit_message_text(self, text: str, **kwargs: Any) -> bool:
+        await self._network("editMessageText")
+        return True
+
+    async def answer_callback_query(self, **kwargs: Any) -> bool:
+        await self._network("answerCallbackQuery")
+        return True
+
+
+class FakeCallbackQuery:
+    def __init__(self, query_id: str, data: str, user: FakeUser, message: FakeMessage, sample: "TapSample") -> None:
+        self.id = query_id
+        self.data = data
+        self.from_user = user
+        self.message = message
+        self._sample = sample
+
+    async def answer(self, text: str | None = None, show_alert: bool = False, **kwargs: Any) -> bool:
+        if self._sample.ack is None:
+            self._sample.ack = time.perf_counter()
+        return await self.message.bot.answer_callback_query(callback_query_id=self.id, text=text)
+
+    async def edit_message_reply_markup(self, reply_markup: Any = None, **kwargs: Any) -> bool:
+        return await self.message.bot.edit_message_reply_markup(
+            chat_id=self.message.chat_id, message_id=self.message.message_id, reply_markup=reply_markup
+        )
+
+    async def edit_message_text(self, text: str, **kwargs: Any) -> bool:
+        ok = await self.message.bot.edit_message_text(text, chat_id=self.message.chat_id, message_id=self.message.message_id)
+        self._sample.final = time.perf_counter()
+        self._sample.final_text = text
+        return ok
+
+
+class FakeUpdate:
+    def __init__(self, user: FakeUser, chat: FakeChat, message: FakeMessage | None = None,
+                 callback_query: FakeCallbackQuery | None = None) -> None:
+        self.effective_user = user
+        self.effective_chat = chat
+        self.message = message
+        self.callback_query = callback_query
+
+
+class FakeContext:
+    def __init__(self, bot: FakeBot) -> None:
+        self.bot = bot
+        self.args: list[str] = []
+        self.user_data: dict[str, Any] = {}
+
+
+class HallViewer:
+    """Экран зала на /ws/hall: принимает JSON с заданной задержкой сети."""
+
+    def __init__(self, harness: "Harness", latency_ms: float) -> None:
+        from starlette.websockets import WebSocketState
+
+        self.application_state = WebSocketState.CONNECTED
+        self._harness = harness
+        self._latency = latency_ms / 1000
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_json(self, message: Any) -> None:
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        self._harness.on_hall_receive(message)
+
+
+# ===== Замер SQLite =====
+
+
+class TapSample:
+    __slots__ = ("tapped", "ack", "final", "final_text", "db_ms", "commit_ms")
+
+    def __init__(self) -> None:
+        self.tapped = time.perf_counter()
+        self.ack: float | None = None
+        self.final: float | None = None
+        self.final_text = ""
+        self.db_ms = 0.0
+        self.commit_ms = 0.0
+
+
+_current_sample: contextvars.ContextVar[TapSample | None] = contextvars.ContextVar("current_sample", default=None)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3.Connection, который относит время execute/commit к текущему апдейту."""
+
+    def execute(self, *args: Any, **kwargs: Any) -> sqlite3.Cursor:
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            sample = _current_sample.get()
+            if sample is not None:
+                sample.db_ms += (time.perf_counter() - t0) * 1000
+
+    def commit(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            sample = _current_sample.get()
+            if sample is not None:
+                spent = (time.perf_counter() - t0) * 1000
+                sample.db_ms += spent
+                sample.commit_ms += spent
+
+
+def timed_get_connection() -> sqlite3.Connection:
+    db.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db.DB_PATH, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _score_reader(stop: threading.Event) -> None:
+    """Фоновый читатель, как ведущий с открытой админкой: держит SHARED-блокировки."""
+    from app.scoring import score_teams
+
+    while not stop.is_set():
+        with db.get_connection() as conn:
+            score_teams(conn)
+        time.sleep(0.05)
+
+
+# ===== Прогон =====
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.bot = FakeBot(args.tg_latency_ms, args.tg_jitter_ms, args.seed)
+        self.ctx = FakeContext(self.bot)
+        self.host = FakeUser(1, "host")
+        self.host_chat = FakeChat(1)
+        self.captains: list[tuple[FakeUser, FakeChat]] = []
+        self.taps: list[TapSample] = []
+        self.errors: Counter[str] = Counter()
+        self.broadcast_lag_ms: list[float] = []
+        self.delivery_ms: list[float] = []
+        self.launch_ms: list[float] = []
+        self._broadcast_t0: float | None = None
+        self._updates = asyncio.Semaphore(args.concurrent_updates)
+        self._query_seq = 0
+
+    def seed(self, data_dir: Path) -> None:
+        use_db(data_dir)
+        db.init_db()
+        with db.get_connection() as conn:
+            game_id = conn.execute("INSERT INTO games(name, status, current_round) VALUES ('Load test', 'active', 1)").lastrowid
+            round_id = conn.execute("INSERT INTO rounds(game_id, number, status) VALUES (?, 1, 'active')", (game_id,)).lastrowid
+            for i in range(self.args.questions):
+                is_case = i % max(1, round(1 / self.args.case_share)) == 0 if self.args.case_share else False
+                conn.execute(
+                    """
+                    INSERT INTO questions(round_id, order_index, text, options_json, correct_index, type, scoring_weights_json)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        round_id,
+                        i + 1,
+                        f"Вопрос {i + 1}",
+                        json.dumps(["A. да", "B. нет", "C. может быть", "D. не знаю", "E. все сразу"][: 5 if is_case else 4]),
+                        self.rnd.randrange(4),
+                        "case" if is_case else "single",
+                        json.dumps(CASE_WEIGHTS[i % len(CASE_WEIGHTS)]) if is_case else None,
+                    ),
+                )
+            conn.execute("INSERT INTO admins(telegram_user_id, username) VALUES (?, ?)", (self.host.id, self.host.username))
+            for t in range(self.args.teams):
+                team_id = conn.execute("INSERT INTO teams(name) VALUES (?)", (f"Команда {t:04d}",)).lastrowid
+                user_id = chat_id = 10_000 + t
+                conn.execute(
+                    "INSERT INTO captains(telegram_user_id, username, team_id, chat_id) VALUES (?, ?, ?, ?)",
+                    (user_id, f"cap{t}", team_id, chat_id),
+                )
+                self.captains.append((FakeUser(user_id, f"cap{t}"), FakeChat(chat_id)))
+            conn.commit()
+
+    def on_hall_receive(self, message: Any) -> None:
+        if self._broadcast_t0 is not None:
+            self.broadcast_lag_ms.append((time.perf_counter() - self._broadcast_t0) * 1000)
+
+    def attach_hall(self) -> None:
+        from app.routers import hall
+
+        manager = hall.ws_manager
+        original = manager.broadcast_json
+
+        async def timed_broadcast(message: Any, channel: str = "main") -> int:
+            self._broadcast_t0 = time.perf_counter()
+            try:
+                return await original(message, channel)
+            finally:
+                self._broadcast_t0 = None
+
+        manager.broadcast_json = timed_broadcast  # type: ignore[method-assign]
+        loop = asyncio.get_running_loop()
+        for _ in range(self.args.viewers):
+            loop.create_task(manager.connect(HallViewer(self, self.args.ws_latency_ms)))
+
+    def _host_update(self) -> FakeUpdate:
+        return FakeUpdate(self.host, self.host_chat, message=FakeMessage(self.bot, self.host_chat.id, 0))
+
+    async def _tap(self, user: FakeUser, chat: FakeChat, payload: dict) -> None:
+        from app import bot
+
+        sample = TapSample()
+        self.taps.append(sample)
+        self._query_seq += 1
+        query = FakeCallbackQuery(str(self._query_seq), json.dumps(payload), user, FakeMessage(self.bot, chat.id, 0), sample)
+        update = FakeUpdate(user, chat, callback_query=query)
+        async with self._updates:
+            token = _current_sample.set(sample)
+            try:
+                await bot.on_answer_callback(update, self.ctx)
+            except Exception as exc:  # считаем, но не роняем прогон
+                self.errors[type(exc).__name__] += 1
+            finally:
+                _current_sample.reset(token)
+
+    async def _captain(self, user: FakeUser, chat: FakeChat, qid: int, q_type: str, n_options: int) -> None:
+        await asyncio.sleep(self.rnd.uniform(0, self.args.answer_window))
+        if q_type == "single":
+            taps = [{"qid": qid, "opt": self.rnd.randrange(n_options)}]
+        else:
+            picks = self.rnd.sample(range(n_options), self.rnd.randint(1, min(self.args.toggles, n_options)))
+            taps = [{"qid": qid, "opt": p} for p in picks] + [{"qid": qid, "done": True}]
+        for payload in taps:
+            await self._tap(user, chat, payload)
+            if self.rnd.random() < self.args.double_tap:
+                await self._tap(user, chat, payload)
+            await asyncio.sleep(1 / self.args.tap_rate)
+
+    async def run_question(self) -> None:
+        from app import bot
+        from app.outbox import outbox
+
+        launch = time.perf_counter()
+        await bot.begin_next_question(self._host_update(), self.ctx)
+        self.launch_ms.append((time.perf_counter() - launch) * 1000)
+        # Рассылка идёт из outbox после ответа ведущему — дожидаемся её, чтобы замерить доставку
+        await outbox.drain()
+        self.delivery_ms += [(t - launch) * 1000 for t in self.bot.sent_at.values() if t >= launch]
+
+        with db.get_connection() as conn:
+            game = conn.execute("SELECT current_question_id FROM games WHERE status='active' ORDER BY id DESC LIMIT 1").fetchone()
+            q = conn.execute("SELECT id, type, options_json FROM questions WHERE id=?", (game["current_question_id"],)).fetchone()
+        n_options = len(json.loads(q["options_json"]))
+        await asyncio.gather(*(self._captain(u, c, q["id"], q["type"], n_options) for u, c in self.captains))
+        await bot.end_question(self._host_update(), self.ctx)
+
+    async def run(self) -> None:
+        from app import bot
+        from app.engine import rooms
+        from app.journal import journal
+        from app.outbox import outbox
+
+        bot.get_connection = timed_get_connection
+        # Движок открывает соединение через app.db — тоже с замером; состояние игры — в память
+        db.get_connection = timed_get_connection
+        rooms.recover()
+        # Журнал включён, как в проде: его стоимость — часть пути ответа
+        journal.start()
+        outbox.start(self.bot)
+        self.attach_hall()
+        await asyncio.sleep(0)
+        try:
+            for _ in range(self.args.questions):
+                await self.run_question()
+                await asyncio.sleep(self.args.pause)
+        finally:
+            await outbox.stop()
+            journal.stop()
+
+    def report(self) -> dict[str, Any]:
+        from app.metrics import CALLBACK_DEDUPED_TOTAL, KEYBOARD_EDITS_SKIPPED_TOTAL
+
+        ack = [(s.ack - s.tapped) * 1000 for s in self.taps if s.ack is not None]
+        final = [(s.final - s.tapped) * 1000 for s in self.taps if s.final is not None]
+        return {
+            "answer_ack_ms": percentiles(ack),
+            "answer_final_ms": percentiles(final),
+            "db_ms_per_update": percentiles([s.db_ms for s in self.taps]),
+            "db_commit_wait_ms": percentiles([s.commit_ms for s in self.taps if s.commit_ms]),
+            "broadcast_lag_ms": percentiles(self.broadcast_lag_ms),
+            "question_delivery_ms": percentiles(self.delivery_ms),
+            "question_launch_ms": percentiles(self.launch_ms),
+            "updates": len(self.taps),
+            "final_texts": dict(Counter(s.final_text for s in self.taps if s.final_text)),
+            "telegram_calls": dict(self.bot.calls),
+            # Нажатия, отсечённые дедупликацией до движка и Bot API
+            "deduped": {r: int(CALLBACK_DEDUPED_TOTAL.value(reason=r)) for r in ("redelivery", "double_tap", "answered")},
+            # Перерисовки черновика, склеенные или пропущенные без вызова Bot API
+            "keyboard_edits_skipped": {r: int(KEYBOARD_EDITS_SKIPPED_TOTAL.value(reason=r)) for r in ("superseded", "unchanged")},
+            "errors": dict(self.errors),
+        }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--questions", type=int, default=4)
+    parser.add_argument("--case-share", type=float, default=0.25, help="доля кейсов среди вопросов")
+    parser.add_argument("--viewers", type=int, default=10, help="экранов зала на /ws/hall")
+    parser.add_argument("--answer-window", type=float, default=5.0, help="за сколько секунд отвечают все команды")
+    parser.add_argument("--tap-rate", type=float, default=5.0, help="нажатий в секунду у одного капитана (кейсы)")
+    parser.add_argument("--toggles", type=int, default=3, help="максимум вариантов, отмечаемых в кейсе")
+    parser.add_argument("--double-tap", type=float, default=0.1, help="вероятность повторного нажатия")
+    parser.add_argument("--concurrent-updates", type=int, default=1, help="как Application.concurrent_updates (1 — по умолчанию в PTB)")
+    parser.add_argument("--tg-latency-ms", type=float, default=40.0)
+    parser.add_argument("--tg-jitter-ms", type=float, default=15.0)
+    parser.add_argument("--ws-latency-ms", type=float, default=1.0)
+    parser.add_argument("--score-readers", type=int, default=0, help="фоновых потоков, считающих счёт (конкуренция за БД)")
+    parser.add_argument("--pause", type=float, default=0.5, help="пауза между вопросами, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+
+    harness = Harness(args)
+    stop = threading.Event()
+    with tempfile.TemporaryDirectory(prefix="quiz-live-") as tmp:
+        harness.seed(Path(tmp))
+        readers = [threading.Thread(target=_score_reader, args=(stop,), daemon=True) for _ in range(args.score_readers)]
+        for t in readers:
+            t.start()
+        started = time.perf_counter()
+        try:
+            asyncio.run(harness.run())
+        finally:
+            stop.set()
+            for t in readers:
+                t.join()
+        elapsed = time.perf_counter() - started
+
+    result = harness.report()
+    result["elapsed_s"] = elapsed
+    result["config"] = vars(args)
+    result["revision"] = _git_revision()
+
+    for key in ("answer_ack_ms", "answer_final_ms", "db_ms_per_update", "db_commit_wait_ms", "broadcast_lag_ms", "question_delivery_ms"):
+        p = result[key]
+        if p.get("count"):
+            print(f"{key:22} p50={p['p50']:8.2f}  p95={p['p95']:8.2f}  p99={p['p99']:8.2f}  max={p['max']:8.2f}  n={p['count']}")
+    print(f"updates={result['updates']}  telegram={result['telegram_calls']}  deduped={result['deduped']}  skipped={result['keyboard_edits_skipped']}  errors={result['errors'] or 0}  {elapsed:.1f}s")
+    write_json(args.json, result)
+
+
+if __name__ == "__main__":
+    main()
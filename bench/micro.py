@@ -0,0 +1,153 @@
+"""Микро-бенчмарки горячих запросов на сгенерированных БД разного размера.
+
+    python -m bench.micro                                  # 10/100/1000 команд, 10k/100k/1M ответов
+    python -m bench.micro --size 100:100000 --only admin_score --json micro.json
+    python -m bench.micro --compare micro.json             # упасть, если что-то стало медленнее
+
+Размер задаётся как команды:ответы. БД кэшируются в --cache-dir, чтобы не генерировать
+1M ответов на каждый прогон.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable
+
+from bench.common import generate_db, timeit, use_db, write_json
+
+
+DEFAULT_SIZES = ["10:10000", "100:100000", "1000:1000000"]
+
+# name -> (фабрика вызова, меняет ли БД)
+BENCHMARKS: dict[str, tuple[Callable[[], Callable[[], Any]], bool]] = {}
+
+
+def bench(name: str, mutates: bool = False):
+    def register(factory: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = (factory, mutates)
+        return factory
+
+    return register
+
+
+def _sync(coro_fn: Callable[[], Any]) -> Callable[[], Any]:
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(coro_fn())
+
+
+@bench("admin_score")
+def _admin_score():
+    from app.routers import admin
+
+    return _sync(admin.admin_score)
+
+
+@bench("admin_final_results")
+def _admin_final_results():
+    from app.routers import admin
+
+    return _sync(admin.admin_final_results)
+
+
+@bench("admin_export_csv")
+def _admin_export_csv():
+    from app.routers import admin
+
+    return _sync(admin.admin_export_csv)
+
+
+@bench("bot_score_query")
+def _bot_score_query():
+    from app import bot
+    from app.db import get_connection
+    from app.engine import DEFAULT_ROOM
+
+    def run():
+        with get_connection() as conn:
+            return bot._score_rows(conn, DEFAULT_ROOM)
+
+    return run
+
+
+@bench("build_default_fixture")
+def _build_default_fixture():
+    from app.fixtures import build_default_fixture
+
+    return build_default_fixture
+
+
+@bench("load_default", mutates=True)
+def _load_default():
+    from app.routers import admin
+
+    return _sync(admin.load_default)
+
+
+def _parse_size(raw: str) -> tuple[int, int]:
+    teams, answers = raw.split(":")
+    return int(teams), int(answers)
+
+
+def _compare(baseline_path: str, report: dict[str, Any], threshold: float) -> list[str]:
+    baseline = {(r["size"], r["name"]): r for r in json.loads(Path(baseline_path).read_text(encoding="utf-8"))["results"]}
+    regressions = []
+    for r in report["results"]:
+        old = baseline.get((r["size"], r["name"]))
+        if old and r["min_ms"] > old["min_ms"] * (1 + threshold):
+            regressions.append(f"{r['size']:>14} {r['name']:24} {old['min_ms']:9.2f} -> {r['min_ms']:9.2f} ms")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", action="append", help="команды:ответы, можно несколько раз")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="запустить только выбранные")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cache-dir", help="где хранить сгенерированные БД (по умолчанию — временный каталог)")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление min_ms (доля)")
+    args = parser.parse_args()
+
+    names = args.only or list(BENCHMARKS)
+    # Меняющие БД — в конце: после них активна копия, а не исходная БД
+    names.sort(key=lambda n: BENCHMARKS[n][1])
+    report: dict[str, Any] = {"results": []}
+    with tempfile.TemporaryDirectory(prefix="quiz-micro-") as tmp:
+        cache = Path(args.cache_dir or tmp)
+        for raw in args.size or DEFAULT_SIZES:
+            teams, answers = _parse_size(raw)
+            data_dir = cache / f"t{teams}_a{answers}"
+            if (data_dir / "quiz.db").exists() and args.cache_dir:
+                use_db(data_dir)
+            else:
+                generate_db(data_dir, teams, answers)
+            for name in names:
+                factory, mutates = BENCHMARKS[name]
+                if mutates:
+                    # Меняющие БД гоняем на копии, чтобы кэш оставался исходным
+                    scratch = Path(tmp) / "scratch"
+                    scratch.mkdir(exist_ok=True)
+                    shutil.copyfile(data_dir / "quiz.db", scratch / "quiz.db")
+                    use_db(scratch)
+                stats = timeit(factory(), repeat=args.repeat)
+                report["results"].append({"size": raw, "name": name, **stats})
+                print(f"{raw:>14} {name:24} min={stats['min_ms']:9.2f}  median={stats['median_ms']:9.2f} ms")
+
+    write_json(args.json, report)
+    if args.compare:
+        regressions = _compare(args.compare, report, args.threshold)
+        if regressions:
+            print(f"Замедление больше {args.threshold:.0%}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print("Регрессий нет.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Сравнение подсчёта итогов: прежний SQL (json_each + json_extract) против app.scoring.
+
+    python -m bench.scoring --teams 100 --answers 10000 --answers 100000 --json bench_scoring.json
+"""
+from __future__ import annotations
+
+import argparse
+import tempfile
+from pathlib import Path
+
+from app.db import get_connection
+from app.scoring import level_for, load_numpy, score_teams
+from bench.common import generate_db, timeit, write_json
+
+
+# Запрос, которым /admin/final-results считал итоги до app.scoring. В оригинале буква
+# получалась через printf('%c', 65 + value), но в SQLite %c берёт первый символ
+# строки ("6"), и веса кейсов не находились; здесь — char(), как и задумывалось.
+# JSON выборов теперь берётся из представления answers_json (schema v8).
+LEGACY_FINAL_RESULTS_SQL = """
+WITH case_points AS (
+    SELECT a.team_id,
+           a.question_id,
+           SUM(
+             COALESCE(json_extract(q.scoring_weights_json, '$.' || char(65 + json_each.value)), 0)
+           ) AS case_pts,
+           COUNT(CASE WHEN json_extract(q.scoring_weights_json, '$.' || char(65 + json_each.value)) = 0 THEN 1 END) AS zero_count
+    FROM answers_json a
+    JOIN questions q ON q.id = a.question_id AND q.type = 'case'
+    JOIN json_each(COALESCE(a.option_indices_json, '[]'))
+    GROUP BY a.team_id, a.question_id
+),
+team_case_results AS (
+    SELECT team_id,
+           SUM(case_pts) AS total_case_pts,
+           SUM(zero_count) AS total_zeros
+    FROM case_points
+    GROUP BY team_id
+),
+single_points AS (
+    SELECT a.team_id,
+           COUNT(CASE WHEN q.type='single' AND a.option_index = q.correct_index THEN 1 END) AS correct,
+           COUNT(CASE WHEN q.type='single' THEN 1 END) AS total
+    FROM answers a
+    JOIN questions q ON q.id = a.question_id
+    GROUP BY a.team_id
+)
+SELECT t.name AS team,
+       COALESCE(sp.correct,0) AS single_correct,
+       COALESCE(sp.total,0) AS single_total,
+       COALESCE(tcr.total_case_pts,0) AS case_points,
+       COALESCE(tcr.total_zeros,0) AS has_zero
+FROM teams t
+LEFT JOIN single_points sp ON sp.team_id = t.id
+LEFT JOIN team_case_results tcr ON tcr.team_id = t.id
+ORDER BY single_correct + COALESCE(tcr.total_case_pts,0) DESC, team ASC
+"""
+
+
+def legacy_final_results() -> list[dict]:
+    with get_connection() as conn:
+        rows = conn.execute(LEGACY_FINAL_RESULTS_SQL).fetchall()
+    out = []
+    for r in rows:
+        has_zero = r["has_zero"] > 0
+        out.append({
+            "team": r["team"],
+            "total": r["single_correct"] + r["case_points"],
+            "level": level_for(r["single_correct"], r["case_points"], has_zero),
+        })
+    return out
+
+
+def engine_final_results(use_numpy: bool) -> list[dict]:
+    with get_connection() as conn:
+        return score_teams(conn, case_types=("case",), use_numpy=use_numpy)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--answers", type=int, action="append", help="можно указать несколько раз (по умолчанию 10000)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+
+    np = load_numpy()
+    report = {"teams": args.teams, "numpy": np is not None, "runs": []}
+    with tempfile.TemporaryDirectory(prefix="quiz-bench-") as tmp:
+        for n_answers in args.answers or [10_000]:
+            generate_db(Path(tmp) / f"a{n_answers}", args.teams, n_answers)
+            legacy = legacy_final_results()
+            engine = engine_final_results(use_numpy=False)
+            mismatch = [
+                (a["team"], a["total"], b["total"])
+                for a, b in zip(legacy, engine)
+                if a["team"] != b["team"] or abs(a["total"] - b["total"]) > 1e-9 or a["level"] != b["level"]
+            ]
+            run = {
+                "answers": n_answers,
+                "sql": timeit(legacy_final_results, repeat=args.repeat),
+                "python": timeit(lambda: engine_final_results(False), repeat=args.repeat),
+                "mismatches": len(mismatch),
+            }
+            if np is not None:
+                run["numpy"] = timeit(lambda: engine_final_results(True), repeat=args.repeat)
+            report["runs"].append(run)
+            line = f"answers={n_answers:>9}  sql={run['sql']['median_ms']:9.1f} ms  python={run['python']['median_ms']:9.1f} ms"
+            if "numpy" in run:
+                line += f"  numpy={run['numpy']['median_ms']:9.1f} ms"
+            print(line + (f"  MISMATCH={len(mismatch)}" if mismatch else ""))
+    write_json(args.json, report)
+
+
+if __name__ == "__main__":
+    main()
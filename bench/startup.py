@@ -0,0 +1,77 @@
+"""Холодный старт: init_db на пустой БД, на актуальной схеме и при гонке нескольких воркеров.
+
+    python -m bench.startup --workers 4 --json bench_startup.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from bench.common import write_json
+
+
+# Дочерний процесс: как отдельный воркер uvicorn — свежий интерпретатор, один вызов init_db
+_CHILD = """
+import json, time
+t0 = time.perf_counter()
+import app.db as db
+t1 = time.perf_counter()
+db.init_db()
+t2 = time.perf_counter()
+conn = db.get_connection()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "init_db_ms": (t2 - t1) * 1000, "version": db._schema_version(conn)}))
+"""
+
+
+def _spawn(data_dir: Path) -> subprocess.Popen:
+    env = dict(os.environ, DATA_DIR=str(data_dir))
+    return subprocess.Popen([sys.executable, "-c", _CHILD], env=env, stdout=subprocess.PIPE, text=True)
+
+
+def _collect(procs: list[subprocess.Popen]) -> list[dict]:
+    out = []
+    for p in procs:
+        stdout, _ = p.communicate()
+        if p.returncode != 0:
+            raise SystemExit(f"воркер завершился с кодом {p.returncode}")
+        out.append(json.loads(stdout))
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+
+    report: dict = {"fresh": [], "current": [], "race": []}
+    with tempfile.TemporaryDirectory(prefix="quiz-startup-") as tmp:
+        for i in range(args.repeat):
+            data_dir = Path(tmp) / f"fresh{i}"
+            report["fresh"] += _collect([_spawn(data_dir)])
+            report["current"] += _collect([_spawn(data_dir)])
+            race_dir = Path(tmp) / f"race{i}"
+            report["race"].append(_collect([_spawn(race_dir) for _ in range(args.workers)]))
+
+    def med(values: list[float]) -> float:
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    fresh = med([r["init_db_ms"] for r in report["fresh"]])
+    current = med([r["init_db_ms"] for r in report["current"]])
+    race = med([max(r["init_db_ms"] for r in run) for run in report["race"]])
+    versions = {r["version"] for run in report["race"] for r in run}
+    print(f"init_db: пустая БД {fresh:.2f} ms, актуальная схема {current:.2f} ms")
+    print(f"{args.workers} воркера одновременно: самый медленный {race:.2f} ms, версии схемы {sorted(versions)}")
+    report["summary"] = {"fresh_ms": fresh, "current_ms": current, "race_max_ms": race, "workers": args.workers}
+    write_json(args.json, report)
+
+
+if __name__ == "__main__":
+    main()